@@ -0,0 +1,130 @@
+"""Benchmark of the CPU inference settings of the AI models.
+
+For every model and precision, reports the load time, the time per document
+(or per title for the keyword model) and the agreement of the answers with
+fp32, which is the reference. Agreement is the fraction of identical answers
+for the analyzers and the mean overlap (Jaccard) of the keyword sets for
+T5Derivative. With --truth, the title accuracy against known titles is
+reported too.
+
+Usage:
+	python benchmarks/cpu_inference.py path/to/pdfs --threads 8
+	python benchmarks/cpu_inference.py path/to/pdfs --models donut --precisions fp32 int8
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+from smartfilelibrary.analyzers.basedocumentanalyzer import render_frontpage
+from smartfilelibrary.analyzers.donut_base_finetuned import DonutAnalyzer
+from smartfilelibrary.analyzers.moondream2 import Moondream2
+from smartfilelibrary.keywordinference.t5derivative import T5Derivative
+from smartfilelibrary.inferencemode import PRECISIONS, set_threads
+from smartfilelibrary.utilities import _get_keywords
+
+
+def _normalize(answer) -> str:
+	return " ".join(str(answer).lower().split())
+
+
+def run_analyzer(cls, documents : list, precision : str, batchsize : int) -> tuple:
+	"""Load the analyzer and analyze all documents. Returns the load time,
+	the analysis time and the results."""
+	t0 = time.perf_counter()
+	analyzer = cls(precision=precision)
+	analyzer.load()
+	t1 = time.perf_counter()
+	results = []
+	for start in range(0, len(documents), batchsize):
+		results.extend(analyzer.analyze_batch(documents[start : start + batchsize]))
+	return t1 - t0, time.perf_counter() - t1, results
+
+
+def run_keywords(titles : list, precision : str, batchsize : int) -> tuple:
+	"""Load T5Derivative without cache and get the keywords of all titles.
+	Returns the load time, the generation time and the keywords per title."""
+	t0 = time.perf_counter()
+	model = T5Derivative(batchsize=batchsize, cache=None, precision=precision)
+	model.load()
+	t1 = time.perf_counter()
+	results = _get_keywords(titles, model.get_keywords_batch, 0)
+	return t1 - t0, time.perf_counter() - t1, results
+
+
+def agreement(model : str, results : list, reference : list) -> float:
+	"""Agreement of results with the fp32 reference, between 0 and 1."""
+	if model == "t5":
+		scores = []
+		for kws, ref in zip(results, reference):
+			kws, ref = {_normalize(k) for k in kws}, {_normalize(k) for k in ref}
+			scores.append(len(kws & ref) / len(kws | ref) if kws | ref else 1.0)
+		return sum(scores) / len(scores)
+	same = sum(_normalize(r["title"]) == _normalize(f["title"]) and
+		_normalize(r["publisher"]) == _normalize(f["publisher"]) for r, f in zip(results, reference))
+	return same / len(results)
+
+
+def title_accuracy(documents : list, results : list, truth : dict):
+	"""Fraction of correct titles among the documents in truth, None if there are none."""
+	hits = [_normalize(r["title"]) == _normalize(truth[os.path.basename(d["path"])])
+		for d, r in zip(documents, results) if os.path.basename(d["path"]) in truth]
+	return sum(hits) / len(hits) if hits else None
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+	parser.add_argument("directory", help="directory with PDF files")
+	parser.add_argument("--models", nargs="+", default=["donut", "moondream2", "t5"],
+		choices=["donut", "moondream2", "t5"])
+	parser.add_argument("--precisions", nargs="+", default=list(PRECISIONS), choices=PRECISIONS)
+	parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+	parser.add_argument("--interop-threads", type=int, default=None, help="torch inter-op threads")
+	parser.add_argument("--limit", type=int, default=16, help="maximum number of documents")
+	parser.add_argument("--batchsize", type=int, default=8)
+	parser.add_argument("--truth", default=None,
+		help="JSON file mapping file names to their correct titles")
+	args = parser.parse_args()
+
+	set_threads(args.threads, args.interop_threads)
+	files = sorted(f for f in os.listdir(args.directory) if f.lower().endswith(".pdf"))[:args.limit]
+	if not files:
+		sys.exit(f"No PDF files in {args.directory}")
+	documents = [render_frontpage(os.path.join(args.directory, f)) for f in files]
+	titles = [d["metadata"].get("title") or os.path.splitext(os.path.basename(d["path"]))[0]
+		for d in documents]
+	truth = None
+	if args.truth is not None:
+		with open(args.truth, "r") as f:
+			truth = json.load(f)
+
+	# fp32 first, it is the reference of the others
+	precisions = sorted(set(args.precisions) | {"fp32"}, key=PRECISIONS.index)
+	analyzers = {"donut" : DonutAnalyzer, "moondream2" : Moondream2}
+	print(f"{len(documents)} documents, {args.threads or 'default'} threads")
+	print(f"{'model':<12}{'precision':<11}{'load s':>8}{'s/item':>9}{'speedup':>9}"
+		f"{'agreement':>11}{'title acc':>11}")
+	for model in args.models:
+		reference = None
+		reference_time = None
+		for precision in precisions:
+			if model == "t5":
+				load, elapsed, results = run_keywords(titles, precision, args.batchsize)
+			else:
+				load, elapsed, results = run_analyzer(analyzers[model], documents, precision,
+					args.batchsize)
+			per_item = elapsed / len(documents)
+			if reference is None:
+				reference, reference_time = results, per_item
+			accuracy = None
+			if truth is not None and model != "t5":
+				accuracy = title_accuracy(documents, results, truth)
+			if precision in args.precisions:
+				print(f"{model:<12}{precision:<11}{load:>8.1f}{per_item:>9.2f}"
+					f"{reference_time / per_item:>8.2f}x{agreement(model, results, reference):>11.2f}"
+					f"{'-' if accuracy is None else f'{accuracy:.2f}':>11}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,110 @@
+"""Insert throughput of the single-row write paths of DatabaseInterface.
+
+Adds the same books (publisher, book, two topics, file) three ways and reports
+books per second:
+	fstring        values formatted into the SQL, as addbook did before
+	parameterized  the statements of addbook, addfile, ... (a book and its topics in one
+	               statement), values bound by psycopg2, parsed and planned every time
+	prepared       addbook, addfile, ... on these statements prepared once per connection
+addbooks_bulk is reported for reference. All rows are logged as usual. Every
+way runs --rounds times, alternating, and the best round counts.
+
+The database is cleared. Only use this on a database meant for testing.
+
+Usage:
+	PGPASSWORD=pw python benchmarks/insert_throughput.py testlib user --books 10000
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from getpass import getpass
+
+from smartfilelibrary import DatabaseInterface
+from smartfilelibrary.config import config
+
+
+def books(n : int):
+	"""The generated books: title, year, publisher, topics, file path, pages."""
+	for i in range(n):
+		yield (f"Generated book {i}: O'Reilly's guide", 1990 + i % 35, f"Publisher {i % 50}",
+			(f"Topic {i % 40}", f"Subject {i % 7}"), f"files/book{i}.pdf", 100 + i % 300)
+
+
+def fstring(db : DatabaseInterface, n : int):
+	pubs = {}
+	for book_id, (title, year, pub, topics, path, pages) in enumerate(books(n), 1):
+		if pub not in pubs:
+			db.execute(f"INSERT INTO Publisher (name) VALUES ('{pub}');")
+			pubs[pub] = len(pubs) + 1
+		for t in topics:
+			db.checktopic(t)
+		title = title.replace("'", "''")
+		db.execute(f"INSERT INTO Book (title, year, pub_id, form_id, favorite) "
+			f"VALUES ('{title}', {year}, {pubs[pub]}, 1, False);")
+		for t in topics:
+			db.execute(f"INSERT INTO book_topic (book_id, topic_name) VALUES ({book_id}, '{t}');")
+		db.execute(f"INSERT INTO File (book_id, filepath, num_pages, subname, content_hash) "
+			f"VALUES ({book_id}, '{path}', {pages}, '', NULL);")
+
+
+def parameterized(db : DatabaseInterface, n : int):
+	pubs = {}
+	for title, year, pub, topics, path, pages in books(n):
+		if pub not in pubs:
+			pubs[pub] = db.execute(db.PREPARED["sfl_publisher"], (pub,))[0][0]
+		for t in topics:
+			db.checktopic(t)
+		book_id = db.execute(db.PREPARED["sfl_book"],
+			(title, year, pubs[pub], 1, False, list(topics)))[0][0]
+		db.execute(db.PREPARED["sfl_file"], (book_id, path, pages, "", None))
+
+
+def prepared(db : DatabaseInterface, n : int):
+	for title, year, pub, topics, path, pages in books(n):
+		book_id = db.addbook(title, year, db.addpublisher(pub), "book", topics)
+		db.addfile(book_id, path, pages)
+
+
+def bulk(db : DatabaseInterface, n : int):
+	db.addbooks_bulk({"title" : title, "year" : year, "publisher" : pub, "form" : "book",
+		"topics" : topics, "files" : [(path, pages)]}
+		for title, year, pub, topics, path, pages in books(n))
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+	parser.add_argument("dbname")
+	parser.add_argument("user")
+	parser.add_argument("--books", type=int, default=10000)
+	parser.add_argument("--rounds", type=int, default=3)
+	args = parser.parse_args()
+
+	password = os.environ.get("PGPASSWORD") or getpass("Please enter the password for the DB: ")
+	workdir = tempfile.mkdtemp(prefix="sfl_insert_")
+	config["LOG_FILE"] = os.path.join(workdir, "locallog.sfl")
+	try:
+		db = DatabaseInterface(args.dbname, args.user, password)
+		ways = {"fstring" : fstring, "parameterized" : parameterized, "prepared" : prepared,
+			"bulk" : bulk}
+		best = {}
+		for _ in range(args.rounds):
+			for name, fill in ways.items():
+				db.cleardb()
+				db.standardsetup()
+				db.commit_transaction()
+				t = time.perf_counter()
+				fill(db, args.books)
+				db.commit_transaction()
+				best[name] = min(best.get(name, float("inf")), time.perf_counter() - t)
+		db.finish()
+		print(f"{args.books} books, each with 2 topics and 1 file, best of {args.rounds}")
+		for name in ways:
+			print(f"{name:<15}{args.books / best[name]:>10.0f} books/s")
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+	main()
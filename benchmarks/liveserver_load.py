@@ -0,0 +1,178 @@
+"""Load test of the liveserver against a local PostgreSQL.
+
+Starts the liveserver in this process, on a free port with its connection
+pool, or with --asgi the asyncserver on uvicorn, and sends a mix of requests from many concurrent clients: keyword
+searches, paged listings, streamed listings and favourite toggles. Reports
+the throughput, the latency percentiles per kind of request and the errors.
+
+With --seed, the database is cleared and filled with generated books first.
+Only use --seed on a database meant for testing.
+
+Usage:
+	PGPASSWORD=pw python benchmarks/liveserver_load.py testlib user --seed 20000
+	PGPASSWORD=pw python benchmarks/liveserver_load.py testlib user --clients 64 --pool-max 16
+	PGPASSWORD=pw python benchmarks/liveserver_load.py testlib user --clients 300 --asgi
+"""
+import os
+import time
+import socket
+import logging
+import random
+import argparse
+import threading
+import statistics
+import urllib.error
+import urllib.request
+from getpass import getpass
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import make_server
+
+from smartfilelibrary import DatabaseInterface
+from smartfilelibrary import liveserver
+
+TOPICS = ["SQL", "Deep Learning", "Physics", "Algebra", "Biology", "Networks", "Compilers",
+	"Statistics", "Chemistry", "Robotics"]
+FORMS = ["book", "research article", "lecture document", "code"]
+
+
+def seed(dbname : str, user : str, password : str, books : int):
+	"""Clear the database and add generated books."""
+	db = DatabaseInterface(dbname, user, password)
+	db.cleardb()
+	db.standardsetup()
+	rng = random.Random(0)
+	db.addbooks_bulk({
+		"title" : f"Generated book {i}",
+		"year" : 1990 + i % 35,
+		"publisher" : f"Publisher {i % 50}",
+		"form" : rng.choice(FORMS),
+		"topics" : rng.sample(TOPICS, rng.randint(1, 3))
+	} for i in range(books))
+	db.finish()
+
+
+def request(base : str, kind : str, books : int, rng : random.Random) -> tuple:
+	"""Send one request of the given kind. Returns the status and the latency."""
+	if kind == "search":
+		path = f"/query?kw={urllib.request.quote(rng.choice(TOPICS))}&form=all&limit=50"
+	elif kind == "page":
+		path = f"/query?kw=*&form={urllib.request.quote(rng.choice(FORMS))}&limit=100" \
+			f"&cursor={rng.randrange(max(books, 1))}"
+	elif kind == "stream":
+		path = f"/query?kw={urllib.request.quote(rng.choice(TOPICS))}&form=all&stream=1" \
+			f"&cursor={rng.randrange(max(books, 1))}&limit=500"
+	else:
+		path = f"/set_fav?val={rng.randint(0, 1)}&id={rng.randint(1, max(books, 1))}"
+	t = time.perf_counter()
+	try:
+		with urllib.request.urlopen(base + path, timeout=60) as r:
+			r.read()
+			status = r.status
+	except urllib.error.HTTPError as e:
+		status = e.code
+	except OSError:
+		status = "connection error"
+	return status, time.perf_counter() - t
+
+
+class _AsgiServer:
+	"""uvicorn running the asyncserver in a thread, with the interface of the werkzeug server."""
+
+	def __init__(self, app):
+		import uvicorn
+		self.sock = socket.socket()
+		self.sock.bind(("127.0.0.1", 0))
+		self.server_port = self.sock.getsockname()[1]
+		self.server = uvicorn.Server(uvicorn.Config(app, log_level="error", backlog=4096))
+		self.thread = threading.Thread(target=self.server.run, kwargs={"sockets" : [self.sock]},
+			daemon=True)
+		self.thread.start()
+		while not self.server.started:
+			time.sleep(0.01)
+
+	def shutdown(self):
+		self.server.should_exit = True
+		self.thread.join()
+
+
+def start_asgi(dbname : str, user : str, password : str, maxconn : int):
+	"""Start the asyncserver on a free port."""
+	from smartfilelibrary import asyncserver
+	return _AsgiServer(asyncserver.create_app(dbname, user, password, maxconn=maxconn))
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+	parser.add_argument("dbname")
+	parser.add_argument("user")
+	parser.add_argument("--seed", type=int, default=None, metavar="BOOKS",
+		help="clear the database and add this many generated books first")
+	parser.add_argument("--clients", type=int, default=32, help="concurrent clients")
+	parser.add_argument("--requests", type=int, default=2000, help="requests in total")
+	parser.add_argument("--pool-max", type=int, default=None, help="maximum database connections")
+	parser.add_argument("--asgi", action="store_true", help="test the asyncserver on uvicorn")
+	parser.add_argument("--mix", default="search=6,page=2,stream=1,fav=1",
+		help="relative frequency of the kinds of requests")
+	args = parser.parse_args()
+
+	password = os.environ.get("PGPASSWORD") or getpass("Please enter the password for the DB: ")
+	if args.seed is not None:
+		print(f"[Info] Seeding {args.dbname} with {args.seed} books.")
+		seed(args.dbname, args.user, password, args.seed)
+	liveserver.init_pool(args.dbname, args.user, password, maxconn=args.pool_max)
+	conn = liveserver.pool.getconn()
+	with conn.cursor() as cur:
+		cur.execute("SELECT COALESCE(MAX(book_id), 0) FROM Book")
+		books = cur.fetchone()[0]
+	conn.rollback()
+	liveserver.pool.putconn(conn)
+
+	if args.asgi:
+		server = start_asgi(args.dbname, args.user, password, args.pool_max)
+	else:
+		logging.getLogger("werkzeug").setLevel(logging.ERROR)
+		server = make_server("127.0.0.1", 0, liveserver.app, threaded=True)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+	base = f"http://127.0.0.1:{server.server_port}"
+
+	kinds, weights = [], []
+	for entry in args.mix.split(","):
+		kind, weight = entry.split("=")
+		kinds.append(kind)
+		weights.append(float(weight))
+	rng = random.Random(1)
+	plan = rng.choices(kinds, weights, k=args.requests)
+
+	def client(i):
+		crng = random.Random(i)
+		return [(kind, *request(base, kind, books, crng)) for kind in plan[i::args.clients]]
+
+	t = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=args.clients) as pool:
+		results = [r for rs in pool.map(client, range(args.clients)) for r in rs]
+	elapsed = time.perf_counter() - t
+	server.shutdown()
+	liveserver.pool.closeall()
+
+	latencies = defaultdict(list)
+	errors = defaultdict(int)
+	for kind, status, latency in results:
+		latencies[kind].append(latency * 1000)
+		if status != 200:
+			errors[status] += 1
+	print(f"{len(results)} requests, {args.clients} clients, {books} books: "
+		f"{len(results) / elapsed:.1f} requests/s")
+	print(f"{'kind':<10}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+	for kind in kinds:
+		ls = sorted(latencies[kind])
+		if not ls:
+			continue
+		q = statistics.quantiles(ls, n=100) if len(ls) > 1 else ls * 99
+		print(f"{kind:<10}{len(ls):>7}{q[49]:>9.1f}{q[94]:>9.1f}{q[98]:>9.1f}{ls[-1]:>9.1f}")
+	print("errors:", dict(errors) or "none")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,131 @@
+"""Benchmark of the action log: logging overhead and replay time.
+
+Fills the database statement by statement (addpublisher, addbook, addfile) and
+reports the time spent writing the log, against the plain SQL text log of
+earlier versions, which opened the file for every statement. Then the library
+is cleared and rebuilt twice: from the equivalent plain SQL file as one string
+(the earlier executefile) and from the action log (chunked replay). Both must
+give the same number of rows.
+
+The database is cleared. Only use this on a database meant for testing.
+
+Usage:
+	PGPASSWORD=pw python benchmarks/log_replay.py testlib user --books 20000
+	PGPASSWORD=pw python benchmarks/log_replay.py testlib user --fsync never --chunksize 50000
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from getpass import getpass
+
+from smartfilelibrary import DatabaseInterface
+from smartfilelibrary.actionlog import ActionLog, read_frames, FSYNC_POLICIES
+from smartfilelibrary.config import config
+
+TABLES = ("Publisher", "Book", "Topic", "book_topic", "File")
+
+
+def counts(db : DatabaseInterface) -> dict:
+	"""Number of rows per table."""
+	ret = {}
+	for table in TABLES:
+		db.cur.execute(f"SELECT COUNT(*) FROM {table}")
+		ret[table] = db.cur.fetchone()[0]
+	return ret
+
+
+def fill(db : DatabaseInterface, books : int):
+	"""Add books one statement at a time, like a manual or preview run does."""
+	pubs = [db.addpublisher(f"Publisher {i}") for i in range(50)]
+	for i in range(books):
+		book = db.addbook(f"Generated book {i}", 1990 + i % 35, pubs[i % 50], "book",
+			(f"Topic {i % 40}", f"Subject {i % 7}"))
+		db.addfile(book, f"files/book{i}.pdf", 100 + i % 300)
+	db.commit_transaction()
+
+
+def to_sql(db : DatabaseInterface, logfile : str, sqlfile : str):
+	"""Write the statements of the action log as a plain SQL file, the format of
+	earlier versions."""
+	with open(sqlfile, "w") as f:
+		for offset, entries in read_frames(logfile):
+			for entry in entries:
+				if entry[0] == "v":
+					raise ValueError("Only statements, no execute_values.")
+				query = entry[1] if len(entry) == 2 else db.cur.mogrify(entry[1], entry[2]).decode()
+				f.write(query + "\n")
+
+
+def legacy_log_time(logfile : str, statements : list) -> float:
+	"""Time to log the statements the earlier way: open, append, close per statement."""
+	t = time.perf_counter()
+	for statement in statements:
+		with open(logfile, "a") as f:
+			f.write(statement + "\n")
+	return time.perf_counter() - t
+
+
+def log_time(logfile : str, statements : list, fsync : str) -> float:
+	"""Time to log the statements to an action log, flushing every 1000 like commits."""
+	log = ActionLog(logfile, fsync)
+	t = time.perf_counter()
+	for i, statement in enumerate(statements):
+		log.statement(statement)
+		if i % 1000 == 999:
+			log.flush()
+	log.close()
+	return time.perf_counter() - t
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+	parser.add_argument("dbname")
+	parser.add_argument("user")
+	parser.add_argument("--books", type=int, default=20000)
+	parser.add_argument("--fsync", default=config["LOG_FSYNC"], choices=FSYNC_POLICIES)
+	parser.add_argument("--chunksize", type=int, default=10000, help="statements per transaction")
+	args = parser.parse_args()
+
+	password = os.environ.get("PGPASSWORD") or getpass("Please enter the password for the DB: ")
+	workdir = tempfile.mkdtemp(prefix="sfl_log_")
+	config["LOG_FILE"] = os.path.join(workdir, "locallog.sfl")
+	config["LOG_FSYNC"] = args.fsync
+	try:
+		db = DatabaseInterface(args.dbname, args.user, password)
+		db.cleardb()
+		db.standardsetup()
+		t = time.perf_counter()
+		fill(db, args.books)
+		filltime = time.perf_counter() - t
+		expected = counts(db)
+		backup = os.path.join(workdir, "backup.sfl")
+		shutil.copy(config["LOG_FILE"], backup)
+		sqlfile = os.path.join(workdir, "backup.sql")
+		to_sql(db, backup, sqlfile)
+		with open(sqlfile, "r") as f:
+			statements = f.read().splitlines()
+		print(f"{args.books} books, {len(statements)} log lines, fsync {args.fsync}")
+		print(f"fill: {filltime:.1f} s")
+		legacy = legacy_log_time(os.path.join(workdir, "legacy.txt"), statements)
+		actionlog = log_time(os.path.join(workdir, "bench.sfl"), statements, args.fsync)
+		print(f"log {len(statements)} lines: plain SQL {legacy:.2f} s, action log {actionlog:.2f} s")
+		print(f"log size: plain SQL {os.path.getsize(sqlfile) / 1e6:.1f} MB, "
+			f"action log {os.path.getsize(backup) / 1e6:.1f} MB")
+
+		for name, file in (("plain SQL", sqlfile), ("action log", backup)):
+			db.cleardb()
+			db.commit_transaction()
+			t = time.perf_counter()
+			db.executefile(file, chunksize=args.chunksize)
+			elapsed = time.perf_counter() - t
+			same = counts(db) == expected
+			print(f"replay {name}: {elapsed:.1f} s, {'same rows' if same else 'DIFFERENT ROWS'}")
+		db.finish()
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+	main()
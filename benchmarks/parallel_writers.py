@@ -0,0 +1,84 @@
+"""Throughput of several writer processes adding books to the same library.
+
+Runs ingest.run_writers with generated books instead of analyzed documents,
+for each number of writers: every job stands for --chunk documents, waits
+--analysis-ms per document like a writer waiting for its models, and commits
+its books (publisher, topics and a file each) in one transaction. The writers
+share the topics and publishers, and neighbouring jobs bring new topics, which
+writers running at the same time add concurrently. Reports books per second, the speedup over
+one writer and whether the library holds every book and each topic once.
+
+The database is cleared. Only use this on a database meant for testing.
+
+Usage:
+	PGPASSWORD=pw python benchmarks/parallel_writers.py testlib user --books 20000
+	PGPASSWORD=pw python benchmarks/parallel_writers.py testlib user --workers 1,2,4 --analysis-ms 5
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from getpass import getpass
+
+from smartfilelibrary import DatabaseInterface
+from smartfilelibrary.config import config
+from smartfilelibrary.ingest import run_writers
+
+
+def generate(db : DatabaseInterface, start : int, n : int, analysis_ms : float) -> list:
+	"""Job of the writers: the records of the books start to start + n."""
+	time.sleep(n * analysis_ms / 1000)
+	return [{"title" : f"Generated book {i}", "year" : 1990 + i % 35,
+		"publisher" : f"Publisher {i % 50}", "form" : "book",
+		"topics" : (f"Topic {i % 40}", f"Subject {i % 7}", f"Series {i // 250}"),
+		"files" : [(f"files/book{i}.pdf", 100 + i % 300)]} for i in range(start, start + n)]
+
+
+def check(db : DatabaseInterface, books : int) -> bool:
+	"""Whether every book was added once and no topic or publisher twice."""
+	db.cur.execute("SELECT (SELECT COUNT(*) FROM Book), (SELECT COUNT(DISTINCT title) FROM Book), "
+		"(SELECT COUNT(*) - COUNT(DISTINCT lower(topic_name)) FROM Topic), "
+		"(SELECT COUNT(*) - COUNT(DISTINCT name) FROM Publisher);")
+	return db.cur.fetchone() == (books, books, 0, 0)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+	parser.add_argument("dbname")
+	parser.add_argument("user")
+	parser.add_argument("--books", type=int, default=20000)
+	parser.add_argument("--chunk", type=int, default=100, help="books per job and transaction")
+	parser.add_argument("--workers", default="1,2,4,8", help="numbers of writers to compare")
+	parser.add_argument("--analysis-ms", type=float, default=0.0,
+		help="milliseconds each document waits for its analysis")
+	args = parser.parse_args()
+
+	password = os.environ.get("PGPASSWORD") or getpass("Please enter the password for the DB: ")
+	workdir = tempfile.mkdtemp(prefix="sfl_writers_")
+	config["LOG_FILE"] = os.path.join(workdir, "locallog.sfl")
+	jobs = [(start, min(args.chunk, args.books - start), args.analysis_ms)
+		for start in range(0, args.books, args.chunk)]
+	try:
+		db = DatabaseInterface(args.dbname, args.user, password)
+		print(f"{args.books} books in {len(jobs)} transactions, analysis {args.analysis_ms} ms per book")
+		print(f"{'writers':<9}{'books/s':>10}{'speedup':>9}  check")
+		single = None
+		for workers in map(int, args.workers.split(",")):
+			db.cleardb()
+			db.standardsetup()
+			db.commit_transaction()
+			t = time.perf_counter()
+			run_writers(args.dbname, args.user, password, generate, jobs, workers)
+			rate = args.books / (time.perf_counter() - t)
+			single = single or rate
+			print(f"{workers:<9}{rate:>10.0f}{rate / single:>9.2f}  "
+				f"{'ok' if check(db, args.books) else 'WRONG ROWS'}")
+			db.commit_transaction()
+		db.finish()
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+	main()
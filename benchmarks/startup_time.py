@@ -0,0 +1,64 @@
+"""Startup time benchmark and regression check.
+
+Imports the given modules in fresh interpreters and reports the median wall
+time and the peak memory. Fails if the time exceeds --max-seconds or if one
+of the heavy modules (torch, transformers) got imported: these must only be
+loaded when an AI model is selected.
+
+Usage:
+	python benchmarks/startup_time.py
+	python benchmarks/startup_time.py --max-seconds 0.5 --runs 10
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HEAVY = ("torch", "transformers")
+
+PROBE = """
+import sys, time, json, resource
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(json.dumps({{"seconds" : elapsed,
+	"maxrss_mb" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+	"heavy" : [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module : str) -> dict:
+	"""Import module in a fresh interpreter and return time, memory and heavy modules."""
+	out = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+		capture_output=True, text=True, check=True).stdout
+	return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+	parser.add_argument("--modules", nargs="+",
+		default=["smartfilelibrary", "smartfilelibrary.liveserver"])
+	parser.add_argument("--runs", type=int, default=5)
+	parser.add_argument("--max-seconds", type=float, default=1.0,
+		help="fail if the median import time is above")
+	args = parser.parse_args()
+
+	failed = False
+	print(f"{'module':<32}{'median s':>10}{'max s':>8}{'rss MB':>9}  heavy imports")
+	for module in args.modules:
+		runs = [measure(module) for _ in range(args.runs)]
+		seconds = [r["seconds"] for r in runs]
+		heavy = sorted({m for r in runs for m in r["heavy"]})
+		median = statistics.median(seconds)
+		print(f"{module:<32}{median:>10.3f}{max(seconds):>8.3f}"
+			f"{max(r['maxrss_mb'] for r in runs):>9.0f}  {', '.join(heavy) or '-'}")
+		if heavy or median > args.max_seconds:
+			failed = True
+	if failed:
+		print("[Error] Startup regression: heavy modules imported or too slow.")
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -1,5 +1,5 @@
 
-DROP TABLE Publisher, Form, Book, File, Topic, subtopic_of, book_topic, UseCase, usecase_book;
+DROP TABLE IF EXISTS Publisher, Form, Book, File, Topic, subtopic_of, topic_closure, book_topic, UseCase, usecase_book;
 
 CREATE TABLE Publisher(
 	pub_id SERIAL PRIMARY KEY, 
@@ -32,6 +32,7 @@ CREATE TABLE File(
 	filepath VARCHAR(100) UNIQUE,
 	num_pages INT,
 	subname VARCHAR(20) DEFAULT '',
+	content_hash CHAR(64), -- SHA-256 of the contents, finds duplicate files
 
 	PRIMARY KEY(book_id, collection_id),
 
@@ -39,6 +40,8 @@ CREATE TABLE File(
 		ON DELETE CASCADE ON UPDATE CASCADE -- File is weak entity linked to book
 );
 
+CREATE INDEX file_content_hash ON File (content_hash);
+
 
 CREATE TABLE Topic(
 	topic_name VARCHAR(40) PRIMARY KEY
@@ -70,6 +73,8 @@ CREATE TABLE book_topic(
 		ON DELETE CASCADE ON UPDATE CASCADE
 );
 
+CREATE INDEX book_topic_lower_name ON book_topic (lower(topic_name));
+
 CREATE TABLE UseCase(
 	usecase_id SERIAL PRIMARY KEY,
 	name VARCHAR(30) NOT NULL,
@@ -90,3 +95,108 @@ CREATE TABLE usecase_book(
 		ON DELETE CASCADE ON UPDATE CASCADE
 
 );
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- The topics of the book, separated by spaces. Kept up to date by the triggers below.
+ALTER TABLE Book ADD COLUMN IF NOT EXISTS topics_text TEXT;
+
+-- Title and topics as plain text, for fuzzy (trigram) matches.
+ALTER TABLE Book ADD COLUMN IF NOT EXISTS search_text TEXT
+	GENERATED ALWAYS AS (title || ' ' || COALESCE(topics_text, '')) STORED;
+
+-- Title (weight A) and topics (weight B) as lexemes, for ranked full-text matches.
+ALTER TABLE Book ADD COLUMN IF NOT EXISTS search tsvector
+	GENERATED ALWAYS AS (setweight(to_tsvector('english', title), 'A') ||
+		setweight(to_tsvector('english', COALESCE(topics_text, '')), 'B')) STORED;
+
+CREATE INDEX IF NOT EXISTS book_search ON Book USING GIN (search);
+CREATE INDEX IF NOT EXISTS book_search_trgm ON Book USING GIN (search_text gin_trgm_ops);
+
+-- Book by book through the primary key: the plan is cached with the function, a
+-- join with the changed books would keep the plan of the (empty) Book of the first call.
+CREATE OR REPLACE FUNCTION book_topics_refresh() RETURNS trigger AS $$
+DECLARE
+	changed_id INTEGER;
+BEGIN
+	FOR changed_id IN SELECT DISTINCT book_id FROM changed LOOP
+		UPDATE Book SET topics_text = (SELECT string_agg(topic_name, ' ' ORDER BY topic_name)
+			FROM book_topic bt WHERE bt.book_id = changed_id)
+		WHERE book_id = changed_id;
+	END LOOP;
+	RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+-- Statement level: a bulk insert refreshes each of its books once.
+CREATE OR REPLACE TRIGGER book_topic_insert AFTER INSERT ON book_topic
+	REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION book_topics_refresh();
+CREATE OR REPLACE TRIGGER book_topic_update AFTER UPDATE ON book_topic
+	REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION book_topics_refresh();
+CREATE OR REPLACE TRIGGER book_topic_delete AFTER DELETE ON book_topic
+	REFERENCING OLD TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION book_topics_refresh();
+
+UPDATE Book SET topics_text = (SELECT string_agg(topic_name, ' ' ORDER BY topic_name)
+	FROM book_topic bt WHERE bt.book_id = Book.book_id);
+
+CREATE TABLE IF NOT EXISTS topic_closure(
+	ancestor_name VARCHAR(40),
+	descendant_name VARCHAR(40),
+
+	PRIMARY KEY(ancestor_name, descendant_name),
+
+	CONSTRAINT ancestorname FOREIGN KEY (ancestor_name) REFERENCES Topic
+		ON DELETE CASCADE ON UPDATE CASCADE,
+
+	CONSTRAINT descendantname FOREIGN KEY (descendant_name) REFERENCES Topic
+		ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS topic_closure_lower_ancestor ON topic_closure (lower(ancestor_name));
+
+CREATE OR REPLACE FUNCTION topic_closure_add_topics() RETURNS trigger AS $$
+BEGIN
+	INSERT INTO topic_closure SELECT topic_name, topic_name FROM added ON CONFLICT DO NOTHING;
+	RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+-- Incremental: everything above base (and base) gets everything below sub (and sub).
+-- Per row, such that several edges in one statement see each other.
+CREATE OR REPLACE FUNCTION topic_closure_add_edge() RETURNS trigger AS $$
+BEGIN
+	INSERT INTO topic_closure
+		SELECT a.ancestor_name, d.descendant_name
+		FROM topic_closure a, topic_closure d
+		WHERE a.descendant_name = NEW.basetopic_name AND d.ancestor_name = NEW.subtopic_name
+	ON CONFLICT DO NOTHING;
+	RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION topic_closure_rebuild() RETURNS void AS $$
+	DELETE FROM topic_closure;
+	INSERT INTO topic_closure
+		WITH RECURSIVE reach(ancestor_name, descendant_name) AS (
+			SELECT topic_name, topic_name FROM Topic
+			UNION
+			SELECT r.ancestor_name, s.subtopic_name
+			FROM reach r JOIN subtopic_of s ON s.basetopic_name = r.descendant_name)
+		SELECT * FROM reach;
+$$ LANGUAGE sql;
+
+-- Removing an edge may or may not remove paths, so these rare changes rebuild it.
+CREATE OR REPLACE FUNCTION topic_closure_changed() RETURNS trigger AS $$
+BEGIN
+	PERFORM topic_closure_rebuild();
+	RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER topic_insert AFTER INSERT ON Topic
+	REFERENCING NEW TABLE AS added FOR EACH STATEMENT EXECUTE FUNCTION topic_closure_add_topics();
+CREATE OR REPLACE TRIGGER subtopic_of_insert AFTER INSERT ON subtopic_of
+	FOR EACH ROW EXECUTE FUNCTION topic_closure_add_edge();
+CREATE OR REPLACE TRIGGER subtopic_of_change AFTER UPDATE OR DELETE OR TRUNCATE ON subtopic_of
+	FOR EACH STATEMENT EXECUTE FUNCTION topic_closure_changed();
+
+SELECT topic_closure_rebuild();
+
+CREATE UNIQUE INDEX IF NOT EXISTS topic_lower_name_key ON Topic (lower(topic_name));
+CREATE UNIQUE INDEX IF NOT EXISTS publisher_name_key ON Publisher (name);
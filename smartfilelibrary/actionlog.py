@@ -0,0 +1,419 @@
+"""The action log records the statements modifying the library, such that the
+library can be rebuilt by replaying it, see DatabaseInterface.executefile.
+
+The file starts with MAGIC, followed by frames. A frame holds the statements
+written together, usually one transaction, and never splits a batch (see
+ActionLog.batch): the length and the CRC-32 of the payload (4 bytes each, big
+endian), then the payload, a zlib compressed JSON list of entries
+	["s", sql] or ["s", sql, params]	executed with cursor.execute
+	["v", sql, rows]					executed with psycopg2.extras.execute_values
+Statements are written once their transaction committed (ActionLog.commit,
+or ActionLog.flush after committing) and dropped if it is rolled back
+(ActionLog.discard). Frames are appended while holding a lock (flock) on the
+file, such that several processes, like the library and the liveserver, can
+append to the same log. Writers committing with ActionLog.commit append their
+frames in the order of their commits.
+
+Print a log as SQL with
+	python3 -m smartfilelibrary.actionlog locallog.sfl
+"""
+import os
+import sys
+import json
+import zlib
+import fcntl
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from psycopg2.extras import execute_values
+
+from .config import config
+
+MAGIC = b"SFLLOG\x00\x01"
+FSYNC_POLICIES = ("commit", "never")
+_FRAME = struct.Struct(">II")
+_SCALARS = frozenset((str, int, float, bool, type(None)))
+_encode = json.JSONEncoder(separators=(",", ":")).encode
+
+
+def _plain(params) -> bool:
+	"""Whether the parameters are the same after a round trip through JSON:
+	scalars and lists (arrays) of scalars. Tuples would become lists."""
+	if isinstance(params, dict):
+		params = params.values()
+	elif not isinstance(params, (list, tuple)):
+		return False
+	return all(type(p) in _SCALARS or type(p) is list and all(type(v) in _SCALARS for v in p)
+		for p in params)
+
+
+def is_action_log(path : str) -> bool:
+	"""Whether the file at path is an action log (and not, e.g., a plain SQL file)."""
+	with open(path, "rb") as f:
+		return f.read(len(MAGIC)) == MAGIC
+
+
+def read_frames(path : str):
+	"""
+	Yield (offset, entries) for every frame of the log, offset being the position
+	of the frame in the file. A damaged frame at the end, as left by a crash while
+	writing, ends the log with a warning.
+
+	Parameters
+	-----------
+	path : str
+		The log file.
+	"""
+	with open(path, "rb") as f:
+		if f.read(len(MAGIC)) != MAGIC:
+			raise ValueError(f"[Error] {path} is not an action log.")
+		offset = len(MAGIC)
+		while True:
+			header = f.read(_FRAME.size)
+			if not header:
+				return
+			payload = b""
+			if len(header) == _FRAME.size:
+				length, crc = _FRAME.unpack(header)
+				payload = f.read(length)
+			if len(header) < _FRAME.size or len(payload) < length or zlib.crc32(payload) != crc:
+				print(f"[Warning] Damaged frame at byte {offset} of {path}, ignoring the rest.")
+				return
+			yield offset, json.loads(zlib.decompress(payload))
+			offset += _FRAME.size + length
+
+
+class ActionLog:
+	"""Buffered, append-only log of the executed statements. Thread safe."""
+
+	def __init__(self, path : str, fsync : str = None, buffersize : int = None):
+		"""This is the constructor. Creates the log if it does not exist.
+
+		Parameters
+		-----------
+		path : str
+			The log file.
+		fsync : str
+			"commit" syncs the log to disk whenever statements are written, on every
+			commit. "never" leaves syncing to the operating system. None for LOG_FSYNC
+			of the config.
+		buffersize : int
+			Statements are kept in memory until they are written. Beyond this many
+			bytes, they wait in a temporary file instead. None for LOG_BUFFER_SIZE of
+			the config.
+		"""
+		self.path = path
+		self.fsync = config["LOG_FSYNC"] if fsync is None else fsync
+		if self.fsync not in FSYNC_POLICIES:
+			raise ValueError(f"[Error] fsync must be one of {FSYNC_POLICIES}, not {self.fsync}.")
+		self.buffersize = config["LOG_BUFFER_SIZE"] if buffersize is None else buffersize
+		self._pending = []
+		self._pendingsize = 0
+		self._batch = None
+		self._spill = None
+		self._lock = threading.RLock()
+		self._open()
+
+	def _create(self, replace : bool = False):
+		"""Write an empty log atomically, such that no other process appends to a
+		file without header. An existing log is kept unless replace is set."""
+		tmp = f"{self.path}.{os.getpid()}.tmp"
+		with open(tmp, "wb") as f:
+			f.write(MAGIC)
+		if replace:
+			os.replace(tmp, self.path)
+			return
+		try:
+			os.link(tmp, self.path)
+		except FileExistsError:
+			pass
+		finally:
+			os.remove(tmp)
+
+	def _open(self):
+		if not os.path.exists(self.path):
+			self._create()
+		if not is_action_log(self.path):
+			raise ValueError(f"[Error] {self.path} is not an action log. Logs of older versions "
+				"are plain SQL, replay them with DatabaseInterface.executefile.")
+		self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+		self._inode = os.fstat(self._fd).st_ino
+
+	def _reopen_if_replaced(self):
+		"""Follow the log if another process cleared (replaced) or removed it."""
+		try:
+			replaced = os.stat(self.path).st_ino != self._inode
+		except FileNotFoundError:
+			replaced = True
+		if replaced:
+			os.close(self._fd)
+			self._open()
+
+	@contextmanager
+	def _locked(self):
+		"""Lock the log file against the writes of other processes."""
+		self._reopen_if_replaced()
+		fd = self._fd
+		fcntl.flock(fd, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(fd, fcntl.LOCK_UN)
+
+	def _frame(self) -> bytes:
+		"""The pending statements as one frame. Empties them."""
+		payload = zlib.compress(("[" + ",".join(self._pending) + "]").encode(), 1)
+		self._pending.clear()
+		self._pendingsize = 0
+		return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+	def _writeall(self, data : bytes):
+		written = 0
+		while written < len(data):
+			written += os.write(self._fd, data[written:])
+
+	def _write(self, sync : bool):
+		"""Append the statements waiting in the temporary file and the pending ones
+		to the log. The caller holds the file lock, see _locked."""
+		if self._spill is not None:
+			self._spill.seek(0)
+			for data in iter(lambda: self._spill.read(1 << 20), b""):
+				self._writeall(data)
+			self._spill.close()
+			self._spill = None
+		if self._pending:
+			self._writeall(self._frame())
+		if sync:
+			os.fsync(self._fd)
+
+	def _append(self, entries : list):
+		"""Add entries to the pending statements."""
+		for entry in entries:
+			self._pending.append(_encode(entry))
+			self._pendingsize += len(self._pending[-1])
+
+	def add_batch(self, entries : list):
+		"""
+		Log entries, which replay executes in the same transaction.
+
+		Parameters
+		-----------
+		entries : list
+			Entries as described in the module documentation.
+		"""
+		with self._lock:
+			if self._batch is not None:
+				self._batch.extend(entries)
+				return
+			self._append(entries)
+			if self._pendingsize >= self.buffersize:
+				# Not committed yet, so not into the log.
+				if self._spill is None:
+					self._spill = tempfile.TemporaryFile(prefix="sfl_log_")
+				self._spill.write(self._frame())
+
+	def statement(self, command : str, params = None, query : bytes = None):
+		"""
+		Log a statement executed with cursor.execute.
+
+		Parameters
+		-----------
+		command : str
+			The SQL string.
+		params : collection
+			Its parameters, if any.
+		query : bytes
+			The statement as sent to the server (cursor.query). Logged instead of command
+			and params if the parameters do not fit into JSON, like tuples or dates.
+		"""
+		if params is None:
+			entry = ["s", command]
+		elif _plain(params):
+			entry = ["s", command, params]
+		elif query is not None:
+			entry = ["s", query.decode()]
+		else:
+			raise ValueError("[Error] Parameters that do not fit into JSON need the query.")
+		self.add_batch([entry])
+
+	def values(self, command : str, rows : list):
+		"""
+		Log a statement executed with psycopg2.extras.execute_values.
+
+		Parameters
+		-----------
+		command : str
+			SQL string with a single %s placeholder for the VALUES.
+		rows : list of tuples
+			The values, which must fit into JSON (strings, numbers, booleans, None).
+		"""
+		self.add_batch([["v", command, rows]])
+
+	@contextmanager
+	def batch(self):
+		"""Keep the statements logged in the block in one frame, such that replay
+		executes them in one transaction. Nothing is logged if the block fails."""
+		with self._lock:
+			outer = self._batch is None
+			if outer:
+				self._batch = []
+			try:
+				yield
+			except BaseException:
+				if outer:
+					self._batch = None
+				raise
+			if outer:
+				entries, self._batch = self._batch, None
+				if entries:
+					self.add_batch(entries)
+
+	def flush(self):
+		"""Write the pending statements, once their transaction committed, and sync
+		them to disk unless fsync is "never"."""
+		with self._lock, self._locked():
+			self._write(self.fsync != "never")
+
+	def discard(self):
+		"""Drop the pending statements, including those of the open batch, when their
+		transaction is rolled back."""
+		with self._lock:
+			self._pending.clear()
+			self._pendingsize = 0
+			if self._batch is not None:
+				self._batch.clear()
+			if self._spill is not None:
+				self._spill.close()
+				self._spill = None
+
+	def commit(self, conn):
+		"""
+		Commit the transaction of conn and write its pending statements, including
+		those of the open batch. The log file is locked meanwhile, such
+		that concurrent writers log their transactions in the order of their commits
+		and a replay finds the rows one writer used from another. If the commit
+		fails, the pending statements are dropped.
+
+		Parameters
+		-----------
+		conn : psycopg2 connection
+			The connection whose statements were logged.
+		"""
+		with self._lock:
+			if self._batch:
+				self._append(self._batch)
+				self._batch.clear()
+			with self._locked():
+				try:
+					conn.commit()
+				except BaseException:
+					# Not committed, a retry logs its statements again.
+					self.discard()
+					raise
+				self._write(self.fsync != "never")
+
+	def clear(self):
+		"""Empty the log, dropping the pending statements."""
+		with self._lock:
+			self.discard()
+			self._batch = None
+			self._create(replace=True)
+			os.close(self._fd)
+			self._open()
+
+	def close(self):
+		"""Write the pending statements (see flush) and close the log."""
+		with self._lock:
+			self.flush()
+			os.close(self._fd)
+
+
+def replay(cur, path : str, chunksize : int = 10000, pagesize : int = 200,
+		log : ActionLog = None) -> int:
+	"""
+	Execute the action log at path. Statements are sent pagesize at a time in one
+	round trip and committed every chunksize statements, at frame boundaries.
+	Returns the number of statements. If one fails, the chunk is rolled back and
+	the chunks before stay committed.
+
+	Parameters
+	-----------
+	cur : psycopg2 cursor
+		The cursor to execute on.
+	path : str
+		The log file.
+	chunksize : int
+		Minimum number of statements per transaction.
+	pagesize : int
+		Maximum number of statements per round trip.
+	log : ActionLog
+		Receives the replayed frames, once they are committed. None: not logged.
+	"""
+	page = []
+	chunk = []
+	done = 0
+	pending = 0
+	chunkstart = len(MAGIC)
+
+	def send():
+		if page:
+			cur.execute(b"\n;\n".join(page))
+			page.clear()
+
+	def commit():
+		send()
+		cur.connection.commit()
+		if log is not None:
+			for entries in chunk:
+				log.add_batch(entries)
+			log.flush()
+		chunk.clear()
+
+	try:
+		for offset, entries in read_frames(path):
+			if pending == 0:
+				chunkstart = offset
+			for entry in entries:
+				kind, command, params = entry[0], entry[1], entry[2] if len(entry) > 2 else None
+				if kind == "v":
+					send()
+					execute_values(cur, command, params, page_size=len(params))
+				else:
+					page.append(command.encode() if params is None else cur.mogrify(command, params))
+					if len(page) >= pagesize:
+						send()
+			chunk.append(entries)
+			pending += len(entries)
+			if pending >= chunksize:
+				commit()
+				done += pending
+				pending = 0
+		commit()
+	except Exception:
+		cur.connection.rollback()
+		print(f"[Error] Replay of {path} failed after byte {chunkstart}. "
+			f"The {done} statements before are committed.")
+		raise
+	return done + pending
+
+
+def main():
+	"""Print the action log as SQL, parameters as comments."""
+	if len(sys.argv) != 2:
+		print("[Error] actionlog.py expects the argument log_file")
+		quit()
+	for offset, entries in read_frames(sys.argv[1]):
+		print(f"-- frame at byte {offset}")
+		for entry in entries:
+			if len(entry) == 2:
+				print(entry[1].rstrip().rstrip(";") + ";")
+			elif entry[0] == "v":
+				print(f"{entry[1]}; -- {len(entry[2])} rows: {json.dumps(entry[2])}")
+			else:
+				print(f"{entry[1].rstrip().rstrip(';')}; -- {json.dumps(entry[2])}")
+
+
+if __name__ == "__main__":
+	main()
@@ -1,30 +1,125 @@
 import os
 import re
 import abc
-import fitz
 from PIL import Image
 from smartfilelibrary.config import config
+from smartfilelibrary.manifest import file_hash
+from smartfilelibrary.tracing import get_tracer
+from .rendercache import RenderCache, default_render_cache, render_key
+
+RENDER_ZOOM = 2
+
+def check_pdf(path : os.PathLike):
+    """Raise ValueError if path is not an existing PDF file.
+
+    Parameters:
+    ------------
+    path : os.PathLike
+        The path of the PDF file.
+    """
+    if not path.lower().endswith(".pdf"):
+        raise ValueError(f"Can only analyze PDFs! Violating instance: {path}")
+    if not os.path.isfile(path):
+        raise ValueError(f"Need an existing PDF! Violating instance: {path}")
+
+
+def render_frontpage(path : os.PathLike, zoom : float = RENDER_ZOOM) -> dict:
+    """Render page 0 of the PDF and read its page count and metadata, opening
+    the file once. The result only holds plain Python objects, such that this
+    can run in a worker process. Pass it to BaseDocumentAnalyzer.analyze.
+
+    Parameters:
+    ------------
+    path : os.PathLike
+        The path of the PDF file.
+    zoom : float
+        The render zoom.
+    """
+    import fitz
+    doc = fitz.open(path)
+    try:
+        page = doc.load_page(0)
+        pix = page.get_pixmap(matrix = fitz.Matrix(zoom, zoom))
+        return {
+            "path" : path,
+            "size" : (pix.width, pix.height),
+            "samples" : pix.samples,
+            "pagecount" : doc.page_count,
+            "metadata" : doc.metadata or {}
+        }
+    finally:
+        doc.close()
+
+
+def render_cached(path : os.PathLike, zoom : float = RENDER_ZOOM, content_hash : str = None,
+        cache : RenderCache = None) -> dict:
+    """render_frontpage, looked up in the render cache first.
+
+    Parameters:
+    ------------
+    path : os.PathLike
+        The path of the PDF file.
+    zoom : float
+        The render zoom.
+    content_hash : str
+        The hash of the file if known, see manifest.file_hash.
+    cache : RenderCache
+        The cache to use, default_render_cache() if None.
+    """
+    cache = default_render_cache() if cache is None else cache
+    key = render_key(file_hash(path) if content_hash is None else content_hash, zoom)
+    prepared = cache.get(key)
+    if prepared is None:
+        prepared = render_frontpage(path, zoom)
+        cache.put(key, prepared)
+    return dict(prepared, path=path)
+
 
 class BaseDocumentAnalyzer(metaclass=abc.ABCMeta):
     """Document analyzer base class. Provides core functionality."""
     def __init__(self):
         self.image = None
         self.path = None
+        self.prepared = None
 
-    def analyze(self, path : os.PathLike):
+    def analyze(self, path : os.PathLike, prepared : dict = None):
         """Prepare PDF file.
 
         Parameters:
         ------------
         path : os.PathLike
             The path of the PDF file.
+        prepared : dict
+            The result of render_frontpage(path), if already available.
         """
-        if not path.lower().endswith(".pdf"):
-            raise ValueError(f"Can only analyze PDFs! Violating instance: {path}")
-        if not os.path.isfile(path):
-            raise ValueError(f"Need an existing PDF! Violating instance: {path}")
+        check_pdf(path)
         self.path = path
-        self._get_image(path)
+        if prepared is None:
+            self._get_image(path)
+        else:
+            self._set_prepared(prepared)
+
+    def analyze_batch(self, documents : list) -> list:
+        """Analyze several documents. Returns one dict per document with the
+        keys title, publisher, year and pagecount. Analyzers that can run their
+        model on several documents at once override this.
+
+        Parameters:
+        ------------
+        documents : list of dict
+            Results of render_frontpage.
+        """
+        results = []
+        for prepared in documents:
+            self.analyze(prepared["path"], prepared)
+            results.append({
+                "title" : self.get_title(),
+                "publisher" : self.get_publisher(),
+                "year" : self.get_publishing_year(),
+                "pagecount" : self.get_pagecount()
+            })
+            get_tracer().capture_data(prepared["path"], "analysis", results[-1])
+        return results
 
     def _get_image(self, path : os.PathLike) -> Image:
         """Get image from PDF file, page 0.
@@ -34,41 +129,40 @@ class BaseDocumentAnalyzer(metaclass=abc.ABCMeta):
         path : os.PathLike
             The path of the PDF file.
         """
-        doc = fitz.open(path)
-        page = doc.load_page(0)
-        pix = page.get_pixmap(matrix = fitz.Matrix(2,2))
-        if config["DEBUG"]:
-            pix.save("debug-frontpage.png")
-        self.image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        doc.close()
+        self._set_prepared(render_cached(path))
+
+    def _set_prepared(self, prepared : dict):
+        """Use the rendered page and metadata from render_frontpage.
+
+        Parameters:
+        ------------
+        prepared : dict
+            The result of render_frontpage.
+        """
+        self.prepared = prepared
+        self.image = Image.frombytes("RGB", prepared["size"], prepared["samples"])
+        get_tracer().capture_image(prepared["path"], "frontpage", self.image)
 
     def get_pagecount(self):
         """
         Get the page count of the document. Be sure to first pass the
         document path using analyze."""
-        try:
-            doc = fitz.open(self.path)
-            pc = doc.page_count
-            doc.close()
-        except:
+        if self.prepared is None:
             return 0
-        return pc
+        return self.prepared["pagecount"]
 
     def get_publishing_year(self):
         """
         Get the publishing year of this document.
         """
         year = None
-        try:
-            doc = fitz.open(self.path)
-            pdfmeta = doc.metadata
-            if "creationDate" in pdfmeta and pdfmeta["creationDate"] not in (None, ""):
-                m = re.search("[1-2][0-9][0-9][0-9]", pdfmeta["creationDate"])
-                if m is not None:
-                    year = pdfmeta["creationDate"][m.span()[0] : m.span()[1]]
-            doc.close()
-        except:
-            pass
+        if self.prepared is None:
+            return year
+        pdfmeta = self.prepared["metadata"]
+        if "creationDate" in pdfmeta and pdfmeta["creationDate"] not in (None, ""):
+            m = re.search("[1-2][0-9][0-9][0-9]", pdfmeta["creationDate"])
+            if m is not None:
+                year = pdfmeta["creationDate"][m.span()[0] : m.span()[1]]
         return year
 
     @abc.abstractmethod
@@ -4,9 +4,12 @@ import torch
 import fitz
 from PIL import Image
 from transformers import VisionEncoderDecoderModel, DonutProcessor
+from transformers.modeling_outputs import BaseModelOutput
 
 from .basedocumentanalyzer import BaseDocumentAnalyzer
 from smartfilelibrary.config import config
+from smartfilelibrary.inferencemode import apply_precision
+from smartfilelibrary.tracing import get_tracer
 
 
 class DonutAnalyzer(BaseDocumentAnalyzer):
@@ -16,9 +19,20 @@ class DonutAnalyzer(BaseDocumentAnalyzer):
     The memory requirements for this model are 3GB peak usage and 2GB average usage."""
 
     HUGGINGFACE_NAME = "naver-clova-ix/donut-base-finetuned-docvqa"
+    TITLE_QUESTION = "What is the title of this document? Please doublecheck your answer."
+    PUBLISHER_QUESTION = "What is the publisher of this document? It is usually written in a corner. Please doublecheck your answer."
 
-    def __init__(self):
+    def __init__(self, precision : str = None):
+        """This is the constructor.
+
+        Parameters:
+        ------------
+        precision : str
+            "fp32", "bf16" or "int8", see inferencemode.apply_precision.
+            None uses PRECISION of the config.
+        """
         super(DonutAnalyzer, self).__init__()
+        self.precision = config["PRECISION"] if precision is None else precision
         self.processor = None
         self.model = None
         self.device = None
@@ -48,6 +62,8 @@ class DonutAnalyzer(BaseDocumentAnalyzer):
         if config["DEBUG"]:
             print(f"Loading model {self.HUGGINGFACE_NAME} done: Processing device {self.device}")
         self.model.to(self.device)
+        self.model = apply_precision(self.model, self.precision, self.device)
+        self.model.eval()
 
     def save(self, model_loc : os.PathLike, proc_loc : os.PathLike, sharding_size : str = "200MB"):
         """
@@ -78,14 +94,41 @@ class DonutAnalyzer(BaseDocumentAnalyzer):
         """
         Get the title of this document.
         """
-        a = self._ask("What is the title of this document? Please doublecheck your answer.")
-        return a
+        return self._ask(self.TITLE_QUESTION)
 
     def get_publisher(self):
         """
         Get the publisher of this document.
         """
-        return self._ask("What is the publisher of this document? It is usually written in a corner. Please doublecheck your answer.")
+        return self._ask(self.PUBLISHER_QUESTION)
+
+    def analyze_batch(self, documents : list) -> list:
+        """Analyze several documents. Returns one dict per document with the
+        keys title, publisher, year and pagecount. The model answers all
+        questions for all documents together, see _ask_batch.
+
+        Parameters:
+        ------------
+        documents : list of dict
+            Results of render_frontpage.
+        """
+        results = []
+        images = []
+        for prepared in documents:
+            self.analyze(prepared["path"], prepared)
+            images.append(self.image)
+            results.append({
+                "year" : self.get_publishing_year(),
+                "pagecount" : self.get_pagecount()
+            })
+        if not images:
+            return results
+        answers = self._ask_batch(images, [self.TITLE_QUESTION, self.PUBLISHER_QUESTION])
+        for prepared, result, (title, publisher) in zip(documents, results, answers):
+            result["title"] = title
+            result["publisher"] = publisher
+            get_tracer().capture_data(prepared["path"], "analysis", result)
+        return results
 
     def _ask(self, question : str):
         """
@@ -96,25 +139,68 @@ class DonutAnalyzer(BaseDocumentAnalyzer):
         question : str
             The question to ask.
         """
+        return self._ask_batch([self.image], [question])[0][0]
+
+    def _ask_batch(self, images : list, questions : list) -> list:
+        """
+        Ask every question about every image. Returns the answers as a list per
+        image, in the order of the questions.
+
+        The images are preprocessed and encoded once, the encoder output is reused
+        for all questions. Questions whose prompts have the same token length are
+        decoded together in one generate call for all images. Prompts of different
+        lengths are not padded into one call: the decoder uses absolute positions,
+        so padding would change the answers.
+
+        Parameters:
+        ------------
+        images : list of PIL.Image
+            The front pages.
+        questions : list of str
+            The questions to ask.
+        """
         if (self.model is None):
             raise ValueError("Must load model first.")
-        prompt = f"<s_docvqa><s_question>{question}</s_question><s_answer>"
-        decoder_input_ids = self.processor.tokenizer(prompt, add_special_tokens=False, return_tensors="pt").input_ids
-        pixel_values = self.processor(self.image, return_tensors="pt").pixel_values
-
-        outputs = self.model.generate(
-            pixel_values.to(self.device),
-            decoder_input_ids=decoder_input_ids.to(self.device),
-            max_length=self.model.decoder.config.max_position_embeddings,
-            pad_token_id=self.processor.tokenizer.pad_token_id,
-            eos_token_id=self.processor.tokenizer.eos_token_id,
-            use_cache=True,
-            bad_words_ids=[[self.processor.tokenizer.unk_token_id]],
-            return_dict_in_generate=True,
-
-        )
-
-        sequence = self.processor.batch_decode(outputs.sequences)[0]
-        sequence = sequence.replace(self.processor.tokenizer.eos_token, "").replace(self.processor.tokenizer.pad_token, "")
-        sequence = re.sub(r"<.*?>", "", sequence, count=1).strip()  
-        return self.processor.token2json(sequence)["answer"]
\ No newline at end of file
+        tokenizer = self.processor.tokenizer
+        groups = {}
+        for j, question in enumerate(questions):
+            prompt = f"<s_docvqa><s_question>{question}</s_question><s_answer>"
+            ids = tokenizer(prompt, add_special_tokens=False, return_tensors="pt").input_ids[0]
+            groups.setdefault(len(ids), []).append((j, ids))
+
+        answers = [[None] * len(questions) for _ in images]
+        with torch.inference_mode():
+            pixel_values = self.processor(images, return_tensors="pt").pixel_values
+            hidden = self.model.encoder(pixel_values=pixel_values.to(self.device, self.model.dtype)).last_hidden_state
+            for group in groups.values():
+                k = len(group)
+                # row r belongs to image r // k and question group[r % k]
+                decoder_input_ids = torch.stack([ids for _, ids in group]).repeat(len(images), 1)
+                outputs = self.model.generate(
+                    encoder_outputs=BaseModelOutput(last_hidden_state=hidden.repeat_interleave(k, dim=0)),
+                    decoder_input_ids=decoder_input_ids.to(self.device),
+                    max_length=self.model.decoder.config.max_position_embeddings,
+                    pad_token_id=tokenizer.pad_token_id,
+                    eos_token_id=tokenizer.eos_token_id,
+                    use_cache=True,
+                    bad_words_ids=[[tokenizer.unk_token_id]],
+                    return_dict_in_generate=True,
+                )
+                for r, sequence in enumerate(self.processor.batch_decode(outputs.sequences)):
+                    i, q = divmod(r, k)
+                    answers[i][group[q][0]] = self._decode(sequence)
+        return answers
+
+    def _decode(self, sequence : str) -> str:
+        """
+        Extract the answer from a decoded output sequence.
+
+        Parameters:
+        ------------
+        sequence : str
+            The decoded sequence.
+        """
+        tokenizer = self.processor.tokenizer
+        sequence = sequence.replace(tokenizer.eos_token, "").replace(tokenizer.pad_token, "")
+        sequence = re.sub(r"<.*?>", "", sequence, count=1).strip()
+        return self.processor.token2json(sequence)["answer"]
@@ -6,6 +6,8 @@ from transformers import AutoModelForCausalLM, AutoTokenizer
 
 from .basedocumentanalyzer import BaseDocumentAnalyzer
 from smartfilelibrary.config import config
+from smartfilelibrary.inferencemode import apply_precision
+from smartfilelibrary.tracing import get_tracer
 
 
 class Moondream2(BaseDocumentAnalyzer):
@@ -13,9 +15,27 @@ class Moondream2(BaseDocumentAnalyzer):
 
     HUGGINGFACE_NAME = "vikhyatk/moondream2"
     REVISION = "2024-05-08"
+    TITLE_QUESTION = "What is the title?"
+    PUBLISHER_QUESTION = "What is the name of the publisher? Just return the name."
 
-    def __init__(self):
+    def __init__(self, batchsize : int = 16, max_new_tokens : int = 128, precision : str = None):
+        """This is the constructor.
+
+        Parameters:
+        ------------
+        batchsize : int
+            Maximum number of (document, question) pairs answered in one generate
+            call. Lower this to reduce the peak memory.
+        max_new_tokens : int
+            Maximum length of an answer in tokens, for the batched answers.
+        precision : str
+            "fp32", "bf16" or "int8", see inferencemode.apply_precision.
+            None uses PRECISION of the config.
+        """
         super(Moondream2, self).__init__()
+        self.batchsize = batchsize
+        self.max_new_tokens = max_new_tokens
+        self.precision = config["PRECISION"] if precision is None else precision
         self.tokenizer = None
         self.model = None
         self.device = None
@@ -40,14 +60,17 @@ class Moondream2(BaseDocumentAnalyzer):
         if config["DEBUG"]:
             print(f"Loading model {self.HUGGINGFACE_NAME}")
 
-        self.tokenizer = AutoTokenizer.from_pretrained(HUGGINGFACE_NAME, revision=REVISION, trust_remote_code=True)
+        self.tokenizer = AutoTokenizer.from_pretrained(self.HUGGINGFACE_NAME, revision=self.REVISION,
+            trust_remote_code=True)
         self.model = AutoModelForCausalLM.from_pretrained(
-            HUGGINGFACE_NAME, revision=REVISION, trust_remote_code=True
+            self.HUGGINGFACE_NAME, revision=self.REVISION, trust_remote_code=True
         )
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         if config["DEBUG"]:
             print(f"Loading model {self.HUGGINGFACE_NAME} done: Processing device {self.device}")
         self.model.to(self.device)
+        self.model = apply_precision(self.model, self.precision, self.device)
+        self.model.eval()
 
     def save(self, model_loc : os.PathLike, proc_loc : os.PathLike, sharding_size : str = "200MB"):
         """
@@ -74,23 +97,52 @@ class Moondream2(BaseDocumentAnalyzer):
         """Get the name of the method to extract metadata."""
         return self.HUGGINGFACE_NAME
 
-    def _get_image(self, path : os.PathLike):
-        """Get the image of the first page and encode the image.
+    def _set_prepared(self, prepared : dict):
+        """Use the image of the first page. It is encoded on the first question.
         """
-        super(Moondream2, self)._get_image(path)
-        self.enc_image = model.encode_image(self.image)
+        super(Moondream2, self)._set_prepared(prepared)
+        self.enc_image = None
 
     def get_title(self):
         """
         Get the title of this document.
         """
-        return self._ask("What is the title?")
+        return self._ask(self.TITLE_QUESTION)
 
     def get_publisher(self):
         """
         Get the publisher of this document.
         """
-        return self._ask("What is the name of the publisher? Just return the name.")
+        return self._ask(self.PUBLISHER_QUESTION)
+
+    def analyze_batch(self, documents : list) -> list:
+        """Analyze several documents. Returns one dict per document with the
+        keys title, publisher, year and pagecount. The front pages are encoded
+        together and all questions are answered in batched generate calls,
+        see _ask_batch.
+
+        Parameters:
+        ------------
+        documents : list of dict
+            Results of render_frontpage.
+        """
+        results = []
+        images = []
+        for prepared in documents:
+            self.analyze(prepared["path"], prepared)
+            images.append(self.image)
+            results.append({
+                "year" : self.get_publishing_year(),
+                "pagecount" : self.get_pagecount()
+            })
+        if not images:
+            return results
+        answers = self._ask_batch(images, [self.TITLE_QUESTION, self.PUBLISHER_QUESTION])
+        for prepared, result, (title, publisher) in zip(documents, results, answers):
+            result["title"] = title
+            result["publisher"] = publisher
+            get_tracer().capture_data(prepared["path"], "analysis", result)
+        return results
 
     def _ask(self, question : str):
         """
@@ -103,6 +155,70 @@ class Moondream2(BaseDocumentAnalyzer):
         """
         if (self.model is None):
             raise ValueError("Must load model first.")
-        if (self.enc_image is None):
-            raise ValueError("Must encode image first")
-        return self.model.answer_question(self.enc_image, question, self.tokenizer)
\ No newline at end of file
+        if (self.image is None):
+            raise ValueError("Must analyze a document first")
+        with torch.inference_mode():
+            if (self.enc_image is None):
+                self.enc_image = self.model.encode_image(self.image)
+            return self.model.answer_question(self.enc_image, question, self.tokenizer)
+
+    def _ask_batch(self, images : list, questions : list) -> list:
+        """
+        Ask every question about every image. Returns the answers as a list per
+        image, in the order of the questions.
+
+        The images are encoded in one pass of the vision encoder for all images
+        of a chunk. The prompts of all (image, question) pairs are then left
+        padded and answered in one generate call per chunk of batchsize pairs.
+
+        Parameters:
+        ------------
+        images : list of PIL.Image
+            The front pages.
+        questions : list of str
+            The questions to ask.
+        """
+        if (self.model is None):
+            raise ValueError("Must load model first.")
+        answers = [[None] * len(questions) for _ in images]
+        per_chunk = max(self.batchsize // max(len(questions), 1), 1)
+        with torch.inference_mode():
+            for start in range(0, len(images), per_chunk):
+                chunk = images[start : start + per_chunk]
+                image_embeds = self.model.encode_image(chunk)
+                embeds = []
+                for i in range(len(chunk)):
+                    for question in questions:
+                        prompt = f"<image>\n\nQuestion: {question}\n\nAnswer:"
+                        embeds.append(self.model.input_embeds(prompt, image_embeds[i : i + 1], self.tokenizer)[0])
+                for r, answer in enumerate(self._generate(embeds)):
+                    i, j = divmod(r, len(questions))
+                    answers[start + i][j] = answer
+        return answers
+
+    def _generate(self, embeds : list) -> list:
+        """
+        Generate the answers for a batch of prompt embeddings, left padded to
+        the same length.
+
+        Parameters:
+        ------------
+        embeds : list of torch.Tensor
+            The prompt embeddings, sequence length x hidden size each.
+        """
+        longest = max(e.shape[0] for e in embeds)
+        padded = []
+        mask = torch.zeros(len(embeds), longest, dtype=torch.long, device=embeds[0].device)
+        for r, e in enumerate(embeds):
+            padding = torch.zeros(longest - e.shape[0], e.shape[1], dtype=e.dtype, device=e.device)
+            padded.append(torch.cat([padding, e], dim=0))
+            mask[r, longest - e.shape[0]:] = 1
+        output_ids = self.model.text_model.generate(
+            inputs_embeds=torch.stack(padded),
+            attention_mask=mask,
+            eos_token_id=self.tokenizer.eos_token_id,
+            bos_token_id=self.tokenizer.bos_token_id,
+            pad_token_id=self.tokenizer.bos_token_id,
+            max_new_tokens=self.max_new_tokens,
+        )
+        return [x.strip() for x in self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)]
@@ -1,34 +1,34 @@
 import re
 import os
-import pickle
 from typing import Union
 import fitz
 from PIL import Image
 
-from smartfilelibrary.crossref_db import getDB
+from smartfilelibrary.crossref_db import getDB, harvest_key
+from smartfilelibrary.metadatastore import CrossrefStore
 from .basedocumentanalyzer import BaseDocumentAnalyzer
 
-def _search(pth : str, metalib : list) -> Union[None, dict]:
-    """Search for the publication within the metadata db.
+def _search(pth : str, store : CrossrefStore) -> Union[None, dict]:
+    """Search for the publication within the metadata db. The filename
+    is looked up as ISBN, then as DOI.
 
     Parameters
     -----------
     pth : str
         The path of the book (pdf) in question.
-    metalib : list
-        The metadata db from crossref.
+    store : CrossrefStore
+        The metadata db from crossref, None if not used.
     """
-    isbn = pth.split(".")[0].replace("-", "")
-    for book in metalib:
-        try:
-            if isinstance(book['ISBN'], list):
-                if isbn in book['ISBN']:
-                    return book
-            elif book['ISBN'] == isbn:
-                return book
-        except KeyError:
-            pass
-    return None
+    if store is None:
+        return None
+    book = store.lookup_isbn(pth.split(".")[0])
+    if book is None:
+        doi = os.path.splitext(pth)[0]
+        book = store.lookup_doi(doi)
+        if book is None and "/" not in doi:
+            # DOI file names usually have the slash replaced
+            book = store.lookup_doi(doi.replace("_", "/", 1))
+    return book
 
 
 class PdfMetaAnalyzer(BaseDocumentAnalyzer):
@@ -44,10 +44,9 @@ class PdfMetaAnalyzer(BaseDocumentAnalyzer):
         super(PdfMetaAnalyzer, self).__init__()
         self.fetch_metadb = fetch_metadb
         self.pub = publisher
-        self.db = []
+        self.db = None
         self.metabook = None
         self.book_path = None
-        self.bookobj = None
 
     def load(self, model_loc : os.PathLike = "", proc_loc : os.PathLike = ""):
         """
@@ -60,18 +59,19 @@ class PdfMetaAnalyzer(BaseDocumentAnalyzer):
         ------------
         Parameters are for interface conformance. They will be ignored.
         """
-        dbname = f"{ self.pub.replace(' ', '_') }_crossref_mdb.dump"
-        if not os.path.exists(dbname) and self.fetch_metadb:
-            self.db = getDB(self.pub, formtype="book", max_results = self.MAXENTRYCROSSREF)
-            with open(dbname, "wb") as f:
-                pickle.dump(self.db, f)
-        elif not self.fetch_metadb:
-            self.db = []
+        dbname = f"{ self.pub.replace(' ', '_') }_crossref_mdb"
+        if not self.fetch_metadb:
+            self.db = None
+        elif not os.path.exists(dbname + ".sqlite") and os.path.exists(dbname + ".dump"):
+            print("[Info] Found previous metadata DB in the old format. Converting.")
+            self.db = CrossrefStore(dbname + ".sqlite")
+            self.db.import_pickle(dbname + ".dump")
+            self.db.set_checkpoint(harvest_key(self.pub, "book"), "*", len(self.db), True)
+            print("[Info] Converting metadata DB done.")
         else:
-            print("[Info] Found previous metadata DB. Loading.")
-            with open(dbname, "rb") as f:
-                self.db = pickle.load(f)
-            print("[Info] Loading metadata DB done.")
+            # Fetches, resumes an interrupted fetch or does nothing if complete.
+            self.db = CrossrefStore(dbname + ".sqlite")
+            getDB(self.pub, formtype="book", max_results = self.MAXENTRYCROSSREF, store = self.db)
 
     def save(self, model_loc : os.PathLike, proc_loc : os.PathLike, sharding_size : str = "200MB"):
         """
@@ -83,13 +83,10 @@ class PdfMetaAnalyzer(BaseDocumentAnalyzer):
         """
         return None
 
-    def analyze(self, path : os.PathLike):
-        super().analyze(path)
+    def analyze(self, path : os.PathLike, prepared : dict = None):
+        super().analyze(path, prepared)
         self.book_path = path
         self.metabook = _search(os.path.split(path)[1], self.db)
-        if self.bookobj is not None:
-            self.bookobj.close()
-        self.bookobj = fitz.open(path)
 
     def get_extraction_name(self):
         """Get the name of the method to extract metadata."""
@@ -105,7 +102,7 @@ class PdfMetaAnalyzer(BaseDocumentAnalyzer):
         except:
             pass
 
-        pdfmeta = self.bookobj.metadata
+        pdfmeta = self.prepared["metadata"]
         if "title" in pdfmeta and pdfmeta["title"] not in (None, ""):
             title = pdfmeta["title"]
 
@@ -0,0 +1,122 @@
+import os
+import zlib
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Union
+
+from smartfilelibrary.config import config
+
+
+def render_key(content_hash : str, zoom : float) -> str:
+    """Get the cache key of a rendered front page.
+
+    Parameters:
+    ------------
+    content_hash : str
+        The hash of the PDF file, see manifest.file_hash.
+    zoom : float
+        The render zoom.
+    """
+    return f"{content_hash}-{zoom}"
+
+
+class RenderCache:
+    """Cache for the results of render_frontpage. Keeps the most recently used
+    pages in memory, up to maxbytes of pixel data. If a directory is given,
+    pages are also stored there, with zlib compressed pixels, and survive
+    the process."""
+
+    def __init__(self, maxbytes : int = 256 << 20, directory : os.PathLike = None):
+        """This is the constructor.
+
+        Parameters:
+        ------------
+        maxbytes : int
+            Maximum size of the pixel data kept in memory.
+        directory : os.PathLike
+            Where to store the pages on disk. None keeps them in memory only.
+        """
+        self.maxbytes = maxbytes
+        self.directory = directory
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key : str) -> Union[None, dict]:
+        """Get the page stored under key, None if unknown.
+
+        Parameters:
+        ------------
+        key : str
+            See render_key.
+        """
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is not None:
+                self._entries.move_to_end(key)
+                return prepared
+        if self.directory is None:
+            return None
+        try:
+            with open(self._diskpath(key), "rb") as f:
+                prepared = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        prepared["samples"] = zlib.decompress(prepared["samples"])
+        self._remember(key, prepared)
+        return prepared
+
+    def put(self, key : str, prepared : dict):
+        """Store a page.
+
+        Parameters:
+        ------------
+        key : str
+            See render_key.
+        prepared : dict
+            The result of render_frontpage.
+        """
+        self._remember(key, prepared)
+        if self.directory is None:
+            return
+        stored = dict(prepared, samples=zlib.compress(prepared["samples"], 1))
+        tmp = f"{self._diskpath(key)}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(stored, f)
+        os.replace(tmp, self._diskpath(key))
+
+    def clear(self):
+        """Forget the pages held in memory."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _remember(self, key : str, prepared : dict):
+        size = len(prepared["samples"])
+        if size > self.maxbytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= len(self._entries.pop(key)["samples"])
+            self._entries[key] = prepared
+            self.nbytes += size
+            while self.nbytes > self.maxbytes:
+                _, old = self._entries.popitem(last=False)
+                self.nbytes -= len(old["samples"])
+
+    def _diskpath(self, key : str) -> str:
+        return os.path.join(self.directory, f"{key}.page")
+
+
+_default_cache = None
+
+def default_render_cache() -> RenderCache:
+    """Get the render cache shared by the analyzers, configured from
+    RENDER_CACHE_MB and RENDER_CACHE_DIR in the config on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = RenderCache(config["RENDER_CACHE_MB"] << 20, config["RENDER_CACHE_DIR"])
+    return _default_cache
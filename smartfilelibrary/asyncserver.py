@@ -0,0 +1,218 @@
+"""Provides the REST server for the webinterface as an asyncio (ASGI) application.
+Same routes and answers as liveserver, but all requests are served by one
+event loop on a pool of asyncpg connections. Needs starlette, uvicorn and asyncpg.
+
+    python3 -m smartfilelibrary.asyncserver db_name user_name
+"""
+import os
+import sys
+import json
+import signal
+import asyncio
+from getpass import getpass
+from contextlib import asynccontextmanager
+
+try:
+    import asyncpg
+    from starlette.applications import Starlette
+    from starlette.datastructures import MutableHeaders
+    from starlette.exceptions import HTTPException
+    from starlette.responses import JSONResponse, Response, StreamingResponse
+    from starlette.routing import Route
+except ImportError as e:
+    raise ImportError(f"{e}. The async server needs starlette, uvicorn and asyncpg, "
+        "fix by executing 'pip3 install starlette uvicorn asyncpg'.") from e
+
+from .config import config
+from .liveserver import MAXPAGESIZE, _search_books, _rank_books, _to_entry
+from .databaseinterface import _numbered
+from .actionlog import ActionLog
+
+
+def get_argument(request, arg : str) -> str:
+    """Get argument from the request. Returns empty string if not available.
+
+    Parameter
+    ----------
+    request : starlette.requests.Request
+        The request.
+    arg : str
+        The argument from the request.
+    """
+    return request.query_params.get(arg, "")
+
+
+def _int_argument(request, arg : str):
+    """Get an integer argument from the request. Returns None if not given,
+    fails the request with 400 if it is not a non-negative integer."""
+    value = get_argument(request, arg)
+    if value == "":
+        return None
+    if not value.isdigit():
+        raise HTTPException(400)
+    return int(value)
+
+
+def _acquire(request):
+    """Take a connection from the pool, waiting at most LIVESERVER_POOL_TIMEOUT seconds."""
+    return request.app.state.pool.acquire(timeout=request.app.state.timeout)
+
+
+async def get_status(request):
+    """Send status."""
+    return JSONResponse({"status" : "running"})
+
+
+async def get_dbmeta(request):
+    """Get metadata about the library. So far, it only accepts
+    ?key=user to return the username."""
+    if get_argument(request, "key") == "user":
+        return JSONResponse(request.app.state.username)
+    raise HTTPException(400)
+
+
+async def shutdown(request):
+    os.kill(os.getpid(), signal.SIGINT)
+    return Response("")
+
+
+async def set_fav(request):
+    """
+    Update the favourite status using the web interface.
+    Done as GET method for convenience.
+    """
+    bid = _int_argument(request, "id")
+    if bid is None:
+        raise HTTPException(400)
+    value = get_argument(request, "val") == "1"
+    async with _acquire(request) as conn:
+        await conn.execute("""UPDATE Book
+        SET favorite = $1
+        WHERE book_id = $2;""", value, bid)
+    log = request.app.state.log
+    log.statement("UPDATE Book SET favorite = %s WHERE book_id = %s;", (value, bid))
+    # Writing and syncing blocks, not on the event loop.
+    await asyncio.to_thread(log.flush)
+    return Response("")
+
+
+async def query_db(request):
+    """Query main entry point, see liveserver.query_db."""
+    query = get_argument(request, "kw")
+    form = get_argument(request, "form")
+    cursor = _int_argument(request, "cursor")
+    limit = _int_argument(request, "limit")
+    if limit is not None:
+        limit = min(max(limit, 1), MAXPAGESIZE)
+
+    text = get_argument(request, "q")
+    if text != "":
+        limit = MAXPAGESIZE if limit is None else limit
+        sql, params = _rank_books(text, query, form, 0 if cursor is None else cursor, limit)
+    else:
+        sql, params = _search_books(query, form, cursor, limit)
+    sql = _numbered(sql)
+
+    if get_argument(request, "stream") == "1":
+        async def generate():
+            async with _acquire(request) as conn, conn.transaction():
+                async for row in conn.cursor(sql, *params, prefetch=2000):
+                    yield json.dumps(_to_entry(row)) + "\n"
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    async with _acquire(request) as conn:
+        ret = [_to_entry(row) for row in await conn.fetch(sql, *params)]
+    nextcursor = None
+    if limit is not None and len(ret) == limit:
+        nextcursor = ret[-1]["id"] if text == "" else (0 if cursor is None else cursor) + limit
+
+    if ret == [] and cursor is None:
+        ret = [{"title" : "Could not find any matches.",
+            "author" : "",
+            "keywords" : [],
+            "favourite" : False
+            }]
+    response = JSONResponse(ret)
+    if nextcursor is not None:
+        response.headers["X-Next-Cursor"] = str(nextcursor)
+    return response
+
+
+async def busy(request, exc):
+    """All connections stayed in use for LIVESERVER_POOL_TIMEOUT seconds."""
+    return JSONResponse({"error" : "No free database connection."}, status_code=503)
+
+
+class _CorsHeaders:
+    """Add the CORS headers to every response, like liveserver.add_header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["Access-Control-Allow-Origin"] = "*"
+                headers["Access-Control-Expose-Headers"] = "X-Next-Cursor"
+            await send(message)
+        await self.app(scope, receive, send_with_headers)
+
+
+def create_app(dbname : str, user : str, password : str, minconn : int = None,
+        maxconn : int = None, timeout : float = None, **kwargs):
+    """Create the ASGI application. The connection pool and the action log
+    (LOG_FILE of the config) are opened on startup. Defaults are
+    LIVESERVER_POOL_MIN, LIVESERVER_POOL_MAX and LIVESERVER_POOL_TIMEOUT of the
+    config.
+
+    Parameter
+    ----------
+    dbname : str
+        Database name in PostgreSQL.
+    user : str
+        The name of the user in PostgreSQL.
+    password : str
+        The password for the user in PostgreSQL.
+    kwargs
+        Passed to asyncpg.create_pool, like host (default localhost).
+    """
+    kwargs.setdefault("host", "localhost")
+
+    @asynccontextmanager
+    async def lifespan(app):
+        app.state.username = user
+        app.state.log = ActionLog(config["LOG_FILE"])
+        app.state.timeout = config["LIVESERVER_POOL_TIMEOUT"] if timeout is None else timeout
+        async with asyncpg.create_pool(database=dbname, user=user, password=password,
+                min_size=config["LIVESERVER_POOL_MIN"] if minconn is None else minconn,
+                max_size=config["LIVESERVER_POOL_MAX"] if maxconn is None else maxconn,
+                **kwargs) as pool:
+            app.state.pool = pool
+            yield
+        app.state.log.close()
+
+    app = Starlette(routes=[
+            Route("/status", get_status),
+            Route("/dbmeta", get_dbmeta),
+            Route("/turnoff", shutdown),
+            Route("/set_fav", set_fav),
+            Route("/query", query_db),
+        ],
+        exception_handlers={TimeoutError : busy},
+        lifespan=lifespan)
+    return _CorsHeaders(app)
+
+
+def main():
+    """Main loop for the async server."""
+    import uvicorn
+    if len(sys.argv) != 3:
+        print("[Error] asyncserver.py expects arguments db_name, user_name")
+        quit()
+    pw = getpass("Please enter the password for the DB: ")
+    uvicorn.run(create_app(sys.argv[1], sys.argv[2], pw), host="127.0.0.1", port=5000)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,70 @@
 config = {
 
-	"DEBUG" : True
+	"DEBUG" : True,
+
+	## Tracing, see tracing.Tracer
+	# Directory receiving the artifacts (front page renders, analysis results)
+	# of the analyzed documents, one subdirectory per run. None: no tracing.
+	"TRACE_DIR" : None,
+	# Fraction of the documents to capture.
+	"TRACE_SAMPLE_RATE" : 1.0,
+
+	## Directory analysis pipeline, see utilities.get_books
+	# Processes rendering the PDFs. None: number of CPUs, 0: render in the main process.
+	"RENDER_WORKERS" : None,
+	# Maximum number of rendered documents waiting for the analyzer.
+	"RENDER_QUEUE_DEPTH" : 32,
+	# Memory for rendered front pages, in MB. Rerunning previews reuses them.
+	"RENDER_CACHE_MB" : 256,
+	# Directory keeping rendered front pages across runs. None: memory only.
+	"RENDER_CACHE_DIR" : None,
+	# Number of documents passed to the analyzer at once.
+	"ANALYZER_BATCHSIZE" : 8,
+	# Threads running the keyword model next to the analyzer.
+	"KEYWORD_WORKERS" : 1,
+	# Pause in seconds after each keyword model call. Only needed for rate limited APIs.
+	"KEYWORD_DELAY" : 0.0,
+
+	## Model inference, see inferencemode
+	# Precision of the AI models: "fp32", "bf16" or "int8" (dynamic quantization, CPU only).
+	"PRECISION" : "fp32",
+	# Torch threads within an operation. None: torch default, the number of physical cores.
+	"TORCH_THREADS" : None,
+	# Torch threads running operations in parallel. None: torch default.
+	"TORCH_INTEROP_THREADS" : None,
+
+	## Model server, see modelserver
+	# Use the models of a running model server instead of loading them.
+	"USE_MODEL_SERVER" : False,
+	# Unix socket path or "host:port". None: a socket in a directory only the user
+	# can access, $XDG_RUNTIME_DIR/smartfilelibrary or ~/.cache/smartfilelibrary.
+	"MODEL_SERVER_ADDRESS" : None,
+	# Shared secret of server and clients, required for "host:port". None with a Unix
+	# socket: the server writes a random one next to the socket (readable by the user).
+	"MODEL_SERVER_AUTHKEY" : None,
+
+	## Action log, see actionlog.ActionLog
+	# File receiving the statements modifying the library, for replays.
+	"LOG_FILE" : "locallog.sfl",
+	# When to sync the log to disk: "commit" (whenever a commit writes it) or "never" (the OS decides).
+	"LOG_FSYNC" : "commit",
+	# Bytes of log of an open transaction kept in memory, more wait in a temporary file.
+	"LOG_BUFFER_SIZE" : 1 << 20,
+
+	## Parallel writers, see ingest
+	# Processes analyzing and inserting documents. None: number of CPUs.
+	"INGEST_WORKERS" : None,
+	# Documents a writer analyzes and commits in one transaction.
+	"INGEST_CHUNK" : 16,
+	# How often a transaction aborted by a serialization failure or deadlock is tried again.
+	"WRITE_RETRIES" : 5,
+
+	## Liveserver, see liveserver.ConnectionPool
+	# Database connections kept open.
+	"LIVESERVER_POOL_MIN" : 1,
+	# Maximum number of database connections, one per concurrent request.
+	"LIVESERVER_POOL_MAX" : 16,
+	# Seconds a request waits for a free connection before failing with 503.
+	"LIVESERVER_POOL_TIMEOUT" : 10.0
 
 }
@@ -1,7 +1,15 @@
 """The metadata database loading utilities, using the crossref API."""
+import json
 import time
-import pickle
-from crossref_commons.iteration import iterate_publications_as_json
+from typing import Callable
+
+from crossref_commons.config import API_URL
+from crossref_commons.http_utils import remote_call
+from crossref_commons.utils import to_filter_string
+
+from .metadatastore import CrossrefStore
+
+ROWS_PER_REQUEST = 1000
 
 def _find_pdf_entry(l):
 	for elt in l:
@@ -10,10 +18,77 @@ def _find_pdf_entry(l):
 	return None
 
 
-def getDB(pub_name : str, formtype : str, max_results : int):
+def _keep(p : dict) -> bool:
+	"""Whether to keep the publication: It must either link a PDF or have no links."""
+	try:
+		elt = _find_pdf_entry(p['link'])
+	except KeyError:
+		elt = p
+	return elt is not None
+
+
+def _iterate_pages(filter : dict, queries : dict, max_results : int, cursor : str,
+		seen : int, fetch : Callable):
+	"""
+	Iterate over the result pages of a crossref query using deep paging. Yields the
+	items of a page, the cursor of the next page and the number of items seen so far.
+
+	Parameters
+	-----------
+	filter : dict
+		The crossref filter.
+	queries : dict
+		The crossref queries.
+	max_results : int
+		Maximum number of items.
+	cursor : str
+		The cursor to start at, '*' for the first page.
+	seen : int
+		Number of items seen before cursor.
+	fetch : Callable
+		Does the request, like crossref_commons.http_utils.remote_call.
+	"""
+	params = dict(queries)
+	params['filter'] = to_filter_string(filter)
+	while seen < max_results:
+		params['cursor'] = cursor
+		params['rows'] = min(ROWS_PER_REQUEST, max_results - seen)
+		code, results = fetch(API_URL, 'works', params=params)
+		if code != 200:
+			raise ConnectionError(f"API returned code {code}")
+		message = json.loads(results)['message']
+		items = message['items'][:max_results - seen]
+		if not items:
+			return
+		seen += len(items)
+		cursor = message['next-cursor']
+		yield items, cursor, seen
+
+
+def harvest_key(pub_name : str, formtype : str) -> str:
+	"""
+	The key of the checkpoint of a harvest in the CrossrefStore.
+
+	Parameters
+	-----------
+	pub_name : str
+		The publisher name.
+	formtype : str
+		The form, like 'book'.
+	"""
+	return json.dumps([{ 'type' : formtype }, { 'query.publisher-name' : pub_name }], sort_keys=True)
+
+
+def getDB(pub_name : str, formtype : str, max_results : int, store : CrossrefStore = None,
+		fetch : Callable = remote_call):
 	"""
 	Get metadata DB from crossref.
 
+	Without store, returns the list of publications. With store, every page is
+	written to the store together with a checkpoint of the crossref cursor, and
+	the store is returned. A harvest that was interrupted then continues from the
+	last checkpoint on the next call, a finished harvest is not repeated.
+
 	Parameters
 	-----------
 	pub_name : str
@@ -22,26 +97,93 @@ def getDB(pub_name : str, formtype : str, max_results : int):
 		The form, like 'book', see DatabaseInterface.
 	max_results : int
 		Maximum number of entries.
+	store : CrossrefStore
+		Where to write the publications.
+	fetch : Callable
+		Does the requests. Default is the crossref API, see fixture_fetch to
+		work from a recorded fixture.
 	"""
 	filter = { 'type' : formtype }
 	queries = { 'query.publisher-name' : pub_name }
+	key = harvest_key(pub_name, formtype)
 	fullinfo = []
-	i = 0	
+	cursor, seen, done = "*", 0, False
+	if store is not None:
+		checkpoint = store.get_checkpoint(key)
+		if checkpoint is not None:
+			cursor, seen, done = checkpoint
+		if done:
+			print(f"[Info] Crossref DB for publisher {pub_name} is complete.")
+			return store
+		if cursor != "*":
+			print(f"[Info] Resuming crossref DB for publisher {pub_name} after {seen} entries.")
+
+	i = 0
 	ts = time.monotonic()
 	print(f"[Info] Start fetching crossref DB for publisher {pub_name}. This may take a while...")
-	for p in iterate_publications_as_json(max_results=max_results + 1, filter=filter, queries=queries):
+	while True:
 		try:
-			elt = _find_pdf_entry(p['link'])
-		except KeyError:
-			elt = p
-		if elt is None:
-			continue
-		fullinfo.append(p)
-		i += 1
+			for items, cursor, seen in _iterate_pages(filter, queries, max_results + 1, cursor, seen, fetch):
+				chunk = [p for p in items if _keep(p)]
+				if store is None:
+					fullinfo.extend(chunk)
+				else:
+					store.add(chunk, checkpoint=(key, cursor, seen, False))
+				i += len(chunk)
+			break
+		except ConnectionError:
+			if cursor == "*" or i > 0:
+				raise
+			# Crossref cursors expire after some minutes. Start over, the store skips known entries.
+			print(f"[Warning] Could not resume the crossref cursor, starting over.")
+			cursor, seen = "*", 0
+
+	if store is not None:
+		store.set_checkpoint(key, cursor, seen, True)
+		i = len(store)
 	print(f"[Info] Fetched {i} entries from crossref on publisher {pub_name} in {time.monotonic() - ts} seconds")
 	if i < 2:
 		print(f"[Warning] Something has gone wrong finding the DB for the publisher {pub_name} "
 			"on crossref. Are you sure you use the correct name? "
 			"For more information, take a look at the official crossref website.")
-		return []
-	return fullinfo
\ No newline at end of file
+		return [] if store is None else store
+	return fullinfo if store is None else store
+
+
+def recording_fetch(fixture : str, fetch : Callable = remote_call) -> Callable:
+	"""
+	Wrap fetch such that every answer is appended to the fixture file.
+
+	Parameters
+	-----------
+	fixture : str
+		The fixture file, one JSON object per line.
+	fetch : Callable
+		The wrapped fetch function.
+	"""
+	def record(url, path, params={}):
+		code, results = fetch(url, path, params=params)
+		with open(fixture, "a") as f:
+			f.write(json.dumps({"cursor" : params.get("cursor"), "code" : code, "results" : results}) + "\n")
+		return code, results
+	return record
+
+
+def fixture_fetch(fixture : str) -> Callable:
+	"""
+	Get a fetch function for getDB answering from a fixture written by recording_fetch,
+	without network access. Requests are matched by their cursor.
+
+	Parameters
+	-----------
+	fixture : str
+		The fixture file.
+	"""
+	with open(fixture, "r") as f:
+		answers = {}
+		for line in f:
+			entry = json.loads(line)
+			answers[entry["cursor"]] = (entry["code"], entry["results"])
+	def replay(url, path, params={}):
+		return answers.get(params.get("cursor"), (404, ""))
+	return replay
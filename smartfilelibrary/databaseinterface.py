@@ -1,26 +1,63 @@
 """The DatabaseInterface is the main programming interface to the user."""
 
 import os
+import re
+import time
+import random
 import pickle
-from typing import Collection
+import importlib
+from itertools import islice, count
+from typing import Collection, Iterable
 
 from .utilities import get_books, write_actions_to_db
-from .analyzers.donut_base_finetuned import DonutAnalyzer
-from .analyzers.pdfmetaanalyzer import PdfMetaAnalyzer
-from .analyzers.moondream2 import Moondream2
-from .keywordinference.t5derivative import T5Derivative
+from .manifest import FileManifest, file_hash, hash_files
+from .inferencemode import set_threads
+from .modelserver import remote_model
+from .actionlog import ActionLog, is_action_log, replay
+from .config import config
 
 import psycopg2
-try:
-	from transformers import pipeline
-except ImportError:
-	print("ERROR: COULD NOT IMPORT TRANSFORMERS. "
-		"AI model functionality will thus not be available.\n"
-		"Fix by executing 'pip3 install transformers'.")
-	def pipeline(**kwargs):
-		def func(arg, **kwargs):
-			return [{"generated_text":""}]
-		return func
+from psycopg2.extras import execute_values
+
+_stream_ids = count(1)
+
+
+def _numbered(sql : str) -> str:
+	"""
+	Replace the %s placeholders of psycopg2 by the $1, $2, ... of PREPARE
+	and asyncpg, and the escaped %% by %.
+
+	Parameters
+	-----------
+	sql : str
+		The SQL string, as for psycopg2 with parameters.
+	"""
+	n = count(1)
+	return re.sub(r"%[s%]", lambda m: "%" if m.group() == "%%" else f"${next(n)}", sql)
+
+
+def stream_rows(conn, command : str, params : Collection = None, itersize : int = 2000):
+	"""
+	Run a read-only SQL query on a server-side (named) cursor of conn and yield
+	the rows. Only itersize rows are held in memory at any time.
+
+	Parameters
+	-----------
+	conn : psycopg2 connection
+		The connection to use.
+	command : str
+		SQL query to execute.
+	params : collection
+		Optional parameters for the placeholders (%s) in command.
+	itersize : int
+		Number of rows fetched from the server per round trip.
+	"""
+	with conn.cursor(name=f"sfl_stream_{next(_stream_ids)}") as cur:
+		cur.itersize = itersize
+		cur.execute(command, params)
+		for row in cur:
+			yield row
+
 
 
 
@@ -29,6 +66,37 @@ class DatabaseInterface:
 	"""Interfaces with a database and will make sure that all actions are committed. Furthermore,
 	it will log all that has been executed such that mistakes can be undone by redoing everything."""
 	MAXOUTPUTLENGTH = 2048
+	# Statements of the frequent inserts. Prepared on the server on first use,
+	# see execute_prepared. A book and its topics are one statement (one round trip).
+	# The ids are assigned by the database and returned. A topic or publisher that
+	# another writer added meanwhile is not inserted again, nothing is returned.
+	PREPARED = {
+		"sfl_book" : "WITH book AS (INSERT INTO Book (title, year, pub_id, form_id, favorite) "
+			"VALUES (%s, %s, %s, %s, %s) RETURNING book_id), "
+			"topics AS (INSERT INTO book_topic (book_id, topic_name) "
+			"SELECT book_id, unnest(%s::VARCHAR(40)[]) FROM book) "
+			"SELECT book_id FROM book;",
+		"sfl_topic" : "INSERT INTO Topic (topic_name) VALUES (%s) ON CONFLICT DO NOTHING "
+			"RETURNING topic_name;",
+		"sfl_subtopic" : "INSERT INTO subtopic_of (basetopic_name, subtopic_name) VALUES (%s, %s);",
+		"sfl_publisher" : "INSERT INTO Publisher (name) VALUES (%s) ON CONFLICT DO NOTHING "
+			"RETURNING pub_id;",
+		"sfl_file" : "INSERT INTO File (book_id, filepath, num_pages, subname, content_hash) "
+			"VALUES (%s, %s, %s, %s, %s);"
+	}
+	# Triggers recomputing derived data, see SEARCHSETUP and HIERARCHYSETUP. A replay
+	# switches them off and recomputes the data once at the end.
+	REPLAY_TRIGGERS = ("book_topic_insert", "book_topic_update", "book_topic_delete",
+		"topic_insert", "subtopic_of_insert", "subtopic_of_change")
+	# How the statements returning an id are logged: with the id, such that a replay
+	# gives every row the same id, also if several writers logged interleaved.
+	LOGGED = {
+		"sfl_book" : "WITH book AS (INSERT INTO Book (book_id, title, year, pub_id, form_id, "
+			"favorite) VALUES (%s, %s, %s, %s, %s, %s) RETURNING book_id) "
+			"INSERT INTO book_topic (book_id, topic_name) "
+			"SELECT book_id, unnest(%s::VARCHAR(40)[]) FROM book;",
+		"sfl_publisher" : "INSERT INTO Publisher (pub_id, name) VALUES (%s, %s);"
+	}
 	
 
 	def __init__(self, dbname : str = "library", user : str = "user", password : str = "pw"):
@@ -50,28 +118,34 @@ class DatabaseInterface:
 		password=password)
 		self.cur = self.conn.cursor()
 		self.username = user
-		self.logfile = "locallog.txt"
+		self.logfile = config["LOG_FILE"]
+		self.log = ActionLog(self.logfile)
+		# Module and class of every method. Imported on selection, such that
+		# torch and transformers are only loaded when an AI model is used.
 		self.metadata_extraction_methods = {
-			1: PdfMetaAnalyzer,
-			2: DonutAnalyzer,
-			3: Moondream2
+			1: ("analyzers.pdfmetaanalyzer", "PdfMetaAnalyzer"),
+			2: ("analyzers.donut_base_finetuned", "DonutAnalyzer"),
+			3: ("analyzers.moondream2", "Moondream2")
 		}
 		self.keywords_methods = {
-			1 : T5Derivative
+			1 : ("keywordinference.t5derivative", "T5Derivative")
 		}
 		self.md_extractor = None
+		self._chat_batch = None
+		self._prepared = {}
 
 
+		# Caches of the registered publishers (lower case name -> pub_id) and topics
+		# (lower case name -> name as registered). Filled on demand, see _load_topics.
 		self.publishers_added = {}
-		self.book_id = 0
-		self.pub_id = 0
 		self.collection_id = 0
 		self.form = {'book' : 1, 'lecture document' : 2, 'exercise' : 3,
 			'website' : 4, 'collection' : 5, 'notes' : 6, 'research article' : 7, 
 			'data' : 8, 'code' : 9}
-		self.topics = []
+		self.topics = {}
 
-	def set_metadata_method(self, method : int, **kwargs):
+	def set_metadata_method(self, method : int, threads : int = None, interop_threads : int = None,
+			**kwargs):
 		"""
 		Set how to extract the metadata of the document. This includes things
 		like author, title, publisher amon other things. This does NOT include
@@ -83,6 +157,18 @@ class DatabaseInterface:
 			1 for using the metadata of the file itself (analyzers.PdfMetaAnalyzer)
 			2 for using a donut AI model (analyzers.DonutAnalyzer)
 			3 for using the Moondream2 AI model. (recommended, min 8GB RAM recommended)
+		threads : int
+			Torch threads within an operation, None for TORCH_THREADS of the config.
+			Process wide, see inferencemode.set_threads.
+		interop_threads : int
+			Torch threads running operations in parallel, None for
+			TORCH_INTEROP_THREADS of the config.
+		kwargs
+			Passed to the analyzer. Methods 2 and 3 take precision, one of
+			"fp32", "bf16" and "int8", see inferencemode.apply_precision.
+
+		If a model server serves methods 2 or 3, its model is used instead of
+		loading one, see modelserver.remote_model.
 
 		Examples:
 		------------
@@ -91,16 +177,24 @@ class DatabaseInterface:
 
 		# use donut model
 		set_metadata_method(2)
+
+		# use donut model on a CPU server, int8 weights, 8 threads
+		set_metadata_method(2, precision = "int8", threads = 8)
 		"""
 		if method not in self.metadata_extraction_methods.keys():
 			raise ValueError(f"Bad metadata method extractor {method}. Check documentation.")
-		self.md_extractor = self.metadata_extraction_methods[method](**kwargs)
+		if method != 1:
+			self.md_extractor = remote_model("metadata", method, kwargs)
+			if self.md_extractor is not None:
+				return
+			self._set_threads(threads, interop_threads)
+		self.md_extractor = self._import_method(self.metadata_extraction_methods[method])(**kwargs)
 		self.md_extractor.load()
 
 	def get_username(self):
 		return self.username
 
-	def execute(self, command : str):
+	def execute(self, command : str, params : Collection = None):
 		"""
 		Execute a SQL statement.
 
@@ -108,22 +202,67 @@ class DatabaseInterface:
 		-----------
 		command : str
 			SQL string to execute.
+		params : collection
+			Optional parameters for the placeholders (%s) in command.
+			They are logged next to command, see actionlog.ActionLog.statement.
 		"""
-		self.cur.execute(command)
+		self.cur.execute(command, params)
 		ret = None
 		try:
 			ret = self.cur.fetchall()
 		except psycopg2.ProgrammingError:
 			pass
 
-		with open(self.logfile, 'a') as f:
-			f.write(command + "\n")
+		self.log.statement(command, params, self.cur.query)
+		return ret
+
+	def execute_prepared(self, name : str, params : Collection):
+		"""
+		Execute one of the PREPARED statements. It is prepared on the server on first
+		use, later calls skip parsing and planning. Logged like execute, with the
+		parameters, or as in LOGGED. Returns the returned row (the new id), if any.
+
+		Parameters
+		-----------
+		name : str
+			Key of the statement in PREPARED.
+		params : collection
+			The parameters of the statement.
+		"""
+		command = self.PREPARED[name]
+		if name not in self._prepared:
+			self.cur.execute(f"PREPARE {name} AS {_numbered(command)}")
+			self._prepared[name] = f"EXECUTE {name} ({', '.join(['%s'] * len(params))});"
+		self.cur.execute(self._prepared[name], params)
+		ret = None if self.cur.description is None else self.cur.fetchone()
+		if name in self.LOGGED:
+			if ret is not None:
+				self.log.statement(self.LOGGED[name], ret + tuple(params))
+		else:
+			self.log.statement(command, params)
 		return ret
 
-	def executefile(self, file : str, update_param : bool = True):
+	def stream(self, command : str, params : Collection = None, itersize : int = 2000):
 		"""
-		Execute file containing SQL statements.
-		NOTE: May commit. See update_param.
+		Run a read-only SQL query on a server-side (named) cursor and yield the rows.
+		Only itersize rows are held in memory at any time. Not logged. See stream_rows.
+
+		Parameters
+		-----------
+		command : str
+			SQL query to execute.
+		params : collection
+			Optional parameters for the placeholders (%s) in command.
+		itersize : int
+			Number of rows fetched from the server per round trip.
+		"""
+		return stream_rows(self.conn, command, params, itersize)
+
+	def executefile(self, file : str, update_param : bool = True, chunksize : int = 10000):
+		"""
+		Execute file containing SQL statements, or replay an action log (see actionlog).
+		NOTE: May commit. See update_param. Action logs are replayed in transactions
+		of chunksize statements, each committed; the replayed statements are logged.
 
 		Parameters
 		-----------
@@ -133,13 +272,66 @@ class DatabaseInterface:
 			Reflect changes also onto the Python side. True unless you know what you do.
 			Setting this False and then adding new entries may corrupt your database.
 			Note: If true then this commits!
+		chunksize : int
+			Statements per transaction when replaying an action log.
 		"""
-		with open(file, "r") as f:
-			read = "".join(f.readlines())
-		self.execute(read)
+		if is_action_log(file):
+			self.commit_transaction()
+			samefile = os.path.exists(self.logfile) and os.path.samefile(file, self.logfile)
+			triggers = self._set_triggers(False)
+			try:
+				replayed = replay(self.cur, file, chunksize, log=None if samefile else self.log)
+			except BaseException:
+				self.conn.rollback()
+				raise
+			finally:
+				if not triggers:
+					self._set_triggers(True)
+			self._sync_sequences()
+			if not triggers:
+				# Recompute what the triggers maintain. Both setups are idempotent.
+				self.cur.execute(self.SEARCHSETUP + self.HIERARCHYSETUP)
+			print(f"[Info] Replayed {replayed} statements from {file}.")
+		else:
+			with open(file, "r") as f:
+				read = "".join(f.readlines())
+			self.execute(read)
 		if update_param:
 			self._update_parameters()
 
+	def _sync_sequences(self):
+		"""
+		Let the id sequences of Book and Publisher continue after the largest id,
+		once a replay inserted rows with the ids they were logged with.
+		"""
+		for table, column in (("Book", "book_id"), ("Publisher", "pub_id")):
+			self.cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+				f"COALESCE(MAX({column}), 0) + 1, false) FROM {table};")
+
+	def _set_triggers(self, enabled : bool) -> bool:
+		"""
+		Switch the triggers maintaining the search columns and the topic closure
+		(REPLAY_TRIGGERS) on or off, for replays of a log that was consistent already.
+		Foreign keys, including their cascades, stay in force. Needs to own the tables.
+		Returns whether the triggers are on afterwards.
+
+		Parameters
+		-----------
+		enabled : bool
+			Whether the triggers fire.
+		"""
+		self.cur.execute("SELECT tgrelid::regclass::text, tgname FROM pg_trigger "
+			"WHERE tgname = ANY(%s) AND NOT tgisinternal;", (list(self.REPLAY_TRIGGERS),))
+		try:
+			for table, trigger in self.cur.fetchall():
+				self.cur.execute(f"ALTER TABLE {table} {'ENABLE' if enabled else 'DISABLE'} "
+					f"TRIGGER {trigger};")
+		except psycopg2.errors.InsufficientPrivilege:
+			self.conn.rollback()
+			return True
+		self.conn.commit()
+		return enabled
+
 	def addbook(self, title : str, year : int, pub_id : int, form : str, topics : Collection[str], 
 			favorite : bool = False, addunknowntopics : bool = True) -> int: 
 		"""
@@ -176,66 +368,83 @@ class DatabaseInterface:
 
 		f = self.form[form.lower()]
 
-		if pub_id is None:
-			pub_id = 'NULL'
-
-		if year is None:
-			self.execute(f'''INSERT INTO book (title, pub_id, form_id, favorite)'''
-				f''' VALUES ('{title}', {pub_id}, {f}, {favorite});''')
-		else:
-			self.execute(f'''INSERT INTO book (title, year, pub_id, form_id, favorite)'''
-				f''' VALUES ('{title}', {year}, {pub_id}, {f}, {favorite});''')
-		self.book_id += 1
-
-		if topics is not None:
-			for t in topics:
-				self.checktopic(t, addunknowntopics)
-				self.execute(f'''INSERT INTO book_topic (book_id, '''
-					f'''topic_name) VALUES ({self.book_id}, '{t}');''')
-
-
-		return self.book_id
+		topics = () if topics is None else topics
+		self._load_topics(topics)
+		topics = list(dict.fromkeys(self.checktopic(t, addunknowntopics) for t in topics))
+		return self.execute_prepared("sfl_book", (title, year, pub_id, f, favorite, topics))[0]
 
 	def _update_parameters(self):
 		"""
 		If you replay from a file, you must afterwards update some parameters
 		that are stored on the Python side. If you call executefile, 
 		you should call this to reflect the changes also on the Python side.
+		The caches of topics and publishers are emptied, they are loaded again
+		name by name when used.
 		"""
-		self.conn.commit()
+		self.commit_transaction()
 		self.cur = self.conn.cursor()
-		self.cur.execute("SELECT COUNT(*) FROM Book;")
-		self.book_id = self.cur.fetchall()[0][0]
-		self.cur.execute("SELECT pub_id, name FROM Publisher;")
+		self._clear_caches()
 
-		for pub_id, name in self.cur.fetchall():
-			self.publishers_added[name] = pub_id
+	def _clear_caches(self):
+		"""Forget the cached topics and publishers, e.g. after a rollback."""
+		self.topics.clear()
+		self.publishers_added.clear()
 
-		self.pub_id = len(self.publishers_added)
-		self.cur.execute("SELECT topic_name FROM Topic;")
+	def _load_topics(self, topics : Collection[str]):
+		"""
+		Cache the registered spelling of those topics that are not cached yet,
+		in one query. Topics match case-insensitively.
+
+		Parameters
+		-----------
+		topics : collection of str
+			Names of topics.
+		"""
+		missing = list({t.lower() for t in topics} - self.topics.keys())
+		if missing:
+			self.cur.execute("SELECT topic_name FROM Topic WHERE lower(topic_name) = ANY(%s);",
+				(missing,))
+			for (name,) in self.cur.fetchall():
+				self.topics.setdefault(name.lower(), name)
+
+	def _load_publishers(self, names : Collection[str]):
+		"""
+		Cache the ids of those publishers that are not cached yet, in one query.
 
-		for t in self.cur.fetchall():
-			topic = t[0]
-			if topic not in self.topics:
-				self.topics.append(topic)
+		Parameters
+		-----------
+		names : collection of str
+			Lower case names of publishers.
+		"""
+		missing = list(set(names) - self.publishers_added.keys())
+		if missing:
+			self.cur.execute("SELECT name, MIN(pub_id) FROM Publisher WHERE name = ANY(%s) "
+				"GROUP BY name;", (missing,))
+			self.publishers_added.update(self.cur.fetchall())
 
 	def addtopics(self, topics : Collection[str]):
 		"""
-		Register a topic.
+		Register topics. Topics registered before, in any case, also by another
+		writer meanwhile, are skipped.
 
 		Parameters
 		-----------
 		topics : collection of str
 			Collection of topics to be registered.
 		"""
+		self._load_topics(topics)
 		for t in topics:
-			self.topics.append(t)
-			self.execute(f'''INSERT INTO Topic (topic_name) VALUES ('{t}');''')
+			if t.lower() not in self.topics:
+				if self.execute_prepared("sfl_topic", (t,)) is None:
+					self._load_topics((t, ))
+				else:
+					self.topics[t.lower()] = t
 
-	def checktopic(self, topic : str, addunknowntopics : bool = True):
+	def checktopic(self, topic : str, addunknowntopics : bool = True) -> str:
 		"""
 		Check if topic was registered. If addunknowntopics is False,
 		will throw ValueError if unknown. Else will register the topic.
+		Topics match case-insensitively. Returns the name as registered.
 
 		Parameters
 		-----------
@@ -244,15 +453,19 @@ class DatabaseInterface:
 		addunknowntopics : bool
 			Whether to register the topic if unknown.
 		"""
-		if not topic in self.topics:
+		self._load_topics((topic, ))
+		if not topic.lower() in self.topics:
 			if not addunknowntopics:
 				raise ValueError(f"[Error] {topic} is unknown topic.")
 			else:
 				self.addtopics((topic, ))
+		return self.topics[topic.lower()]
 
 	def subtopic(self, base : str, sub : str, addunknowntopics : bool = True):
 		"""
-		Register a subtopic relationship.
+		Register a subtopic relationship. The triggers of topic_closure add
+		the new ancestor/descendant pairs, such that searches for base or any
+		of its supertopics also find the books of sub and its subtopics.
 
 		Parameters
 		-----------
@@ -264,9 +477,9 @@ class DatabaseInterface:
 			If any of the topics is unknown then wither register or
 			throw ValueError. True results in the former behavior.
 		"""
-		self.checktopic(base, addunknowntopics)
-		self.checktopic(sub, addunknowntopics)
-		self.execute(f'''INSERT INTO subtopic_of (basetopic_name, subtopic_name) VALUES ('{base}', '{sub}');''')
+		base = self.checktopic(base, addunknowntopics)
+		sub = self.checktopic(sub, addunknowntopics)
+		self.execute_prepared("sfl_subtopic", (base, sub))
 
 	def addpublisher(self, name : str):
 		"""
@@ -278,15 +491,19 @@ class DatabaseInterface:
 			The name of the publisher.
 		"""
 		name = name.lower()
+		self._load_publishers((name, ))
 		if name in self.publishers_added:
 			return self.publishers_added[name]
 
-		self.execute(f'''INSERT INTO Publisher (name) VALUES ('{name}');''')
-		self.pub_id += 1
-		self.publishers_added[name] = self.pub_id
-		return self.pub_id
+		added = self.execute_prepared("sfl_publisher", (name,))
+		if added is None:
+			self._load_publishers((name, ))
+		else:
+			self.publishers_added[name] = added[0]
+		return self.publishers_added[name]
 
-	def addfile(self, book_id : int, path : str, num_pages : int, subname : str = ""):
+	def addfile(self, book_id : int, path : str, num_pages : int, subname : str = "",
+			content_hash : str = None):
 		"""
 		Register a file.
 
@@ -301,17 +518,229 @@ class DatabaseInterface:
 		subname : str
 			Secondary name like 'Chapter 2'. Especially useful if one book is made of
 			several files.
+		content_hash : str
+			SHA-256 of the file contents, see manifest.file_hash. Computed if None
+			and the file exists.
 		"""
 		if len(path) > 100:
 			raise ValueError(f"[Error] Too long path {path}")
 
-		if num_pages is None:
-			self.execute('''INSERT INTO File (book_id, filepath, subname)'''
-				f''' VALUES ({book_id}, '{path}', '{subname}');''')
-		else:
-			self.execute('''INSERT INTO File (book_id, filepath, num_pages, subname)'''
-				f''' VALUES ({book_id}, '{path}', {num_pages}, '{subname}');''')
+		content_hash = self._content_hash(path, content_hash)
+		self.execute_prepared("sfl_file", (book_id, path, num_pages, subname, content_hash))
 
+	def _content_hash(self, path : str, content_hash : str = None):
+		"""
+		Returns content_hash if given, else the hash of the file at path or None
+		if there is no such file.
+
+		Parameters
+		-----------
+		path : str
+			The filepath of the file.
+		content_hash : str
+			A previously computed hash.
+		"""
+		if content_hash is None and os.path.isfile(path):
+			content_hash = file_hash(path)
+		return content_hash
+
+	def find_duplicates(self, hashes : Collection[str]) -> dict:
+		"""
+		Look up which of the content hashes are already registered. Returns a dict
+		mapping each known hash to (book_id, num_pages) of one file with that hash.
+
+		Parameters
+		-----------
+		hashes : collection of str
+			Content hashes, see manifest.file_hash.
+		"""
+		self.cur.execute('''SELECT DISTINCT ON (content_hash) content_hash, book_id, num_pages'''
+			''' FROM File WHERE content_hash = ANY(%s);''', (list(hashes),))
+		return {h : (book_id, num_pages) for h, book_id, num_pages in self.cur.fetchall()}
+
+	def addbooks_bulk(self, records : Iterable[dict], addunknowntopics : bool = True,
+			batchsize : int = 1000) -> list:
+		"""
+		Add many books together with their publishers, topics and files. The rows are
+		sent in batches, with one INSERT per table and batch, and every batch is logged
+		as one frame of the action log. Returns the ids of the books, in the order of records.
+
+		Parameters
+		-----------
+		records : iterable of dict
+			One dict per book. Keys are 'title', 'year', 'publisher' (the name, may be None),
+			'form' and 'topics' as in addbook. Optional are 'favorite' and 'files', a
+			collection of (path, num_pages), (path, num_pages, subname) or
+			(path, num_pages, subname, content_hash) tuples.
+		addunknowntopics : bool
+			Whether ot automatically add topics that were not yet registered.
+			If False, will throw ValueError if topic was not registered before.
+		batchsize : int
+			Number of books per batch.
+		"""
+		book_ids = []
+		records = iter(records)
+		while True:
+			batch = list(islice(records, batchsize))
+			if not batch:
+				break
+			book_ids.extend(self._addbooks_batch(batch, addunknowntopics))
+		return book_ids
+
+	def _addbooks_batch(self, batch : list, addunknowntopics : bool) -> list:
+		"""
+		Check one batch for addbooks_bulk and insert it, logged as one frame.
+		Returns the book ids.
+
+		Parameters
+		-----------
+		batch : list of dict
+			The records, see addbooks_bulk.
+		addunknowntopics : bool
+			See addbooks_bulk.
+		"""
+		topics = []
+		for rec in batch:
+			if rec["title"] is None:
+				raise ValueError(f"[Error] Need title not None.")
+			if len(rec["title"]) > 100:
+				raise ValueError(f"[Error] {rec['title']} too long")
+			for fileinfo in rec.get("files", ()):
+				if len(fileinfo[0]) > 100:
+					raise ValueError(f"[Error] Too long path {fileinfo[0]}")
+			rectopics = rec.get("topics") or ()
+			topics.extend((rectopics,) if isinstance(rectopics, str) else rectopics)
+		self._load_topics(topics)
+		newtopics = {}
+		for t in topics:
+			if t.lower() not in self.topics:
+				if not addunknowntopics:
+					raise ValueError(f"[Error] {t} is unknown topic.")
+				newtopics.setdefault(t.lower(), t)
+
+		with self.log.batch():
+			return self._insert_batch(batch, newtopics)
+
+	def _insert_batch(self, batch : list, newtopics : dict) -> list:
+		"""
+		Send the INSERTs of one checked batch for addbooks_bulk. Returns the book ids.
+
+		Parameters
+		-----------
+		batch : list of dict
+			The records, see addbooks_bulk.
+		newtopics : dict
+			The topics of the batch that are not registered yet, lower case name -> name.
+		"""
+		pubnames = {rec["publisher"].lower() for rec in batch if rec.get("publisher") is not None}
+		self._load_publishers(pubnames)
+		# Sorted by the lower case names, like the unique indexes compare them, such
+		# that concurrent writers adding the same names wait for each other instead
+		# of deadlocking. Names added meanwhile are loaded.
+		newpubs = sorted((name for name in pubnames if name not in self.publishers_added),
+			key=str.lower)
+		if newpubs:
+			for pub_id, name in self._execute_values(
+					"INSERT INTO Publisher (name) VALUES %s ON CONFLICT DO NOTHING RETURNING pub_id, name",
+					[(name,) for name in newpubs], "INSERT INTO Publisher (pub_id, name) VALUES %s"):
+				self.publishers_added[name] = pub_id
+			self._load_publishers(newpubs)
+		if newtopics:
+			names = sorted(newtopics.values(), key=str.lower)
+			for (name,) in self._execute_values("INSERT INTO Topic (topic_name) VALUES %s "
+					"ON CONFLICT DO NOTHING RETURNING topic_name", [(t,) for t in names]):
+				self.topics[name.lower()] = name
+			self._load_topics(names)
+
+		rows = []
+		for rec in batch:
+			pub = rec.get("publisher")
+			rows.append((rec["title"], rec.get("year"),
+				None if pub is None else self.publishers_added[pub.lower()],
+				self.form[rec["form"].lower()], rec.get("favorite", False)))
+		book_ids = [r[0] for r in self._execute_values(
+			"INSERT INTO Book (title, year, pub_id, form_id, favorite) VALUES %s "
+			"RETURNING book_id, title, year, pub_id, form_id, favorite", rows,
+			"INSERT INTO Book (book_id, title, year, pub_id, form_id, favorite) VALUES %s")]
+
+		topicrows = []
+		filerows = []
+		for book_id, rec in zip(book_ids, batch):
+			topics = rec.get("topics") or ()
+			if isinstance(topics, str):
+				topics = (topics,)
+			names = dict.fromkeys(self.topics[t.lower()] for t in topics)
+			topicrows.extend((book_id, name) for name in names)
+			for fileinfo in rec.get("files", ()):
+				path, num_pages = fileinfo[0], fileinfo[1]
+				subname = fileinfo[2] if len(fileinfo) > 2 else ""
+				content_hash = self._content_hash(path, fileinfo[3] if len(fileinfo) > 3 else None)
+				filerows.append((book_id, path, num_pages, subname, content_hash))
+		if topicrows:
+			self._execute_values(
+				"INSERT INTO book_topic (book_id, topic_name) VALUES %s", topicrows)
+		if filerows:
+			self._execute_values(
+				"INSERT INTO File (book_id, filepath, num_pages, subname, content_hash) VALUES %s",
+				filerows)
+		return book_ids
+
+	def addbooks_committed(self, records : Collection[dict], addunknowntopics : bool = True,
+			retries : int = None) -> list:
+		"""
+		Add the books like addbooks_bulk and commit them, in one transaction. Meant for
+		several writers, e.g. processes each with its own DatabaseInterface (see
+		ingest), adding to the same library: If the transaction is aborted by a
+		serialization failure or a deadlock, it is rolled back and tried again.
+		Returns the ids of the books. What was added before is committed first.
+
+		Parameters
+		-----------
+		records : collection of dict
+			The books, see addbooks_bulk.
+		addunknowntopics : bool
+			See addbooks_bulk.
+		retries : int
+			How often to try again, None for WRITE_RETRIES of the config.
+		"""
+		retries = config["WRITE_RETRIES"] if retries is None else retries
+		records = list(records)
+		self.commit_transaction()
+		for attempt in count():
+			try:
+				with self.log.batch():
+					book_ids = self.addbooks_bulk(records, addunknowntopics)
+					self.commit_transaction()
+				return book_ids
+			except psycopg2.extensions.TransactionRollbackError as e:
+				self.rollback_transaction()
+				if attempt >= retries:
+					raise
+				print(f"[Warning] Transaction aborted ({e.pgcode}), trying again.")
+				time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+	def _execute_values(self, command : str, rows : list, logcommand : str = None):
+		"""
+		Insert all rows with a single statement using execute_values and log it.
+		Returns fetched rows, if any.
+
+		Parameters
+		-----------
+		command : str
+			SQL string with a single %s placeholder for the VALUES.
+		rows : list of tuples
+			The values.
+		logcommand : str
+			Logged with the fetched rows instead of command and rows, for an INSERT
+			returning the inserted rows with the ids assigned by the database.
+		"""
+		ret = execute_values(self.cur, command, rows, page_size=len(rows),
+			fetch=" RETURNING " in command)
+		if logcommand is None:
+			self.log.values(command, rows)
+		elif ret:
+			self.log.values(logcommand, ret)
+		return ret
 
 	def finish(self, commit : bool = True):
 		"""
@@ -325,23 +754,53 @@ class DatabaseInterface:
 		print(f"[Info] Closing library database connection.")
 		self.cur.close()
 		if commit:
-			self.conn.commit()
+			self.log.commit(self.conn)
+		else:
+			self.log.discard()
+		self.log.close()
 		self.conn.close()
 
 	def cleardb(self):
 		"""
 		Clear the contents of the DB and setup the plain tables again.
 		"""
-		with open(self.logfile, "w") as f:
-			f.write("") # make sure that the file is overwritten
+		self.log.clear()
+		self._clear_caches()
 		try:
-			self.execute("DROP TABLE Publisher, Form, Book, File, "
-				"Topic, subtopic_of, book_topic, UseCase, usecase_book;")
+			self.execute("DROP TABLE IF EXISTS Publisher, Form, Book, File, "
+				"Topic, subtopic_of, topic_closure, book_topic, UseCase, usecase_book;")
 		except:
 			print("[Error] Removing tables error: Probably first run.")
 			self.conn.commit()
 			self.cur = self.conn.cursor()
 		self.execute(self.SQLSETUP)
+		self.execute(self.SEARCHSETUP)
+		self.execute(self.HIERARCHYSETUP)
+		self.execute(self.WRITERSETUP)
+
+	def setup_search(self):
+		"""
+		Add the search columns, indexes and triggers to a library created
+		before they were part of the setup. Does nothing if they exist.
+		Needs the pg_trgm extension of PostgreSQL.
+		"""
+		self.execute(self.SEARCHSETUP)
+
+	def setup_hierarchy(self):
+		"""
+		Add the topic_closure table and its triggers to a library created
+		before they were part of the setup. Does nothing if they exist.
+		"""
+		self.execute(self.HIERARCHYSETUP)
+
+	def setup_writers(self):
+		"""
+		Add the unique indexes on the names of topics and publishers to a library
+		created before they were part of the setup, such that several writers can
+		add to it at once. Does nothing if they exist. Fails if a name is
+		registered twice (topics: in different case).
+		"""
+		self.execute(self.WRITERSETUP)
 
 	def cancel_transaction(self):
 		"""
@@ -350,17 +809,27 @@ class DatabaseInterface:
 		"""
 		self.conn.cancel()
 
+	def rollback_transaction(self):
+		"""
+		Undo the changes since the last commit. Their statements are dropped from
+		the action log.
+		"""
+		self.conn.rollback()
+		self.log.discard()
+		self._clear_caches()
+
 	def commit_transaction(self):
 		"""
 		Commits the transaction. The equivalent of a savegame: If an error now appears,
-		the transaction is saved.
+		the transaction is saved. Flushes the action log, see actionlog.ActionLog.commit.
 		"""
-		self.conn.commit()
+		self.log.commit(self.conn)
 
 	def standardsetup(self):
 		"""
 		Insert some typical values into the DB. You may check them out by
-		calling this method and then looking at the logfile.
+		calling this method and then looking at the logfile
+		(python3 -m smartfilelibrary.actionlog locallog.sfl).
 		"""
 		self.execute('''INSERT INTO Form (form_name) VALUES
 			('book'), -- ID == 1
@@ -391,10 +860,12 @@ class DatabaseInterface:
 		self.subtopic('Naval', 'Naval Traffic')
 		self.subtopic('Airspace', 'Air Traffic')
 
-	def preview_all(self, filesdir : str,  to_file : str = "preview_db.py"):
+	def preview_all(self, filesdir : str,  to_file : str = "preview_db.py",
+			incremental : bool = False, manifest : str = "filemanifest.json", **kwargs):
 		"""Try to automatically generate the entries into the DB, given some file directory.
 		Will not make any changes to the DB, instead will preview all changes into a
-		Python file.
+		Python file. Byte-identical files are only analyzed once: Copies become further
+		files of the same book, or of the registered book that has a file with the same contents.
 
 		Parameters
 		-----------
@@ -402,17 +873,73 @@ class DatabaseInterface:
 			The directory of the files.
 		to_file : str
 			The filepath where the preview will be saved.
+		incremental : bool
+			Skip files that are already registered in the File table and reuse the
+			stored analysis of files that did not change since the last incremental run.
+			Only new or changed files are analyzed.
+		manifest : str
+			The file keeping the state and analysis of the files for incremental runs.
+		kwargs
+			Pipeline settings passed to utilities.get_books, like render_workers,
+			queue_depth, batchsize, keyword_workers and keyword_delay.
 		"""
 		if (self.md_extractor is None):
 			raise ValueError("Must set metadata extraction method first before calling preview_all")
-		
-		books = get_books(filesdir, self.md_extractor, self._chat)
-		write_actions_to_db(books, to_file, filesdir, self)
+
+		names = os.listdir(filesdir)
+		state = None
+		if incremental:
+			self.cur.execute("SELECT filepath FROM File;")
+			registered = {r[0] for r in self.cur.fetchall()}
+			unregistered = [n for n in names if os.path.join(filesdir, n) not in registered]
+			print(f"[Info] Skipped {len(names) - len(unregistered)} registered files.")
+			names = unregistered
+			state = FileManifest(manifest)
+			hashes = [state.get_hash(os.path.join(filesdir, n)) for n in names]
+		else:
+			hashes = hash_files([os.path.join(filesdir, n) for n in names])
+		hashes = dict(zip(names, hashes))
+		registered_hashes = self.find_duplicates(set(hashes.values()))
+
+		books = []
+		todo = []
+		first = {}
+		copies = {}
+		existing = []
+		for bookfilename in names:
+			h = hashes[bookfilename]
+			if h in registered_hashes:
+				existing.append((bookfilename, ) + registered_hashes[h])
+			elif h in first:
+				copies[first[h]].append(bookfilename)
+			else:
+				first[h] = bookfilename
+				copies[bookfilename] = []
+				result = None if state is None else state.get_result(os.path.join(filesdir, bookfilename))
+				if result is None:
+					todo.append(bookfilename)
+				else:
+					books.append(tuple(result))
+		print(f"[Info] Found {len(names) - len(first)} duplicate files, {len(existing)} of them "
+			f"already in the library. Reusing {len(books)} previous analyses, analyzing {len(todo)} files.")
+
+		if todo:
+			analyzed = get_books(filesdir, self.md_extractor, self._chat, files=todo,
+				hashes=hashes, chat_batch=self._chat_batch, **kwargs)
+			if state is not None:
+				for book in analyzed:
+					state.record(os.path.join(filesdir, book[1]), book)
+			books.extend(analyzed)
+		if state is not None:
+			# Also keeps the new mtimes of files reused unchanged, see get_result.
+			state.save()
+		write_actions_to_db(books, to_file, filesdir, self, hashes, copies, existing)
 
 	def _chat(self, inp : str):
 		return ""
 
-	def set_keywords_model(self, method : int):
+	def set_keywords_model(self, method : int, threads : int = None, interop_threads : int = None,
+			**kwargs):
 		"""Set the method to use for keyword inference.
 
 		Parameters
@@ -421,11 +948,41 @@ class DatabaseInterface:
 			1: Extract keywords from the title, using a derivative from 
 				Google's T5 model ( less than 8GB RAM required)
 			Will soon add ChatGPT, etc. 
+		threads : int
+			Torch threads within an operation, see set_metadata_method.
+		interop_threads : int
+			Torch threads running operations in parallel, see set_metadata_method.
+		kwargs
+			Passed to the model, like batchsize, max_new_tokens, sampling,
+			cache and precision for T5Derivative.
+
+		If a model server serves the method, its model is used instead of
+		loading one, see modelserver.remote_model.
 		"""
 		if method not in self.keywords_methods:
 			raise ValueError("Unknown value for keyword extraction.")
-		self._chat = self.keywords_methods[method](**kwargs).get_keywords
+		model = remote_model("keywords", method, kwargs)
+		if model is None:
+			self._set_threads(threads, interop_threads)
+			model = self._import_method(self.keywords_methods[method])(**kwargs)
+			model.load()
+		self._chat = model.get_keywords
+		self._chat_batch = model.get_keywords_batch
 		
+	@staticmethod
+	def _import_method(spec : tuple):
+		module, name = spec
+		try:
+			return getattr(importlib.import_module(f".{module}", __package__), name)
+		except ImportError as e:
+			raise ImportError(f"Could not import {name}: {e}. The AI models need torch and "
+				"transformers, fix by executing 'pip3 install torch transformers'.") from e
+
+	def _set_threads(self, threads : int, interop_threads : int):
+		set_threads(config["TORCH_THREADS"] if threads is None else threads,
+			config["TORCH_INTEROP_THREADS"] if interop_threads is None else interop_threads)
+
+
 	SQLSETUP = """
 CREATE TABLE Publisher(
 	pub_id SERIAL PRIMARY KEY, 
@@ -458,6 +1015,7 @@ CREATE TABLE File(
 	filepath VARCHAR(100) UNIQUE,
 	num_pages INT,
 	subname VARCHAR(20) DEFAULT '',
+	content_hash CHAR(64), -- SHA-256 of the contents, finds duplicate files
 
 	PRIMARY KEY(book_id, collection_id),
 
@@ -465,6 +1023,8 @@ CREATE TABLE File(
 		ON DELETE CASCADE ON UPDATE CASCADE -- File is weak entity linked to book
 );
 
+CREATE INDEX file_content_hash ON File (content_hash);
+
 
 CREATE TABLE Topic(
 	topic_name VARCHAR(40) PRIMARY KEY
@@ -496,6 +1056,8 @@ CREATE TABLE book_topic(
 		ON DELETE CASCADE ON UPDATE CASCADE
 );
 
+CREATE INDEX book_topic_lower_name ON book_topic (lower(topic_name));
+
 CREATE TABLE UseCase(
 	usecase_id SERIAL PRIMARY KEY,
 	name VARCHAR(30) NOT NULL,
@@ -517,5 +1079,122 @@ CREATE TABLE usecase_book(
 
 );"""
 
+	# Full-text and trigram search over titles and topics. Idempotent, such that
+	# setup_search can add it to libraries created before.
+	SEARCHSETUP = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- The topics of the book, separated by spaces. Kept up to date by the triggers below.
+ALTER TABLE Book ADD COLUMN IF NOT EXISTS topics_text TEXT;
+
+-- Title and topics as plain text, for fuzzy (trigram) matches.
+ALTER TABLE Book ADD COLUMN IF NOT EXISTS search_text TEXT
+	GENERATED ALWAYS AS (title || ' ' || COALESCE(topics_text, '')) STORED;
+
+-- Title (weight A) and topics (weight B) as lexemes, for ranked full-text matches.
+ALTER TABLE Book ADD COLUMN IF NOT EXISTS search tsvector
+	GENERATED ALWAYS AS (setweight(to_tsvector('english', title), 'A') ||
+		setweight(to_tsvector('english', COALESCE(topics_text, '')), 'B')) STORED;
+
+CREATE INDEX IF NOT EXISTS book_search ON Book USING GIN (search);
+CREATE INDEX IF NOT EXISTS book_search_trgm ON Book USING GIN (search_text gin_trgm_ops);
+
+-- Book by book through the primary key: the plan is cached with the function, a
+-- join with the changed books would keep the plan of the (empty) Book of the first call.
+CREATE OR REPLACE FUNCTION book_topics_refresh() RETURNS trigger AS $$
+DECLARE
+	changed_id INTEGER;
+BEGIN
+	FOR changed_id IN SELECT DISTINCT book_id FROM changed LOOP
+		UPDATE Book SET topics_text = (SELECT string_agg(topic_name, ' ' ORDER BY topic_name)
+			FROM book_topic bt WHERE bt.book_id = changed_id)
+		WHERE book_id = changed_id;
+	END LOOP;
+	RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+-- Statement level: a bulk insert refreshes each of its books once.
+CREATE OR REPLACE TRIGGER book_topic_insert AFTER INSERT ON book_topic
+	REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION book_topics_refresh();
+CREATE OR REPLACE TRIGGER book_topic_update AFTER UPDATE ON book_topic
+	REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION book_topics_refresh();
+CREATE OR REPLACE TRIGGER book_topic_delete AFTER DELETE ON book_topic
+	REFERENCING OLD TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION book_topics_refresh();
+
+UPDATE Book SET topics_text = (SELECT string_agg(topic_name, ' ' ORDER BY topic_name)
+	FROM book_topic bt WHERE bt.book_id = Book.book_id);"""
+
+	# Transitive closure of subtopic_of, such that a topic query is one indexed join
+	# instead of a recursion. Every topic is its own descendant. Idempotent, such that
+	# setup_hierarchy can add it to libraries created before.
+	HIERARCHYSETUP = """
+CREATE TABLE IF NOT EXISTS topic_closure(
+	ancestor_name VARCHAR(40),
+	descendant_name VARCHAR(40),
+
+	PRIMARY KEY(ancestor_name, descendant_name),
+
+	CONSTRAINT ancestorname FOREIGN KEY (ancestor_name) REFERENCES Topic
+		ON DELETE CASCADE ON UPDATE CASCADE,
+
+	CONSTRAINT descendantname FOREIGN KEY (descendant_name) REFERENCES Topic
+		ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS topic_closure_lower_ancestor ON topic_closure (lower(ancestor_name));
+
+CREATE OR REPLACE FUNCTION topic_closure_add_topics() RETURNS trigger AS $$
+BEGIN
+	INSERT INTO topic_closure SELECT topic_name, topic_name FROM added ON CONFLICT DO NOTHING;
+	RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+-- Incremental: everything above base (and base) gets everything below sub (and sub).
+-- Per row, such that several edges in one statement see each other.
+CREATE OR REPLACE FUNCTION topic_closure_add_edge() RETURNS trigger AS $$
+BEGIN
+	INSERT INTO topic_closure
+		SELECT a.ancestor_name, d.descendant_name
+		FROM topic_closure a, topic_closure d
+		WHERE a.descendant_name = NEW.basetopic_name AND d.ancestor_name = NEW.subtopic_name
+	ON CONFLICT DO NOTHING;
+	RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION topic_closure_rebuild() RETURNS void AS $$
+	DELETE FROM topic_closure;
+	INSERT INTO topic_closure
+		WITH RECURSIVE reach(ancestor_name, descendant_name) AS (
+			SELECT topic_name, topic_name FROM Topic
+			UNION
+			SELECT r.ancestor_name, s.subtopic_name
+			FROM reach r JOIN subtopic_of s ON s.basetopic_name = r.descendant_name)
+		SELECT * FROM reach;
+$$ LANGUAGE sql;
+
+-- Removing an edge may or may not remove paths, so these rare changes rebuild it.
+CREATE OR REPLACE FUNCTION topic_closure_changed() RETURNS trigger AS $$
+BEGIN
+	PERFORM topic_closure_rebuild();
+	RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER topic_insert AFTER INSERT ON Topic
+	REFERENCING NEW TABLE AS added FOR EACH STATEMENT EXECUTE FUNCTION topic_closure_add_topics();
+CREATE OR REPLACE TRIGGER subtopic_of_insert AFTER INSERT ON subtopic_of
+	FOR EACH ROW EXECUTE FUNCTION topic_closure_add_edge();
+CREATE OR REPLACE TRIGGER subtopic_of_change AFTER UPDATE OR DELETE OR TRUNCATE ON subtopic_of
+	FOR EACH STATEMENT EXECUTE FUNCTION topic_closure_changed();
+
+SELECT topic_closure_rebuild();"""
+
+	# Unique names of topics (in any case) and publishers, such that concurrent
+	# writers adding the same one insert it once (ON CONFLICT DO NOTHING). Idempotent,
+	# such that setup_writers can add it to libraries created before.
+	WRITERSETUP = """
+CREATE UNIQUE INDEX IF NOT EXISTS topic_lower_name_key ON Topic (lower(topic_name));
+CREATE UNIQUE INDEX IF NOT EXISTS publisher_name_key ON Publisher (name);"""
+
+
 
 	
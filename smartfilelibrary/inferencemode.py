@@ -0,0 +1,75 @@
+"""Settings for running the models on the CPU: reduced precision and torch thread counts."""
+import warnings
+
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def set_threads(threads : int = None, interop_threads : int = None):
+	"""
+	Set the number of torch threads. These are process wide, they apply to
+	all loaded models.
+
+	Parameters
+	-----------
+	threads : int
+		Threads used within an operation, like a matrix product. None keeps
+		the torch default, the number of physical cores.
+	interop_threads : int
+		Threads running independent operations in parallel. None keeps the
+		torch default. Torch only accepts this before the first parallel
+		work, later calls keep the current value and warn.
+	"""
+	import torch
+	if threads is not None:
+		torch.set_num_threads(threads)
+	if interop_threads is not None and interop_threads != torch.get_num_interop_threads():
+		try:
+			torch.set_interop_threads(interop_threads)
+		except RuntimeError:
+			warnings.warn("Cannot change the torch inter-op threads after parallel work has "
+				f"started, keeping {torch.get_num_interop_threads()}.")
+
+
+def bf16_supported() -> bool:
+	"""Whether the CPU computes bf16 natively (AVX512-BF16 or AMX). Elsewhere,
+	bf16 is emulated and slower than fp32."""
+	import torch
+	for check in ("_is_avx512_bf16_supported", "_is_amx_tile_supported"):
+		if getattr(torch.cpu, check, lambda: False)():
+			return True
+	return False
+
+
+def apply_precision(model, precision : str, device : str):
+	"""
+	Convert a loaded model to the given precision and return it.
+
+	fp32 keeps the model as it is. bf16 casts the weights, on the CPU only if
+	the CPU supports it natively, see bf16_supported. int8 replaces the linear
+	layers by dynamically quantized ones: the weights are stored as int8, the
+	activations are quantized on the fly. It is CPU only. Where a precision is
+	not supported, the model stays fp32 with a warning.
+
+	Parameters
+	-----------
+	model : torch.nn.Module
+		The model, already moved to device.
+	precision : str
+		One of PRECISIONS.
+	device : str
+		The device of the model, "cpu" or "cuda".
+	"""
+	import torch
+	if precision not in PRECISIONS:
+		raise ValueError(f"Unknown precision {precision}, use one of {PRECISIONS}.")
+	if precision == "bf16":
+		if device == "cpu" and not bf16_supported():
+			warnings.warn("This CPU has no native bf16 support, using fp32.")
+			return model
+		return model.to(torch.bfloat16)
+	if precision == "int8":
+		if device != "cpu":
+			warnings.warn("int8 dynamic quantization is CPU only, using fp32.")
+			return model
+		return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+	return model
@@ -0,0 +1,211 @@
+"""Several writer processes analyzing documents and adding them to the same
+library at once. Every writer has its own DatabaseInterface and commits the
+books of each job in a transaction of its own, see
+DatabaseInterface.addbooks_committed. The database assigns the ids and
+registers a topic or publisher found by several writers once, so the writers
+only share the queue of jobs. With a model server running (see modelserver),
+the writers share its models instead of loading one each.
+
+	python3 -m smartfilelibrary.ingest db_name user_name directory metadata_method [keywords_method]
+"""
+import os
+import sys
+import queue
+import multiprocessing
+from functools import partial
+from getpass import getpass
+from typing import Callable, Iterable
+
+from .config import config
+from .databaseinterface import DatabaseInterface
+from .manifest import hash_files
+from .utilities import get_books, to_record
+
+
+def _writer(dbname : str, user : str, password : str, setup : Callable, settings : dict,
+		jobs, results):
+	"""Main loop of a writer process: Run the jobs of the queue until None,
+	each committed on its own. Puts (job index, book ids) or (None, error).
+	settings is the config of the parent, like its LOG_FILE."""
+	config.update(settings)
+	db = None
+	try:
+		db = DatabaseInterface(dbname, user, password)
+		if setup is not None:
+			setup(db)
+		for i, work, args in iter(jobs.get, None):
+			results.put((i, db.addbooks_committed(work(db, *args))))
+	except Exception as e:
+		results.put((None, f"{type(e).__name__}: {e}"))
+	finally:
+		if db is not None:
+			db.finish(commit=False)
+
+
+def run_writers(dbname : str, user : str, password : str, work : Callable, jobs : Iterable[tuple],
+		workers : int = None, setup : Callable = None) -> list:
+	"""
+	Call work(db, *args) for the args of every job in writer processes and add the
+	books it returns, one transaction per job. Returns the ids of the books per job,
+	in the order of jobs. If a writer fails, the others are stopped; the jobs
+	committed before stay in the library.
+
+	Parameters
+	-----------
+	dbname : str
+		Database name in PostgreSQL.
+	user : str
+		The name of the user in PostgreSQL.
+	password : str
+		The password for the user in PostgreSQL.
+	work : Callable
+		Module level function of the writer's DatabaseInterface and the arguments
+		of a job, returning the records of the books, see addbooks_bulk.
+	jobs : iterable of tuples
+		The arguments of the jobs.
+	workers : int
+		Number of writer processes, None for INGEST_WORKERS of the config.
+	setup : Callable
+		Module level function called with the DatabaseInterface of every writer
+		before its first job, like one setting the models. None: nothing to set up.
+	"""
+	jobs = list(jobs)
+	workers = config["INGEST_WORKERS"] if workers is None else workers
+	workers = min(workers or os.cpu_count(), len(jobs))
+	# Spawned, not forked: The parent may hold threads and loaded models.
+	ctx = multiprocessing.get_context("spawn")
+	jobqueue = ctx.Queue()
+	results = ctx.Queue()
+	for i, args in enumerate(jobs):
+		jobqueue.put((i, work, args))
+	for _ in range(workers):
+		jobqueue.put(None)
+	processes = [ctx.Process(target=_writer,
+		args=(dbname, user, password, setup, dict(config), jobqueue, results)) for _ in range(workers)]
+	for p in processes:
+		p.start()
+
+	book_ids = [None] * len(jobs)
+	try:
+		for _ in jobs:
+			while True:
+				try:
+					i, ret = results.get(timeout=1)
+					break
+				except queue.Empty:
+					if not any(p.is_alive() for p in processes):
+						raise RuntimeError("[Error] The writers stopped before finishing the jobs.")
+			if i is None:
+				raise RuntimeError(f"[Error] A writer failed: {ret}")
+			book_ids[i] = ret
+	except BaseException:
+		for p in processes:
+			p.terminate()
+		raise
+	finally:
+		for p in processes:
+			p.join()
+	return book_ids
+
+
+def _set_models(metadata : tuple, keywords : tuple, db : DatabaseInterface):
+	"""Set the models of a writer, (method, kwargs) each. keywords may be None."""
+	db.set_metadata_method(metadata[0], **metadata[1])
+	if keywords is not None:
+		db.set_keywords_model(keywords[0], **keywords[1])
+
+
+def _analyze(db : DatabaseInterface, filesdir : str, files : list, hashes : dict,
+		copies : dict) -> list:
+	"""Job of ingest: The records of the analyzed files. The writers are the
+	parallel processes, so each renders its documents itself."""
+	books = get_books(filesdir, db.md_extractor, db._chat, render_workers=0, files=files,
+		hashes=hashes, chat_batch=db._chat_batch)
+	return [to_record(book, filesdir, hashes, copies) for book in books]
+
+
+def ingest(dbname : str, user : str, password : str, filesdir : str, metadata : tuple,
+		keywords : tuple = None, workers : int = None, chunksize : int = None) -> list:
+	"""
+	Analyze the documents of filesdir and add them to the library right away, in
+	parallel writer processes. Does what adding the books of preview_all does,
+	without the preview: Files registered before (by path) are skipped, a file
+	with the contents of a registered file becomes a further file of that book,
+	and byte-identical files are analyzed once and become files of the same book.
+	Returns the ids of the added books.
+
+	Parameters
+	-----------
+	dbname : str
+		Database name in PostgreSQL.
+	user : str
+		The name of the user in PostgreSQL.
+	password : str
+		The password for the user in PostgreSQL.
+	filesdir : str
+		The directory of the files.
+	metadata : tuple
+		(method, kwargs) for DatabaseInterface.set_metadata_method.
+	keywords : tuple
+		(method, kwargs) for DatabaseInterface.set_keywords_model. None: no keywords.
+	workers : int
+		Number of writer processes, None for INGEST_WORKERS of the config.
+	chunksize : int
+		Documents per job (and transaction), None for INGEST_CHUNK of the config.
+	"""
+	chunksize = config["INGEST_CHUNK"] if chunksize is None else chunksize
+	db = DatabaseInterface(dbname, user, password)
+	db.cur.execute("SELECT filepath FROM File;")
+	registered = {r[0] for r in db.cur.fetchall()}
+	allnames = os.listdir(filesdir)
+	names = [n for n in allnames if os.path.join(filesdir, n) not in registered]
+	hashes = dict(zip(names, hash_files([os.path.join(filesdir, n) for n in names])))
+	registered_hashes = db.find_duplicates(set(hashes.values()))
+	first = {}
+	copies = {}
+	for name in names:
+		h = hashes[name]
+		if h in registered_hashes:
+			book_id, num_pages = registered_hashes[h]
+			db.addfile(book_id, os.path.join(filesdir, name), num_pages, content_hash=h)
+		elif h in first:
+			copies[first[h]].append(name)
+		else:
+			first[h] = name
+			copies[name] = []
+	db.finish()
+	print(f"[Info] Skipped {len(allnames) - len(names)} registered files, analyzing "
+		f"{len(first)} of {len(names)} new files.")
+
+	todo = list(first.values())
+	jobs = []
+	for i in range(0, len(todo), chunksize):
+		files = todo[i:i + chunksize]
+		jobcopies = {n : copies[n] for n in files}
+		jobhashes = {n : hashes[n] for n in files + [c for n in files for c in copies[n]]}
+		jobs.append((filesdir, files, jobhashes, jobcopies))
+	book_ids = run_writers(dbname, user, password, _analyze, jobs, workers,
+		partial(_set_models, metadata, keywords))
+	return [book_id for ids in book_ids for book_id in ids]
+
+
+def main():
+	"""Ingest a directory with the methods given as in set_metadata_method
+	and set_keywords_model, without their options. Method 1 needs its options
+	(fetch_metadb, publisher), so it is only available by calling ingest."""
+	if len(sys.argv) not in (5, 6):
+		print("[Error] ingest.py expects arguments db_name, user_name, directory, "
+			"metadata_method and optionally keywords_method")
+		quit()
+	if int(sys.argv[4]) == 1:
+		print("[Error] metadata_method 1 needs the options fetch_metadb and publisher. "
+			"Call ingest from Python with (1, dict(fetch_metadb=..., publisher=...)).")
+		quit()
+	pw = getpass("Please enter the password for the DB: ")
+	keywords = None if len(sys.argv) == 5 else (int(sys.argv[5]), {})
+	book_ids = ingest(sys.argv[1], sys.argv[2], pw, sys.argv[3], (int(sys.argv[4]), {}), keywords)
+	print(f"[Info] Added {len(book_ids)} books.")
+
+
+if __name__ == "__main__":
+	main()
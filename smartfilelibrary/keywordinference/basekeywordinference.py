@@ -4,6 +4,7 @@ import abc
 import fitz
 from PIL import Image
 from smartfilelibrary.config import config
+from smartfilelibrary.tracing import get_tracer
 
 class BaseKeywordInference(metaclass=abc.ABCMeta):
     """Document keywords extractor base class. Provides core functionality."""
@@ -37,9 +38,8 @@ class BaseKeywordInference(metaclass=abc.ABCMeta):
         doc = fitz.open(path)
         page = doc.load_page(0)
         pix = page.get_pixmap(matrix = fitz.Matrix(2,2))
-        if config["DEBUG"]:
-            pix.save("debug-frontpage.png")
         self.image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        get_tracer().capture_image(path, "frontpage", self.image)
         doc.close()
 
     @abc.abstractmethod
@@ -47,6 +47,17 @@ class BaseKeywordInference(metaclass=abc.ABCMeta):
         """Get the keywords."""
         ...
 
+    def get_keywords_batch(self, titles : list) -> list:
+        """Get the keywords for several titles, in order. Models that can
+        handle several inputs at once override this.
+
+        Parameters:
+        ------------
+        titles : list of str
+            The inputs.
+        """
+        return [self.get_keywords(t) for t in titles]
+
     @abc.abstractmethod
     def load(self, model_loc : os.PathLike = "", proc_loc : os.PathLike = ""):
         """
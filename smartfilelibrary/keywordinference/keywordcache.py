@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import threading
+from typing import Union
+
+
+class KeywordCache:
+    """SQLite file remembering the answers of keyword models, keyed by the model,
+    its generation settings and the prompt. Only use it for deterministic
+    generation. Can be shared between threads."""
+
+    def __init__(self, path : os.PathLike = "keywordcache.sqlite"):
+        """This is the constructor. Creates the cache if it does not exist.
+
+        Parameters:
+        ------------
+        path : os.PathLike
+            The SQLite file.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS answer(
+            model TEXT NOT NULL,
+            settings TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            PRIMARY KEY(model, settings, prompt)
+        ) WITHOUT ROWID;""")
+
+    def get(self, model : str, settings : str, prompt : str) -> Union[None, str]:
+        """Get the stored answer, None if unknown.
+
+        Parameters:
+        ------------
+        model : str
+            Name of the model.
+        settings : str
+            Describes the generation settings.
+        prompt : str
+            The model input.
+        """
+        with self._lock:
+            row = self.conn.execute("SELECT answer FROM answer WHERE model = ? AND settings = ? "
+                "AND prompt = ?", (model, settings, prompt)).fetchone()
+        return None if row is None else row[0]
+
+    def put_many(self, model : str, settings : str, answers : dict):
+        """Store answers and commit.
+
+        Parameters:
+        ------------
+        model : str
+            Name of the model.
+        settings : str
+            Describes the generation settings.
+        answers : dict
+            Maps prompts to answers.
+        """
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO answer (model, settings, prompt, answer) "
+                "VALUES (?, ?, ?, ?)", [(model, settings, p, a) for p, a in answers.items()])
+
+    def close(self):
+        """Close the cache."""
+        self.conn.close()
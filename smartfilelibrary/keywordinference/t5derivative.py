@@ -1,23 +1,54 @@
 import os
 import re
+import torch
 import fitz
 from PIL import Image
 from smartfilelibrary.config import config
+from smartfilelibrary.inferencemode import apply_precision
+from typing import Collection
 from .basekeywordinference import BaseKeywordInference
+from .keywordcache import KeywordCache
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 from transformers import pipeline
 
 
 class T5Derivative(BaseKeywordInference):
-    """Document analyzer base class. Provides core functionality."""
+    """Keywords extractor using a derivative of Google's T5 model.
+
+    By default, generation is greedy with at most max_new_tokens tokens, which
+    makes the answers deterministic. They are then kept in a KeywordCache, such
+    that repeated prompts skip generation. With sampling=True, the previous
+    behavior, sampling up to MAXOUTPUTLENGTH tokens, is used and nothing is cached."""
 
     HUGGINGFACE_NAME = "MBZUAI/LaMini-Flan-T5-783M"
     MAXOUTPUTLENGTH = 2048
 
-    def __init__(self):
+    def __init__(self, batchsize : int = 8, max_new_tokens : int = 128, sampling : bool = False,
+            cache : os.PathLike = "keywordcache.sqlite", precision : str = None):
+        """This is the constructor.
+
+        Parameters:
+        ------------
+        batchsize : int
+            Number of prompts the pipeline runs through the model at once.
+        max_new_tokens : int
+            Maximum length of an answer in tokens, for greedy generation.
+        sampling : bool
+            Sample the answers instead of greedy generation.
+        cache : os.PathLike
+            The file of the KeywordCache. None disables caching.
+        precision : str
+            "fp32", "bf16" or "int8", see inferencemode.apply_precision.
+            None uses PRECISION of the config.
+        """
         self._tokenizer = None
         self.model = None
         self._model = None
+        self.batchsize = batchsize
+        self.max_new_tokens = max_new_tokens
+        self.sampling = sampling
+        self.precision = config["PRECISION"] if precision is None else precision
+        self.cache = None if cache is None or sampling else KeywordCache(cache)
 
     def get_extraction_name(self):
         """Get the name of the method to extract metadata."""
@@ -25,7 +56,43 @@ class T5Derivative(BaseKeywordInference):
 
     def get_keywords(self, title : str):
         """Get the keywords."""
-        return self.model(title, max_length=self.MAXOUTPUTLENGTH, do_sample=True)[0]['generated_text']
+        return self.get_keywords_batch([title])[0]
+
+    def get_keywords_batch(self, titles : Collection[str]) -> list:
+        """Get the keywords for several prompts, in order. Cached answers are
+        reused, the other distinct prompts are run through the pipeline in batches.
+
+        Parameters:
+        ------------
+        titles : collection of str
+            The prompts.
+        """
+        settings = f"greedy-{self.max_new_tokens}"
+        if self.precision != "fp32":
+            settings += f"-{self.precision}"
+        answers = {}
+        if self.cache is not None:
+            for title in set(titles):
+                answer = self.cache.get(self.HUGGINGFACE_NAME, settings, title)
+                if answer is not None:
+                    answers[title] = answer
+        todo = [t for t in dict.fromkeys(titles) if t not in answers]
+        if todo:
+            if self.sampling:
+                kwargs = {"max_length" : self.MAXOUTPUTLENGTH, "do_sample" : True}
+            else:
+                kwargs = {"max_new_tokens" : self.max_new_tokens, "do_sample" : False}
+            with torch.inference_mode():
+                outputs = self.model(todo, batch_size=self.batchsize, **kwargs)
+            generated = {}
+            for title, output in zip(todo, outputs):
+                if isinstance(output, list):
+                    output = output[0]
+                generated[title] = output['generated_text']
+            if self.cache is not None:
+                self.cache.put_many(self.HUGGINGFACE_NAME, settings, generated)
+            answers.update(generated)
+        return [answers[t] for t in titles]
 
     def load(self, model_loc : os.PathLike = "", proc_loc : os.PathLike = ""):
         """
@@ -47,6 +114,7 @@ class T5Derivative(BaseKeywordInference):
         self._tokenizer = AutoTokenizer.from_pretrained(self.HUGGINGFACE_NAME)
         self._model = AutoModelForSeq2SeqLM.from_pretrained(self.HUGGINGFACE_NAME, 
             revision="refs/pr/6", use_safetensors=True)
+        self._model = apply_precision(self._model.eval(), self.precision, "cpu")
 
         self.model = pipeline(task= 'text2text-generation', 
             model=self._model, tokenizer=self._tokenizer)
@@ -73,4 +141,4 @@ class T5Derivative(BaseKeywordInference):
             The shard size. Allows smoother loading.
         """
         self._tokenizer.save_pretrained(proc_loc)
-        self._model.save_pretrained(model_loc", max_shard_size=sharding_size)
\ No newline at end of file
+        self._model.save_pretrained(model_loc, max_shard_size=sharding_size)
\ No newline at end of file
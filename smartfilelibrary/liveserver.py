@@ -1,14 +1,148 @@
 """Provides the REST server for the webinterface."""
 import os
+import re
 import sys
 import signal
+import threading
 from getpass import getpass
-from flask import Flask, request, jsonify
+import json
+from flask import Flask, Response, request, jsonify, abort, g
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 
-from .databaseinterface import DatabaseInterface
+from .config import config
+from .databaseinterface import stream_rows
+from .actionlog import ActionLog
  
 app = Flask(__name__)
 
+MAXPAGESIZE = 1000
+
+pool = None
+username = None
+actionlog = None
+
+
+class ConnectionPool:
+    """A psycopg2 ThreadedConnectionPool that waits up to timeout seconds for a
+    free connection instead of failing when all are in use."""
+
+    def __init__(self, minconn : int, maxconn : int, timeout : float, **kwargs):
+        """This is the constructor. Opens minconn connections.
+
+        Parameter
+        ----------
+        minconn : int
+            Connections kept open.
+        maxconn : int
+            Maximum number of connections.
+        timeout : float
+            Seconds to wait for a free connection.
+        kwargs
+            Passed to psycopg2.connect.
+        """
+        self.timeout = timeout
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **kwargs)
+        self._free = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self):
+        """Take a connection. Raises PoolError if none got free in time."""
+        if not self._free.acquire(timeout=self.timeout):
+            raise PoolError("No free database connection.")
+        try:
+            return self._pool.getconn()
+        except:
+            self._free.release()
+            raise
+
+    def putconn(self, conn, close : bool = False):
+        """Give a connection back, closing it if close is set."""
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._free.release()
+
+    def closeall(self):
+        """Close all connections."""
+        self._pool.closeall()
+
+
+def init_pool(dbname : str, user : str, password : str, minconn : int = None,
+        maxconn : int = None, timeout : float = None):
+    """Open the connection pool of the server. Defaults are LIVESERVER_POOL_MIN,
+    LIVESERVER_POOL_MAX and LIVESERVER_POOL_TIMEOUT of the config.
+
+    Parameter
+    ----------
+    dbname : str
+        Database name in PostgreSQL.
+    user : str
+        The name of the user in PostgreSQL.
+    password : str
+        The password for the user in PostgreSQL.
+
+    Also opens the action log (LOG_FILE of the config) for the modifications.
+    """
+    global pool, username, actionlog
+    pool = ConnectionPool(
+        config["LIVESERVER_POOL_MIN"] if minconn is None else minconn,
+        config["LIVESERVER_POOL_MAX"] if maxconn is None else maxconn,
+        config["LIVESERVER_POOL_TIMEOUT"] if timeout is None else timeout,
+        host="localhost", database=dbname, user=user, password=password)
+    username = user
+    actionlog = ActionLog(config["LOG_FILE"])
+
+
+def get_conn():
+    """Get the database connection of the current request. It is taken from
+    the pool on first use and given back when the request ends, see release_conn."""
+    if "conn" not in g:
+        g.conn = pool.getconn()
+    return g.conn
+
+
+@app.teardown_appcontext
+def release_conn(exc):
+    """Give the connection of the request back to the pool, see _giveback."""
+    conn = g.pop("conn", None)
+    if conn is not None:
+        _giveback(conn, exc is None)
+
+
+def _giveback(conn, commit : bool):
+    """Commit or roll back, and give the connection back to the pool.
+    Broken connections are closed."""
+    close = bool(conn.closed)
+    if not close:
+        try:
+            if commit:
+                conn.commit()
+            else:
+                conn.rollback()
+        except psycopg2.Error:
+            close = True
+    pool.putconn(conn, close=close)
+
+
+@app.errorhandler(PoolError)
+def busy(e):
+    """All connections stayed in use for LIVESERVER_POOL_TIMEOUT seconds."""
+    return jsonify({"error" : str(e)}), 503
+
+
+def _execute(command : str, params = None, log : bool = False):
+    """Execute a SQL statement on the connection of the request and return the
+    rows, if any. Modifications are committed right away and logged like
+    DatabaseInterface.execute does, see actionlog.ActionLog.commit."""
+    with get_conn().cursor() as cur:
+        cur.execute(command, params)
+        rows = cur.fetchall() if cur.description is not None else None
+        if log:
+            with actionlog.batch():
+                actionlog.statement(command, params, cur.query)
+                actionlog.commit(cur.connection)
+    return rows
+
 
 def get_argument(arg : str):
     """Get argument from the most recent request. 
@@ -31,6 +165,7 @@ def get_argument(arg : str):
 def add_header(response):
     """Add CORS header."""
     response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Expose-Headers'] = 'X-Next-Cursor'
     return response
 
 @app.route('/status')
@@ -42,9 +177,9 @@ def get_status():
 def get_dbmeta():
     """Get metadata about the library. So far, it only accepts
     ?key=user to return the username."""
-    global db
     if get_argument("key") == "user":
-        return jsonify(db.get_username())
+        return jsonify(username)
+    abort(400)
 
 @app.route('/turnoff')
 def shutdown():
@@ -62,76 +197,205 @@ def set_fav():
     Update the favourite status using the web interface.
     Done as GET method for convenience.
     """
-    global db
-    fav = get_argument("val")
-    bid = get_argument("id")
-    value = "false"
-    if fav == "1":
-        value = "true"
-    db.execute(
-        f"""UPDATE Book
-        SET favorite = {value}
-        WHERE book_id = {bid};"""
-        )
+    bid = _int_argument("id")
+    if bid is None:
+        abort(400)
+    _execute(
+        """UPDATE Book
+        SET favorite = %s
+        WHERE book_id = %s;""",
+        (get_argument("val") == "1", bid), log=True)
     return ""
 
 
+QUERY_BOOKS = """SELECT book_id, title, name, favorite,
+        COALESCE(array_agg(bt.topic_name) FILTER (WHERE bt.topic_name IS NOT NULL), '{{}}')
+    FROM Book
+    LEFT JOIN Publisher USING(pub_id)
+    LEFT JOIN book_topic bt USING(book_id)
+    WHERE {conditions}
+    GROUP BY book_id, title, name, favorite
+    ORDER BY book_id
+    {limit};"""
+
+RANK_BOOKS = """SELECT book_id, title, name, favorite,
+        COALESCE(array_agg(bt.topic_name) FILTER (WHERE bt.topic_name IS NOT NULL), '{{}}')
+    FROM (SELECT book_id, ts_rank(search, query, 1) + word_similarity(%s, search_text) AS rank
+        FROM Book, to_tsquery('english', %s) query
+        WHERE (search @@ query OR %s <%% search_text) AND {conditions}
+        ORDER BY rank DESC, book_id
+        LIMIT %s OFFSET %s) ranked
+    JOIN Book USING(book_id)
+    LEFT JOIN Publisher USING(pub_id)
+    LEFT JOIN book_topic bt USING(book_id)
+    GROUP BY rank, book_id, title, name, favorite
+    ORDER BY rank DESC, book_id;"""
+
+
+def _filters(query : str, form : str):
+    """The conditions on Book for the keyword and the form, and their parameters.
+    See _search_books."""
+    conditions = ["TRUE"]
+    params = []
+    if form != "all":
+        conditions.append("form_id = (SELECT form_id FROM Form WHERE form_name = %s)")
+        params.append(form)
+    if query != "*":
+        conditions.append(
+            """EXISTS (SELECT 1 FROM topic_closure c JOIN book_topic kw
+                ON kw.topic_name = c.descendant_name
+            WHERE kw.book_id = Book.book_id AND lower(c.ancestor_name) = lower(%s))""")
+        params.append(query)
+    return conditions, params
+
+
+def _search_books(query : str, form : str, cursor : int = None, limit : int = None):
+    """Build the query fetching the matching books together with their topics.
+    Returns the SQL string and its parameters.
+
+    Parameter
+    ----------
+    query : str
+        The keyword, matched case insensitive against the topics. Books with a
+        subtopic of it match too (see topic_closure). '*' matches all.
+    form : str
+        The form name, or 'all'.
+    cursor : int
+        Only return books with a book_id larger than this (keyset pagination).
+    limit : int
+        Maximum number of books to return.
+    """
+    conditions, params = _filters(query, form)
+    if cursor is not None:
+        conditions.append("book_id > %s")
+        params.append(cursor)
+    sql = QUERY_BOOKS.format(conditions=" AND ".join(conditions),
+        limit="" if limit is None else "LIMIT %s")
+    if limit is not None:
+        params.append(limit)
+    return sql, params
+
+
+def _tsquery(text : str) -> str:
+    """Turn search text into a tsquery matching all its words as prefixes."""
+    return " & ".join(f"{word}:*" for word in re.findall(r"[^\W_]+", text))
+
+
+def _rank_books(text : str, query : str, form : str, offset : int, limit : int):
+    """Build the ranked search for text in the titles and topics. Books match if
+    they contain all words of text, as words or prefixes of words (full-text
+    search), or if text is similar to a part of their title and topics
+    (trigram search, catches typos). Best matches first. Returns the SQL string
+    and its parameters.
+
+    Parameter
+    ----------
+    text : str
+        The search text.
+    query : str
+        Only books with this topic, see _search_books. '*' or '' for all.
+    form : str
+        The form name, or 'all'.
+    offset : int
+        Number of best matches to skip.
+    limit : int
+        Maximum number of books to return.
+    """
+    conditions, params = _filters("*" if query == "" else query, form)
+    sql = RANK_BOOKS.format(conditions=" AND ".join(conditions))
+    return sql, [text, _tsquery(text), text] + params + [limit, offset]
+
+
+def _to_entry(row):
+    """Convert a row of QUERY_BOOKS into the JSON entry of the frontend. Books
+    without a publisher have no author."""
+    bid, title, pubname, fav, tps = row
+    return {
+        "id" : bid,
+        "title" : title,
+        "author" : "" if pubname is None else ("published by " + pubname).title(),
+        "keywords" : tps,
+        "favourite" : fav
+        }
+
+
+def _int_argument(arg : str):
+    """Get an integer argument from the most recent request. Returns None if not
+    given, aborts the request with 400 if it is not a non-negative integer."""
+    value = get_argument(arg)
+    if value == "":
+        return None
+    if not value.isdigit():
+        abort(400)
+    return int(value)
+
+
 @app.route('/query')
 def query_db():
-    """Query main entry point."""
-    global db # need to be explicit with flask
+    """Query main entry point.
+
+    Optional arguments are limit (page size) and cursor (the id of the last
+    book of the previous page). The cursor for the next page is sent in the
+    X-Next-Cursor header. With stream=1 the results are streamed as
+    newline delimited JSON, one entry per line.
+
+    With q, the books are searched for the text q and returned best match
+    first, see _rank_books. kw then optionally restricts to a topic. The
+    cursor is the number of results already shown, pages hold at most
+    MAXPAGESIZE results."""
     query = get_argument("kw")
     form = get_argument("form")
-    
-    if form == "all":
-        res = db.execute(
-            """SELECT book_id, title, name, favorite 
-            FROM Book JOIN Publisher USING(pub_id);"""
-            )
+    cursor = _int_argument("cursor")
+    limit = _int_argument("limit")
+    if limit is not None:
+        limit = min(max(limit, 1), MAXPAGESIZE)
+
+    text = get_argument("q")
+    if text != "":
+        limit = MAXPAGESIZE if limit is None else limit
+        sql, params = _rank_books(text, query, form, 0 if cursor is None else cursor, limit)
     else:
-        res = db.execute(
-            f"""SELECT book_id, title, name, favorite 
-            FROM Book 
-            JOIN Publisher USING(pub_id)
-            JOIN Form USING(form_id)
-            WHERE form_name = '{form}';"""
-            )
-    ret = []
-    for bid, title, pubname, fav in res:
-        res = db.execute(
-            f"""SELECT topic_name FROM book_topic WHERE book_id = {int(bid)};"""
-        )
-        tps = [i[0] for i in res]
-        tpscheck = [i[0].lower() for i in res]
-        if query.lower() not in tpscheck and query != "*":
-            continue
-
-        ret.append(
-            {
-            "id" : bid,
-            "title" : title,
-            "author" : ("published by " + pubname).title(),
-            "keywords" : tps,
-            "favourite" : fav
-            })
-
-    if ret == []:
+        sql, params = _search_books(query, form, cursor, limit)
+
+    if get_argument("stream") == "1":
+        # The request context ends before the response is streamed, so the
+        # stream has its own connection, given back when the response is closed.
+        conn = pool.getconn()
+        def generate():
+            for row in stream_rows(conn, sql, params):
+                yield json.dumps(_to_entry(row)) + "\n"
+        response = Response(generate(), mimetype="application/x-ndjson")
+        response.call_on_close(lambda: _giveback(conn, False))
+        return response
+
+    ret = [_to_entry(row) for row in _execute(sql, params)]
+    nextcursor = None
+    if limit is not None and len(ret) == limit:
+        nextcursor = ret[-1]["id"] if text == "" else (0 if cursor is None else cursor) + limit
+
+    if ret == [] and cursor is None:
         ret = [{"title" : "Could not find any matches.",
             "author" : "",
             "keywords" : [],
             "favourite" : False
             }]
-    return jsonify(ret)
+    response = jsonify(ret)
+    if nextcursor is not None:
+        response.headers["X-Next-Cursor"] = str(nextcursor)
+    return response
 
 
 def main():
-    """Main loop for the server."""
-    global db
+    """Main loop for the server. Requests are handled in threads, each with its
+    own connection from the pool."""
     if len(sys.argv) != 3:
         print("[Error] liveserver.py expects arguments db_name, user_name")
         quit()
     pw = getpass("Please enter the password for the DB: ")
-    db = DatabaseInterface(sys.argv[1], sys.argv[2], pw)
+    init_pool(sys.argv[1], sys.argv[2], pw)
  
-    app.run()
+    try:
+        app.run(threaded=True)
+    finally:
+        pool.closeall()
 
@@ -0,0 +1,131 @@
+"""Persistent record of the analyzed files, used for incremental previews,
+and the content hashes used to find duplicate files."""
+
+import os
+import json
+import mmap
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Collection
+
+
+def file_hash(path : os.PathLike) -> str:
+	"""
+	Get the SHA-256 hex digest of the file contents. The file is memory mapped
+	and hashed in one call, which releases the GIL.
+
+	Parameters
+	-----------
+	path : os.PathLike
+		The path of the file.
+	"""
+	with open(path, "rb") as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			return hashlib.sha256().hexdigest()
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+			return hashlib.sha256(m).hexdigest()
+
+
+def hash_files(paths : Collection[os.PathLike], workers : int = None) -> list:
+	"""
+	Get file_hash for all paths, in order, using a thread pool.
+
+	Parameters
+	-----------
+	paths : collection of os.PathLike
+		The files.
+	workers : int
+		Number of threads, None for the default of ThreadPoolExecutor.
+	"""
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		return list(pool.map(file_hash, paths))
+
+
+class FileManifest:
+	"""Remembers path, size, mtime and content hash of every analyzed file together
+	with the result of the analysis. A file whose size and mtime did not change is
+	considered unchanged without reading it. Otherwise its hash decides."""
+
+	def __init__(self, path : os.PathLike = "filemanifest.json"):
+		"""This is the constructor. Loads the manifest if it exists.
+
+		Parameters
+		-----------
+		path : os.PathLike
+			Where the manifest is stored.
+		"""
+		self.path = path
+		self.entries = {}
+		self._hashes = {}
+		if os.path.exists(path):
+			with open(path, "r") as f:
+				self.entries = json.load(f)
+
+	def get_hash(self, filepath : os.PathLike) -> str:
+		"""
+		Get the content hash of the file. Taken from the manifest if size and
+		mtime did not change, else computed.
+
+		Parameters
+		-----------
+		filepath : os.PathLike
+			The path of the file.
+		"""
+		key = os.path.abspath(filepath)
+		entry = self.entries.get(key)
+		if entry is not None:
+			st = os.stat(filepath)
+			if st.st_size == entry["size"] and st.st_mtime_ns == entry["mtime"]:
+				return entry["hash"]
+		if key not in self._hashes:
+			self._hashes[key] = file_hash(filepath)
+		return self._hashes[key]
+
+	def get_result(self, filepath : os.PathLike):
+		"""
+		Get the stored analysis result of the file, None if unknown or changed.
+
+		Parameters
+		-----------
+		filepath : os.PathLike
+			The path of the file.
+		"""
+		entry = self.entries.get(os.path.abspath(filepath))
+		if entry is None or self.get_hash(filepath) != entry["hash"]:
+			return None
+		st = os.stat(filepath)
+		entry["size"] = st.st_size
+		entry["mtime"] = st.st_mtime_ns
+		return entry["result"]
+
+	def record(self, filepath : os.PathLike, result):
+		"""
+		Store the state of the file and its analysis result.
+
+		Parameters
+		-----------
+		filepath : os.PathLike
+			The path of the file.
+		result : JSON serializable
+			The analysis result, like one entry of utilities.get_books.
+		"""
+		key = os.path.abspath(filepath)
+		st = os.stat(filepath)
+		digest = self._hashes.pop(key, None)
+		if digest is None:
+			digest = file_hash(filepath)
+		self.entries[key] = {
+			"size" : st.st_size,
+			"mtime" : st.st_mtime_ns,
+			"hash" : digest,
+			"result" : result
+		}
+
+	def save(self):
+		"""
+		Write the manifest to disk. The previous version is replaced atomically.
+		"""
+		tmp = f"{self.path}.tmp"
+		with open(tmp, "w") as f:
+			json.dump(self.entries, f)
+		os.replace(tmp, self.path)
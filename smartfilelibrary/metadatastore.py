@@ -0,0 +1,193 @@
+"""On-disk index of the crossref metadata, keyed by ISBN and DOI."""
+import os
+import re
+import json
+import pickle
+import sqlite3
+from typing import Iterable, Union
+
+
+def normalize_isbn(isbn : str) -> str:
+	"""
+	Normalize an ISBN: Drop hyphens and spaces, upper case check digit.
+
+	Parameters
+	-----------
+	isbn : str
+		The ISBN.
+	"""
+	return re.sub(r"[\s-]", "", str(isbn)).upper()
+
+
+def normalize_doi(doi : str) -> str:
+	"""
+	Normalize a DOI: Drop resolver prefixes and surrounding whitespace, lower case.
+
+	Parameters
+	-----------
+	doi : str
+		The DOI.
+	"""
+	doi = str(doi).strip().lower()
+	return re.sub(r"^(https?://(dx\.)?doi\.org/|doi:)", "", doi)
+
+
+class CrossrefStore:
+	"""SQLite file holding crossref records, indexed by normalized ISBN and DOI.
+	Opening the store does not read the records, every lookup is an index search
+	that only loads the matching record."""
+
+	SCHEMA = """
+CREATE TABLE IF NOT EXISTS record(
+	record_id INTEGER PRIMARY KEY,
+	data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS identifier(
+	kind TEXT NOT NULL, -- 'isbn' or 'doi'
+	value TEXT NOT NULL,
+	record_id INTEGER NOT NULL REFERENCES record,
+	PRIMARY KEY(kind, value)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS checkpoint(
+	query TEXT PRIMARY KEY,
+	cursor TEXT NOT NULL,
+	seen INTEGER NOT NULL,
+	done INTEGER NOT NULL
+);"""
+
+	def __init__(self, path : os.PathLike):
+		"""This is the constructor. Creates the store if it does not exist.
+
+		Parameters
+		-----------
+		path : os.PathLike
+			The SQLite file.
+		"""
+		self.path = path
+		self.conn = sqlite3.connect(path)
+		self.conn.executescript(self.SCHEMA)
+
+	def add(self, records : Iterable[dict], checkpoint : tuple = None) -> int:
+		"""
+		Add crossref records and commit. Returns the number of records added.
+		Records with a DOI that is already in the store are skipped. For other
+		identifiers already in the store, the first record is kept.
+
+		Parameters
+		-----------
+		records : iterable of dict
+			Crossref publications as returned by the crossref API.
+		checkpoint : tuple
+			Arguments for set_checkpoint, written in the same transaction.
+		"""
+		n = 0
+		with self.conn:
+			for rec in records:
+				dois = [normalize_doi(d) for d in self._as_list(rec.get("DOI"))]
+				if any(self._lookup_id("doi", d) is not None for d in dois):
+					continue
+				cur = self.conn.execute("INSERT INTO record (data) VALUES (?)", (json.dumps(rec),))
+				keys = [("isbn", normalize_isbn(i)) for i in self._as_list(rec.get("ISBN"))]
+				keys += [("doi", d) for d in dois]
+				self.conn.executemany("INSERT OR IGNORE INTO identifier (kind, value, record_id) "
+					"VALUES (?, ?, ?)", [(k, v, cur.lastrowid) for k, v in keys])
+				n += 1
+			if checkpoint is not None:
+				self._set_checkpoint(*checkpoint)
+		return n
+
+	def get_checkpoint(self, query : str):
+		"""
+		Get (cursor, seen, done) of the harvest for query, None if there is none.
+
+		Parameters
+		-----------
+		query : str
+			Identifies the harvest.
+		"""
+		row = self.conn.execute("SELECT cursor, seen, done FROM checkpoint WHERE query = ?",
+			(query,)).fetchone()
+		return None if row is None else (row[0], row[1], bool(row[2]))
+
+	def set_checkpoint(self, query : str, cursor : str, seen : int, done : bool):
+		"""
+		Store the progress of a harvest and commit.
+
+		Parameters
+		-----------
+		query : str
+			Identifies the harvest.
+		cursor : str
+			The crossref cursor of the next page.
+		seen : int
+			Number of entries fetched so far.
+		done : bool
+			Whether the harvest is complete.
+		"""
+		with self.conn:
+			self._set_checkpoint(query, cursor, seen, done)
+
+	def _set_checkpoint(self, query : str, cursor : str, seen : int, done : bool):
+		self.conn.execute("INSERT OR REPLACE INTO checkpoint (query, cursor, seen, done) "
+			"VALUES (?, ?, ?, ?)", (query, cursor, seen, int(done)))
+
+	def import_pickle(self, dumpfile : os.PathLike) -> int:
+		"""
+		Add the records of a pickled list, the format used by previous versions.
+
+		Parameters
+		-----------
+		dumpfile : os.PathLike
+			The pickle file.
+		"""
+		with open(dumpfile, "rb") as f:
+			return self.add(pickle.load(f))
+
+	def lookup_isbn(self, isbn : str) -> Union[None, dict]:
+		"""
+		Get the record with this ISBN, None if unknown.
+
+		Parameters
+		-----------
+		isbn : str
+			The ISBN, normalized on lookup.
+		"""
+		return self._lookup("isbn", normalize_isbn(isbn))
+
+	def lookup_doi(self, doi : str) -> Union[None, dict]:
+		"""
+		Get the record with this DOI, None if unknown.
+
+		Parameters
+		-----------
+		doi : str
+			The DOI, normalized on lookup.
+		"""
+		return self._lookup("doi", normalize_doi(doi))
+
+	def __len__(self):
+		return self.conn.execute("SELECT COUNT(*) FROM record").fetchone()[0]
+
+	def close(self):
+		"""Close the store."""
+		self.conn.close()
+
+	def _lookup(self, kind : str, value : str) -> Union[None, dict]:
+		record_id = self._lookup_id(kind, value)
+		if record_id is None:
+			return None
+		row = self.conn.execute("SELECT data FROM record WHERE record_id = ?", (record_id,)).fetchone()
+		return json.loads(row[0])
+
+	def _lookup_id(self, kind : str, value : str) -> Union[None, int]:
+		row = self.conn.execute("SELECT record_id FROM identifier WHERE kind = ? AND value = ?",
+			(kind, value)).fetchone()
+		return None if row is None else row[0]
+
+	@staticmethod
+	def _as_list(value):
+		if value is None:
+			return []
+		if isinstance(value, (list, tuple)):
+			return value
+		return [value]
@@ -0,0 +1,425 @@
+"""Long-lived process keeping the AI models loaded, such that ingestion runs
+do not load them again. Start it with
+
+	python -m smartfilelibrary.modelserver --metadata 3 --keywords 1
+
+DatabaseInterface.set_metadata_method and set_keywords_model then use the
+models of the server if it serves the requested method, see remote_model."""
+import os
+import stat
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from typing import Callable, Collection, Union
+
+from .config import config
+from .methodconstants import DONUTFT, MOONDREAM2, T5DERIVATIVE
+
+
+def _check_private(path : str, mode : int):
+	"""
+	Raise PermissionError unless path is owned by the current user, no symlink,
+	of the type of mode and not accessible by others.
+
+	Parameters
+	-----------
+	path : str
+		The file, socket or directory.
+	mode : int
+		stat.S_IFDIR, stat.S_IFSOCK or stat.S_IFREG.
+	"""
+	st = os.lstat(path)
+	if stat.S_IFMT(st.st_mode) != mode or st.st_uid != os.getuid():
+		kind = {stat.S_IFDIR : "directory", stat.S_IFSOCK : "socket"}.get(mode, "file")
+		raise PermissionError(f"{path} is not a {kind} owned by the current user.")
+	if mode != stat.S_IFSOCK and st.st_mode & 0o077:
+		raise PermissionError(f"{path} is accessible by other users.")
+
+
+def default_address() -> str:
+	"""The Unix socket used if MODEL_SERVER_ADDRESS in the config is None, in a
+	directory only the user can access: $XDG_RUNTIME_DIR/smartfilelibrary, else
+	~/.cache/smartfilelibrary. Created if missing."""
+	base = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(os.path.expanduser("~"), ".cache")
+	directory = os.path.join(base, "smartfilelibrary")
+	os.makedirs(directory, mode=0o700, exist_ok=True)
+	_check_private(directory, stat.S_IFDIR)
+	return os.path.join(directory, "models.sock")
+
+
+def _keyfile(address : str) -> str:
+	"""The file next to a Unix socket holding the authkey of its server."""
+	return address + ".key"
+
+
+def _read_authkey(address : str) -> bytes:
+	"""The authkey of the server at the Unix socket address, after checking that
+	the key belongs to the current user."""
+	_check_private(_keyfile(address), stat.S_IFREG)
+	with open(_keyfile(address), "rb") as f:
+		return f.read()
+
+
+def _resolve(address : str = None, authkey : bytes = None) -> tuple:
+	"""
+	Get the address and authkey for multiprocessing.connection. An address
+	"host:port" is a TCP socket, which requires an authkey, else it is the path
+	of a Unix socket. Its server writes a random authkey next to it, see
+	serve_forever, which the clients read if authkey is None.
+
+	Parameters
+	-----------
+	address : str
+		None for MODEL_SERVER_ADDRESS of the config.
+	authkey : bytes
+		None for MODEL_SERVER_AUTHKEY of the config.
+	"""
+	address = config["MODEL_SERVER_ADDRESS"] if address is None else address
+	address = default_address() if address is None else address
+	authkey = config["MODEL_SERVER_AUTHKEY"] if authkey is None else authkey
+	if isinstance(authkey, str):
+		authkey = authkey.encode()
+	if ":" in address and os.path.sep not in address:
+		if authkey is None:
+			raise ValueError("A model server on a TCP address needs MODEL_SERVER_AUTHKEY.")
+		host, port = address.rsplit(":", 1)
+		return (host, int(port)), authkey
+	return address, authkey
+
+
+class _Batcher:
+	"""Runs a batched function in its own thread. Requests of concurrent callers
+	that arrive within maxwait seconds are combined, up to maxbatch items per call."""
+
+	def __init__(self, run : Callable[list, list], maxbatch : int, maxwait : float):
+		self.run = run
+		self.maxbatch = max(maxbatch, 1)
+		self.maxwait = maxwait
+		self.requests = queue.Queue()
+		threading.Thread(target=self._loop, daemon=True).start()
+
+	def submit(self, items : list) -> list:
+		"""Get the results for items, blocks until they are computed."""
+		future = Future()
+		self.requests.put((list(items), future))
+		return future.result()
+
+	def _loop(self):
+		while True:
+			pending = [self.requests.get()]
+			count = len(pending[0][0])
+			deadline = time.monotonic() + self.maxwait
+			while count < self.maxbatch:
+				try:
+					request = self.requests.get(timeout=max(deadline - time.monotonic(), 0))
+				except queue.Empty:
+					break
+				pending.append(request)
+				count += len(request[0])
+			items = [item for request, _ in pending for item in request]
+			try:
+				results = []
+				for start in range(0, len(items), self.maxbatch):
+					results.extend(self.run(items[start : start + self.maxbatch]))
+			except Exception as e:
+				for _, future in pending:
+					future.set_exception(e)
+				continue
+			start = 0
+			for request, future in pending:
+				future.set_result(results[start : start + len(request)])
+				start += len(request)
+
+
+class ModelServer:
+	"""Keeps a metadata analyzer and a keywords model loaded and answers the
+	requests of ModelClient. Every client connection has its own thread. The
+	requests of all clients go to one batching thread per model, see _Batcher."""
+
+	METADATA_METHODS = (DONUTFT, MOONDREAM2)
+	KEYWORDS_METHODS = (T5DERIVATIVE,)
+
+	def __init__(self, metadata : int = None, keywords : int = None, model_kwargs : dict = None,
+			batchsize : int = None, maxwait : float = 0.05):
+		"""This is the constructor. Loads the models.
+
+		Parameters
+		-----------
+		metadata : int
+			The metadata method, see methodconstants. None serves no analyzer.
+		keywords : int
+			The keywords method, see methodconstants. None serves no keywords model.
+		model_kwargs : dict
+			Passed to both models, like precision.
+		batchsize : int
+			Maximum number of documents per analyzer call, None for
+			ANALYZER_BATCHSIZE of the config. Keyword calls take 8 times as many prompts.
+		maxwait : float
+			Seconds to wait for requests of other clients before running a batch.
+		"""
+		batchsize = config["ANALYZER_BATCHSIZE"] if batchsize is None else batchsize
+		self.model_kwargs = {} if model_kwargs is None else dict(model_kwargs)
+		self.methods = {"metadata" : metadata, "keywords" : keywords}
+		self.names = {}
+		self.batchers = {}
+		if metadata is not None:
+			if metadata not in self.METADATA_METHODS:
+				raise ValueError(f"The model server cannot serve metadata method {metadata}.")
+			from .analyzers.donut_base_finetuned import DonutAnalyzer
+			from .analyzers.moondream2 import Moondream2
+			cls = {DONUTFT : DonutAnalyzer, MOONDREAM2 : Moondream2}[metadata]
+			analyzer = cls(**self.model_kwargs)
+			analyzer.load()
+			self.names["metadata"] = analyzer.get_extraction_name()
+			self.batchers["metadata"] = _Batcher(analyzer.analyze_batch, batchsize, maxwait)
+		if keywords is not None:
+			if keywords not in self.KEYWORDS_METHODS:
+				raise ValueError(f"The model server cannot serve keywords method {keywords}.")
+			from .keywordinference.t5derivative import T5Derivative
+			model = T5Derivative(**self.model_kwargs)
+			model.load()
+			self.names["keywords"] = model.get_extraction_name()
+			self.batchers["keywords"] = _Batcher(model.get_keywords_batch, 8 * batchsize, maxwait)
+
+	def info(self) -> dict:
+		"""What the server serves: method, name and kwargs per model."""
+		return {kind : {"method" : self.methods[kind], "name" : self.names[kind],
+			"kwargs" : self.model_kwargs} for kind in self.batchers}
+
+	def serve_forever(self, address : str = None, authkey : bytes = None):
+		"""
+		Accept clients until interrupted.
+
+		Parameters
+		-----------
+		address : str
+			Unix socket path or "host:port", see _resolve.
+		authkey : bytes
+			Shared secret of server and clients, see _resolve.
+		"""
+		address, authkey = _resolve(address, authkey)
+		unix = isinstance(address, str)
+		if unix and os.path.lexists(address):
+			# Only a stale socket of this user is replaced.
+			_check_private(address, stat.S_IFSOCK)
+			try:
+				Client(address, authkey=authkey or _read_authkey(address)).close()
+				raise RuntimeError(f"A model server is already running at {address}.")
+			except (ConnectionError, FileNotFoundError, AuthenticationError, EOFError):
+				os.unlink(address)
+		if unix and authkey is None:
+			authkey = os.urandom(32)
+			if os.path.lexists(_keyfile(address)):
+				_check_private(_keyfile(address), stat.S_IFREG)
+				os.unlink(_keyfile(address))
+			fd = os.open(_keyfile(address), os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+			with os.fdopen(fd, "wb") as f:
+				f.write(authkey)
+		umask = os.umask(0o177)
+		try:
+			listener = Listener(address, authkey=authkey)
+		finally:
+			os.umask(umask)
+		print(f"[Info] Model server listening at {listener.address}")
+		try:
+			with listener:
+				while True:
+					try:
+						conn = listener.accept()
+					except KeyboardInterrupt:
+						return
+					except (OSError, EOFError, AuthenticationError) as e:
+						print(f"[Warning] Rejected model server client: {e}")
+						continue
+					threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+		finally:
+			if unix and os.path.exists(_keyfile(address)):
+				os.unlink(_keyfile(address))
+
+	def _serve(self, conn):
+		with conn:
+			while True:
+				try:
+					command, args = conn.recv()
+				except (EOFError, OSError):
+					return
+				try:
+					if command == "info":
+						result = self.info()
+					elif command in self.batchers:
+						result = self.batchers[command].submit(args)
+					else:
+						raise ValueError(f"Unknown command {command}")
+					conn.send(("ok", result))
+				except Exception as e:
+					conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class ModelClient:
+	"""Connection to a ModelServer. Can be shared between threads, the calls
+	are serialized."""
+
+	def __init__(self, address : str = None, authkey : bytes = None):
+		"""This is the constructor. Connects to the server.
+
+		Parameters
+		-----------
+		address : str
+			Unix socket path or "host:port", see _resolve.
+		authkey : bytes
+			Shared secret of server and clients, see _resolve.
+		"""
+		address, authkey = _resolve(address, authkey)
+		if isinstance(address, str):
+			# Connect only to a server of this user, it sends pickles.
+			_check_private(address, stat.S_IFSOCK)
+			if authkey is None:
+				authkey = _read_authkey(address)
+		self.conn = Client(address, authkey=authkey)
+		self._lock = threading.Lock()
+
+	def call(self, command : str, args = None):
+		"""
+		Send a request and return the answer. Raises RuntimeError if the
+		server failed.
+
+		Parameters
+		-----------
+		command : str
+			"info", "metadata" or "keywords".
+		args
+			The documents or prompts.
+		"""
+		with self._lock:
+			self.conn.send((command, args))
+			status, result = self.conn.recv()
+		if status != "ok":
+			raise RuntimeError(f"Model server: {result}")
+		return result
+
+	def close(self):
+		"""Close the connection."""
+		self.conn.close()
+
+
+class RemoteAnalyzer:
+	"""Stands in for a metadata analyzer in DatabaseInterface.preview_all,
+	running analyze_batch on the model server."""
+
+	def __init__(self, client : ModelClient, name : str):
+		self.client = client
+		self.name = name
+
+	def get_extraction_name(self):
+		"""Get the name of the method to extract metadata."""
+		return self.name
+
+	def analyze_batch(self, documents : list) -> list:
+		"""See BaseDocumentAnalyzer.analyze_batch.
+
+		Parameters
+		-----------
+		documents : list of dict
+			Results of render_frontpage.
+		"""
+		return self.client.call("metadata", documents)
+
+
+class RemoteKeywords:
+	"""Stands in for a keywords model, running it on the model server."""
+
+	def __init__(self, client : ModelClient, name : str):
+		self.client = client
+		self.name = name
+
+	def get_extraction_name(self):
+		"""Get the name of the method to extract keywords."""
+		return self.name
+
+	def get_keywords(self, title : str):
+		"""Get the keywords."""
+		return self.get_keywords_batch([title])[0]
+
+	def get_keywords_batch(self, titles : Collection[str]) -> list:
+		"""See BaseKeywordInference.get_keywords_batch.
+
+		Parameters
+		-----------
+		titles : collection of str
+			The inputs.
+		"""
+		return self.client.call("keywords", list(titles))
+
+
+def remote_model(kind : str, method : int, kwargs : dict) -> Union[None, RemoteAnalyzer, RemoteKeywords]:
+	"""
+	Get the model of the model server, if USE_MODEL_SERVER is set in the config,
+	a server is running and it serves this method. Else None, the caller loads
+	the model itself. kwargs that differ from the settings of the server are
+	reported, the server keeps its settings.
+
+	Parameters
+	-----------
+	kind : str
+		"metadata" or "keywords".
+	method : int
+		The method, see methodconstants.
+	kwargs : dict
+		The arguments the caller would load the model with.
+	"""
+	if not config["USE_MODEL_SERVER"]:
+		return None
+	try:
+		client = ModelClient()
+		served = client.call("info").get(kind)
+	except PermissionError as e:
+		print(f"[Warning] Not using the model server: {e}")
+		return None
+	except (OSError, EOFError, ValueError, RuntimeError, AuthenticationError) as e:
+		if config["DEBUG"]:
+			print(f"[Info] No model server available ({e}), loading the model.")
+		return None
+	if served is None or served["method"] != method:
+		client.close()
+		return None
+	differing = {k : v for k, v in kwargs.items() if served["kwargs"].get(k) != v}
+	if differing:
+		print(f"[Warning] The model server ignores {differing}, it uses {served['kwargs']}.")
+	print(f"[Info] Using {served['name']} of the model server.")
+	if kind == "metadata":
+		return RemoteAnalyzer(client, served["name"])
+	return RemoteKeywords(client, served["name"])
+
+
+def main():
+	"""Start a model server from the command line."""
+	parser = argparse.ArgumentParser(description="Keeps the AI models of SmartFileLibrary loaded.")
+	parser.add_argument("--metadata", type=int, default=None, choices=list(ModelServer.METADATA_METHODS),
+		help="metadata method to serve, see methodconstants")
+	parser.add_argument("--keywords", type=int, default=None, choices=list(ModelServer.KEYWORDS_METHODS),
+		help="keywords method to serve, see methodconstants")
+	parser.add_argument("--address", default=None, help="Unix socket path or host:port")
+	parser.add_argument("--precision", default=None, help="fp32, bf16 or int8")
+	parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+	parser.add_argument("--interop-threads", type=int, default=None, help="torch inter-op threads")
+	parser.add_argument("--batchsize", type=int, default=None, help="documents per analyzer call")
+	parser.add_argument("--maxwait", type=float, default=0.05,
+		help="seconds to wait for other clients before running a batch")
+	args = parser.parse_args()
+	if args.metadata is None and args.keywords is None:
+		parser.error("Nothing to serve, give --metadata and/or --keywords.")
+
+	from .inferencemode import set_threads
+	set_threads(config["TORCH_THREADS"] if args.threads is None else args.threads,
+		config["TORCH_INTEROP_THREADS"] if args.interop_threads is None else args.interop_threads)
+	model_kwargs = {} if args.precision is None else {"precision" : args.precision}
+	server = ModelServer(args.metadata, args.keywords, model_kwargs, args.batchsize, args.maxwait)
+	server.serve_forever(args.address)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,99 @@
+"""Opt-in capture of per-document artifacts, like the rendered front page, for debugging."""
+import os
+import re
+import json
+import time
+import zlib
+import threading
+
+from .config import config
+
+
+class Tracer:
+	"""Writes artifacts of a sample of the analyzed documents into a directory per run,
+	one subdirectory per document. Whether a document is sampled only depends on its path,
+	so all artifacts of a document are kept or dropped together. A disabled tracer does
+	no work at all."""
+
+	def __init__(self, directory : os.PathLike = None, sample_rate : float = 1.0):
+		"""This is the constructor.
+
+		Parameters
+		-----------
+		directory : os.PathLike
+			Where the run directories are created. None disables tracing.
+		sample_rate : float
+			Fraction of the documents to capture, between 0 and 1.
+		"""
+		self.enabled = directory is not None and sample_rate > 0
+		self.directory = directory
+		self.sample_rate = sample_rate
+		self.rundir = None
+		self._lock = threading.Lock()
+
+	def sampled(self, path : os.PathLike) -> bool:
+		"""
+		Whether artifacts of this document are captured.
+
+		Parameters
+		-----------
+		path : os.PathLike
+			The path of the document.
+		"""
+		if not self.enabled:
+			return False
+		return zlib.crc32(os.fsencode(path)) % 10000 < self.sample_rate * 10000
+
+	def capture_image(self, path : os.PathLike, name : str, image):
+		"""
+		Save an image of the document as PNG, if sampled.
+
+		Parameters
+		-----------
+		path : os.PathLike
+			The path of the document.
+		name : str
+			Name of the artifact.
+		image : PIL.Image
+			The image.
+		"""
+		if self.sampled(path):
+			image.save(os.path.join(self._docdir(path), f"{name}.png"))
+
+	def capture_data(self, path : os.PathLike, name : str, data):
+		"""
+		Save JSON serializable data about the document, if sampled.
+
+		Parameters
+		-----------
+		path : os.PathLike
+			The path of the document.
+		name : str
+			Name of the artifact.
+		data : JSON serializable
+			The data.
+		"""
+		if self.sampled(path):
+			with open(os.path.join(self._docdir(path), f"{name}.json"), "w") as f:
+				json.dump(data, f, default=str, indent=1)
+
+	def _docdir(self, path : os.PathLike) -> str:
+		with self._lock:
+			if self.rundir is None:
+				self.rundir = os.path.join(self.directory,
+					time.strftime("run-%Y%m%d-%H%M%S") + f"-{os.getpid()}")
+		stem = re.sub(r"[^\w.-]", "_", os.path.basename(path))
+		docdir = os.path.join(self.rundir, f"{stem}-{zlib.crc32(os.fsencode(path)):08x}")
+		os.makedirs(docdir, exist_ok=True)
+		return docdir
+
+
+_tracer = None
+
+def get_tracer() -> Tracer:
+	"""Get the tracer of this process, configured from TRACE_DIR and
+	TRACE_SAMPLE_RATE in the config on first use."""
+	global _tracer
+	if _tracer is None:
+		_tracer = Tracer(config["TRACE_DIR"], config["TRACE_SAMPLE_RATE"])
+	return _tracer
@@ -6,64 +6,212 @@ import pickle
 import time
 from typing import Union, Callable, Collection, Tuple
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 from tqdm import tqdm
 
-from .analyzers.donut_base_finetuned import BaseDocumentAnalyzer
+from .config import config
+from .manifest import hash_files
+from .analyzers.basedocumentanalyzer import BaseDocumentAnalyzer, check_pdf, render_frontpage, \
+	render_cached, RENDER_ZOOM
+from .analyzers.rendercache import default_render_cache, render_key
 
 SEARCHMETHOD = "ISBN"
 DIGIT_AT_END = r"(.*) [0-9]+$"
 
 def get_books(directory : str, metadata_extractor : BaseDocumentAnalyzer,
-	chat : Callable[str, str]) -> Collection[Tuple[str, str, list, Union[dict, None]]]:
+	chat : Callable[str, str], render_workers : int = None, queue_depth : int = None,
+	batchsize : int = None, keyword_workers : int = None,
+	keyword_delay : float = None,
+	files : Collection[str] = None, hashes : dict = None,
+	chat_batch : Callable[Collection[str], list] = None) -> Collection[Tuple[str, str, list, Union[dict, None]]]:
 	"""
 	Get the books from the given directory. Will try to retreive the title,
 	path, keywords and metadata for each file.
 
+	The work is pipelined: A process pool renders the front pages and reads the
+	PDF metadata, the analyzer handles the rendered documents in batches and
+	the keyword model runs in its own thread(s) on the resulting titles.
+	Parameters left None are taken from the config.
+
 	Parameters
 	-----------
 	directory : str
 		The directory from which to get the files from.
-	metalib : list
-		The metadata db from crossref.
+	metadata_extractor : BaseDocumentAnalyzer
+		The loaded metadata extractor.
 	chat : Callable str -> str
 		The model functionality, input in, answer out.
+	render_workers : int
+		Number of rendering processes. 0 renders in this process.
+	queue_depth : int
+		Maximum number of rendered documents waiting for the analyzer.
+	batchsize : int
+		Number of documents passed to the analyzer at once.
+	keyword_workers : int
+		Number of threads calling chat.
+	keyword_delay : float
+		Pause in seconds after each call to chat or chat_batch.
+	files : collection of str
+		Only analyze these filenames within directory. Default is all files.
+	hashes : dict
+		Content hashes of the files by filename, if already known. Rendered
+		front pages are cached by content hash.
+	chat_batch : Callable list of str -> list of str
+		Batched version of chat, used instead if given. Gets the prompts of a
+		whole analyzer batch at once.
 	"""
-	what = os.listdir(directory)
-	bookannotated = []
-
-	for bookfilename in tqdm(what, desc="Analyzing books"):
-		metadata_extractor.analyze(os.path.join(directory, bookfilename))
-		
-		title = metadata_extractor.get_title()
-		numpages = metadata_extractor.get_pagecount()
-		publisher = metadata_extractor.get_publisher()
-		year = metadata_extractor.get_publishing_year()
-
-		answer = chat(f"Please give keywords what sciences this book is about: '{title}'")
-		time.sleep(1)
-		answer = chat(f"Please extract the keywords mentioned in this book description and list these comma seperated: {answer}")
-		time.sleep(1)
-		answer = answer.replace(".", ",")
-		answer = answer.split(",")
-		if answer[-1] == "":
-			del answer[-1]
-		if len(answer) == 1:
-			answer = answer[0].split(" - ")
-		elif len(answer) == 0:
-			answer = ["no-keywords-available"]
-		for i in range(len(answer)):
-			answer[i] = answer[i].strip()
-
-		for i in range(len(answer) - 1, -1, -1):
-			if ":" in answer[i]:
-				del answer[i]
-		#print(f"{title} : {answer}")
-
-		bookannotated.append((title, bookfilename, answer, publisher, year, numpages))
+	render_workers = config["RENDER_WORKERS"] if render_workers is None else render_workers
+	queue_depth = config["RENDER_QUEUE_DEPTH"] if queue_depth is None else queue_depth
+	batchsize = config["ANALYZER_BATCHSIZE"] if batchsize is None else batchsize
+	keyword_workers = config["KEYWORD_WORKERS"] if keyword_workers is None else keyword_workers
+	keyword_delay = config["KEYWORD_DELAY"] if keyword_delay is None else keyword_delay
+
+	what = os.listdir(directory) if files is None else list(files)
+	paths = [os.path.join(directory, bookfilename) for bookfilename in what]
+	for path in paths:
+		check_pdf(path)
+	hashes = {} if hashes is None else hashes
+	missing = [i for i, bookfilename in enumerate(what) if bookfilename not in hashes]
+	content_hashes = [hashes.get(bookfilename) for bookfilename in what]
+	for i, content_hash in zip(missing, hash_files([paths[i] for i in missing], render_workers or None)):
+		content_hashes[i] = content_hash
+
+	batch_delay = keyword_delay
+	if chat_batch is None:
+		def chat_batch(prompts):
+			answers = []
+			for prompt in prompts:
+				answers.append(chat(prompt))
+				if keyword_delay:
+					time.sleep(keyword_delay)
+			return answers
+		batch_delay = 0
+
+	analyzed = []
+	with ThreadPoolExecutor(max_workers=max(keyword_workers, 1)) as keywordpool:
+		batch = []
+		def flush():
+			infos = metadata_extractor.analyze_batch(batch)
+			kws = keywordpool.submit(_get_keywords, [info["title"] for info in infos],
+				chat_batch, batch_delay)
+			for i, info in enumerate(infos):
+				analyzed.append((info, kws, i))
+			batch.clear()
+
+		for prepared in tqdm(_render_all(paths, content_hashes, render_workers, queue_depth),
+				total=len(paths), desc="Analyzing books"):
+			batch.append(prepared)
+			if len(batch) >= batchsize:
+				flush()
+		if batch:
+			flush()
+
+		bookannotated = []
+		for bookfilename, (info, kws, i) in zip(what, analyzed):
+			bookannotated.append((info["title"], bookfilename, kws.result()[i],
+				info["publisher"], info["year"], info["pagecount"]))
 
 	return bookannotated
 
 
+def _render_all(paths : Collection[str], hashes : Collection[str], workers : int, queue_depth : int):
+	"""
+	Yield render_frontpage for all paths, in order. Pages found in the render cache
+	are reused, the others are rendered ahead in a process pool, with at most
+	queue_depth documents waiting.
+
+	Parameters
+	-----------
+	paths : collection of str
+		The PDF files.
+	hashes : collection of str
+		The content hashes of the files.
+	workers : int
+		Number of processes, None for the number of CPUs. 0 renders in this process.
+	queue_depth : int
+		Maximum number of submitted but not yet consumed documents.
+	"""
+	cache = default_render_cache()
+	if workers == 0:
+		for path, content_hash in zip(paths, hashes):
+			yield render_cached(path, content_hash=content_hash, cache=cache)
+		return
+
+	def collect(entry):
+		path, key, prepared = entry
+		if not isinstance(prepared, dict):
+			prepared = prepared.result()
+			cache.put(key, prepared)
+		return dict(prepared, path=path)
+
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		pending = deque()
+		for path, content_hash in zip(paths, hashes):
+			key = render_key(content_hash, RENDER_ZOOM)
+			prepared = cache.get(key)
+			if prepared is None:
+				prepared = pool.submit(render_frontpage, path)
+			pending.append((path, key, prepared))
+			if len(pending) >= max(queue_depth, 1):
+				yield collect(pending.popleft())
+		while pending:
+			yield collect(pending.popleft())
+
+
+def _get_keywords(titles : Collection[str], chat_batch : Callable[Collection[str], list],
+		delay : float) -> list:
+	"""
+	Ask the keyword model for the keywords of several titles. Returns a list
+	of keywords per title.
+
+	Parameters
+	-----------
+	titles : collection of str
+		The titles of the documents.
+	chat_batch : Callable list of str -> list of str
+		The model functionality, prompts in, answers out.
+	delay : float
+		Pause in seconds after each call to chat_batch.
+	"""
+	answers = chat_batch([f"Please give keywords what sciences this book is about: '{title}'"
+		for title in titles])
+	if delay:
+		time.sleep(delay)
+	answers = chat_batch(["Please extract the keywords mentioned in this book description and "
+		f"list these comma seperated: {answer}" for answer in answers])
+	if delay:
+		time.sleep(delay)
+	return [_parse_keywords(answer) for answer in answers]
+
+
+def _parse_keywords(answer : str) -> list:
+	"""
+	Split the answer of the keyword model into keywords.
+
+	Parameters
+	-----------
+	answer : str
+		The answer of the keyword model.
+	"""
+	answer = answer.replace(".", ",")
+	answer = answer.split(",")
+	if answer[-1] == "":
+		del answer[-1]
+	if len(answer) == 1:
+		answer = answer[0].split(" - ")
+	elif len(answer) == 0:
+		answer = ["no-keywords-available"]
+	for i in range(len(answer)):
+		answer[i] = answer[i].strip()
+
+	for i in range(len(answer) - 1, -1, -1):
+		if ":" in answer[i]:
+			del answer[i]
+	return answer
+
+
 def _cleankeywords(kws : Collection[str]) -> Collection[str]:
 	"""
 	Cleans the keywords list a bit, removing some trivial answers.
@@ -88,8 +236,35 @@ def _cleankeywords(kws : Collection[str]) -> Collection[str]:
 			kws[i] = m.group(1)
 	return kws
 
+def to_record(book : Tuple, filesdir : str, hashes : dict = None, copies : dict = None) -> dict:
+	"""
+	The record of addbooks_bulk for a book from get_books, with cleaned keywords.
+
+	Parameters
+	-----------
+	book : tuple
+		One entry of the output from get_books.
+	filesdir : str
+		The directory for the files in question.
+	hashes : dict
+		Maps filenames to their content hash.
+	copies : dict
+		Maps filenames of books to filenames with identical contents. These
+		are added as further files of the book.
+	"""
+	hashes = {} if hashes is None else hashes
+	copies = {} if copies is None else copies
+	title, bookfilename, answer, publisher, year, numpages = book
+	files = []
+	for filename in [bookfilename] + copies.get(bookfilename, []):
+		fullpath = os.path.join(filesdir, filename)
+		files.append((fullpath, numpages, "", hashes.get(filename)))
+	return dict(title=title, year=year, publisher=publisher, form="book",
+		topics=list(set(_cleankeywords(answer))), files=files)
+
 def write_actions_to_db(books : Collection[Tuple[str, str, list, Union[dict, None]]],
-		 result_file : str, filesdir : str, dbinstance) -> None:
+		 result_file : str, filesdir : str, dbinstance, hashes : dict = None,
+		 copies : dict = None, existing : Collection[Tuple[str, int, int]] = ()) -> None:
 	"""
 	Write actions into Python file.
 
@@ -103,18 +278,32 @@ def write_actions_to_db(books : Collection[Tuple[str, str, list, Union[dict, Non
 		The publisher ID.
 	filesdir : str
 		The directory for the files in question.
+	hashes : dict
+		Maps filenames to their content hash.
+	copies : dict
+		Maps filenames of books to filenames with identical contents. These
+		are added as further files of the book.
+	existing : collection of (filename, book_id, num_pages)
+		Files with the same contents as an already registered file of book_id.
 	"""
+	hashes = {} if hashes is None else hashes
+	copies = {} if copies is None else copies
 	with open(result_file, "w") as f:
 		f.write(f"def add_books(db):\n")
-		for (title, bookfilename, answer, publisher, year, numpages) in books:
-			fullpath = os.path.join(filesdir, bookfilename)
-			answer = list(set(_cleankeywords(answer)))
-
-			f.write(f"\t# Set publisher as '{publisher}':\n")
-			f.write(f"\tpublisher_id = db.addpublisher('{publisher}')\n")
-			
-			insert = "\t# book_id = db.addbook(title (not filepath!), year, publisher_id, form, keywords)\n"
-			insert += f"""\tbook_id = db.addbook('{title}', {year}, publisher_id, 'book', """ + \
-			f"""{answer})\n\tdb.addfile(book_id, "{fullpath}", {numpages})\n\n"""
+		f.write(f"\trecords = []\n\n")
+		for book in books:
+			rec = to_record(book, filesdir, hashes, copies)
+			insert = f"\t# Set publisher as {rec['publisher']!r}:\n"
+			insert += f"\trecords.append(dict(title={rec['title']!r}, year={rec['year']!r}, " \
+				f"publisher={rec['publisher']!r},\n"
+			insert += f"\t\tform='book', topics={rec['topics']!r},\n"
+			insert += f"\t\tfiles={rec['files']!r}))\n\n"
 
 			f.write(insert)
+		for (filename, book_id, numpages) in existing:
+			fullpath = os.path.join(filesdir, filename)
+			f.write(f"\t# Same contents as a file of the registered book {book_id}:\n")
+			f.write(f"\tdb.addfile({book_id}, {fullpath!r}, {numpages!r}, "
+				f"content_hash={hashes.get(filename)!r})\n\n")
+		f.write(f"\t# Inserts all books in batches, returns the book ids.\n")
+		f.write(f"\treturn db.addbooks_bulk(records)\n")
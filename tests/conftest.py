@@ -0,0 +1,40 @@
+"""Fixtures of the tests. The tests using PostgreSQL connect to localhost with
+the database, user and password in SFL_TEST_DB, SFL_TEST_USER and
+SFL_TEST_PASSWORD and are skipped if these are not set. The database is
+cleared, so only point them at one meant for testing."""
+import os
+
+import pytest
+
+from smartfilelibrary import DatabaseInterface
+
+
+@pytest.fixture
+def credentials():
+	"""The database name, user and password of the test database."""
+	names = ("SFL_TEST_DB", "SFL_TEST_USER", "SFL_TEST_PASSWORD")
+	if not all(os.environ.get(n) for n in names):
+		pytest.skip("SFL_TEST_DB, SFL_TEST_USER and SFL_TEST_PASSWORD are not set.")
+	return tuple(os.environ[n] for n in names)
+
+
+@pytest.fixture
+def db(credentials, tmp_path, monkeypatch):
+	"""A cleared library with the standard setup. Runs in tmp_path, so the
+	log ends up there."""
+	monkeypatch.chdir(tmp_path)
+	db = DatabaseInterface(*credentials)
+	db.cleardb()
+	db.standardsetup()
+	db.commit_transaction()
+	yield db
+	db.finish(commit=False)
+
+
+@pytest.fixture
+def client(db, credentials):
+	"""Test client of the liveserver, on the test database."""
+	from smartfilelibrary import liveserver
+	liveserver.init_pool(*credentials, minconn=1, maxconn=4, timeout=5)
+	yield liveserver.app.test_client()
+	liveserver.pool.closeall()
@@ -0,0 +1,168 @@
+import os
+
+import pytest
+
+from smartfilelibrary.actionlog import ActionLog, MAGIC, read_frames, is_action_log
+
+
+def frames(path):
+	return [entries for offset, entries in read_frames(path)]
+
+
+@pytest.fixture
+def path(tmp_path):
+	return str(tmp_path / "log.sfl")
+
+
+def test_flush_writes_frames(path):
+	log = ActionLog(path, fsync="never")
+	assert is_action_log(path)
+	log.statement("INSERT INTO Topic (topic_name) VALUES ('SQL');")
+	log.statement("UPDATE Book SET favorite = %s WHERE book_id = %s;", (True, 3))
+	assert frames(path) == []
+	log.flush()
+	log.values("INSERT INTO Publisher (name) VALUES %s", [("springer",), ("o'reilly",)])
+	log.close()
+	assert frames(path) == [
+		[["s", "INSERT INTO Topic (topic_name) VALUES ('SQL');"],
+			["s", "UPDATE Book SET favorite = %s WHERE book_id = %s;", [True, 3]]],
+		[["v", "INSERT INTO Publisher (name) VALUES %s", [["springer"], ["o'reilly"]]]]]
+
+
+def test_statement_query(path):
+	log = ActionLog(path)
+	log.statement("INSERT INTO Book (year) VALUES (%s);", ((2020, 1),), b"INSERT INTO Book (year) VALUES ((2020, 1));")
+	with pytest.raises(ValueError):
+		log.statement("INSERT INTO Book (year) VALUES (%s);", ((2020, 1),))
+	log.close()
+	assert frames(path) == [[["s", "INSERT INTO Book (year) VALUES ((2020, 1));"]]]
+
+
+def test_batch(path):
+	log = ActionLog(path)
+	with log.batch():
+		log.statement("A")
+		with log.batch():
+			log.statement("B")
+	with pytest.raises(KeyError):
+		with log.batch():
+			log.statement("C")
+			raise KeyError
+	log.statement("D")
+	log.flush()
+	assert frames(path) == [[["s", "A"], ["s", "B"], ["s", "D"]]]
+
+
+def test_discard(path):
+	log = ActionLog(path)
+	log.statement("A")
+	log.flush()
+	log.statement("rolled back")
+	log.discard()
+	with log.batch():
+		log.statement("rolled back in batch")
+		log.discard()
+	log.statement("B")
+	log.close()
+	assert frames(path) == [[["s", "A"]], [["s", "B"]]]
+
+
+class Connection:
+	"""Stands in for a psycopg2 connection whose commit may fail."""
+
+	def __init__(self, fail):
+		self.fail = fail
+
+	def commit(self):
+		if self.fail:
+			raise RuntimeError("could not serialize access")
+
+
+def test_commit(path):
+	log = ActionLog(path)
+	log.statement("A")
+	log.commit(Connection(False))
+	log.statement("not committed")
+	with pytest.raises(RuntimeError):
+		with log.batch():
+			log.statement("not committed in batch")
+			log.commit(Connection(True))
+	with log.batch():
+		log.statement("B")
+		log.commit(Connection(False))
+	log.close()
+	assert frames(path) == [[["s", "A"]], [["s", "B"]]]
+
+
+def test_spill(path):
+	log = ActionLog(path, buffersize=100)
+	for i in range(50):
+		log.statement(f"INSERT INTO Topic (topic_name) VALUES ('Topic {i}');")
+	# Not committed, so nothing reaches the log yet.
+	assert os.path.getsize(path) == len(MAGIC)
+	log.flush()
+	entries = [e for frame in frames(path) for e in frame]
+	assert entries == [["s", f"INSERT INTO Topic (topic_name) VALUES ('Topic {i}');"] for i in range(50)]
+	assert len(frames(path)) > 1
+
+	size = os.path.getsize(path)
+	for i in range(50):
+		log.statement(f"DELETE FROM Topic WHERE topic_name = 'Topic {i}';")
+	log.discard()
+	log.close()
+	assert os.path.getsize(path) == size
+
+
+def test_damaged_end(path, capsys):
+	log = ActionLog(path)
+	for name in ("A", "B"):
+		log.statement(name)
+		log.flush()
+	log.close()
+	size = os.path.getsize(path)
+
+	with open(path, "r+b") as f:
+		f.truncate(size - 3)
+	assert frames(path) == [[["s", "A"]]]
+	assert "Damaged frame" in capsys.readouterr().out
+
+	with open(path, "r+b") as f:
+		f.truncate(size - 3 - 12)
+	assert frames(path) == [[["s", "A"]]]
+
+
+def test_corrupt_frame(path):
+	log = ActionLog(path)
+	for name in ("A", "B"):
+		log.statement(name)
+		log.flush()
+	log.close()
+	with open(path, "r+b") as f:
+		f.seek(-1, os.SEEK_END)
+		last = f.read(1)
+		f.seek(-1, os.SEEK_END)
+		f.write(bytes([last[0] ^ 0xff]))
+	assert frames(path) == [[["s", "A"]]]
+
+
+def test_shared_file(path):
+	first = ActionLog(path)
+	second = ActionLog(path)
+	first.statement("A")
+	second.statement("B")
+	second.flush()
+	first.flush()
+	assert frames(path) == [[["s", "B"]], [["s", "A"]]]
+	# clear replaces the file, the other log follows.
+	first.clear()
+	second.statement("C")
+	second.close()
+	first.close()
+	assert frames(path) == [[["s", "C"]]]
+
+
+def test_not_an_action_log(path):
+	with open(path, "w") as f:
+		f.write("INSERT INTO Topic (topic_name) VALUES ('SQL');\n")
+	with pytest.raises(ValueError):
+		ActionLog(path)
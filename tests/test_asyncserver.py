@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+pytest.importorskip("starlette")
+pytest.importorskip("asyncpg")
+pytest.importorskip("httpx")
+from starlette.testclient import TestClient
+
+from smartfilelibrary.asyncserver import create_app
+from smartfilelibrary.actionlog import read_frames
+
+
+@pytest.fixture
+def aclient(db, credentials):
+	pub = db.addpublisher("Springer")
+	db.addbook("Deep Learning", 2016, pub, "book", ("Deep Learning", "LLMs"))
+	db.addbook("Naval Charts", 1999, pub, "research article", ("Naval",))
+	db.addbook("Learning SQL", 2020, pub, "book", ("SQL", "Deep Learning"))
+	db.commit_transaction()
+	with TestClient(create_app(*credentials, minconn=1, maxconn=2)) as aclient:
+		yield aclient
+
+
+def sorted_keywords(entries):
+	"""The order of the keywords is not defined."""
+	if isinstance(entries, list):
+		for e in entries:
+			e["keywords"].sort()
+	return entries
+
+
+def test_same_answers(aclient, client):
+	for url in ("/query?kw=*&form=all", "/query?kw=deep learning&form=all",
+			"/query?kw=*&form=all&limit=2", "/query?kw=*&form=all&limit=2&cursor=2",
+			"/query?kw=unknown&form=all", "/dbmeta?key=user"):
+		ares = aclient.get(url)
+		res = client.get(url)
+		assert sorted_keywords(ares.json()) == sorted_keywords(res.get_json())
+		assert ares.headers.get("X-Next-Cursor") == res.headers.get("X-Next-Cursor")
+		assert ares.headers["Access-Control-Allow-Origin"] == "*"
+	assert aclient.get("/dbmeta?key=other").status_code == 400
+	assert client.get("/dbmeta?key=other").status_code == 400
+
+
+def test_stream(aclient):
+	listed = aclient.get("/query?kw=*&form=all").json()
+	res = aclient.get("/query?kw=*&form=all&stream=1")
+	streamed = [json.loads(line) for line in res.text.splitlines()]
+	assert sorted_keywords(streamed) == sorted_keywords(listed)
+
+
+def test_set_fav(aclient, db):
+	assert aclient.get("/set_fav?id=3&val=1").status_code == 200
+	db.cur.execute("SELECT book_id FROM Book WHERE favorite;")
+	assert db.cur.fetchall() == [(3,)]
+	updates = [e for offset, entries in read_frames("locallog.sfl") for e in entries
+		if e[1].startswith("UPDATE Book")]
+	assert [e[2] for e in updates] == [[True, 3]]
+	assert aclient.get("/set_fav?val=1").status_code == 400
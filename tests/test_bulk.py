@@ -0,0 +1,120 @@
+import time
+
+import psycopg2
+
+from smartfilelibrary import DatabaseInterface
+from smartfilelibrary.actionlog import read_frames
+
+
+def test_addbooks_bulk(db):
+	pub = db.addpublisher("Springer")
+	ids = db.addbooks_bulk([
+		{"title": "Deep Learning", "year": 2016, "publisher": "SPRINGER", "form": "book",
+			"topics": ("Deep Learning", "Transformers", "Transformers"),
+			"files": [("a.pdf", 10), ("b.pdf", 20, "Chapter 2")]},
+		{"title": "Untitled Notes", "year": None, "publisher": None, "form": "notes",
+			"topics": "Knots"},
+		{"title": "Sailing", "year": 2001, "publisher": "Sea Press", "form": "book",
+			"topics": ()},
+		], batchsize=2)
+	db.commit_transaction()
+	assert len(ids) == 3 and ids == sorted(ids)
+
+	db.cur.execute("SELECT book_id, title, pub_id FROM Book ORDER BY book_id;")
+	books = db.cur.fetchall()
+	assert [b[0] for b in books] == ids
+	assert books[0][2] == pub
+	assert books[1][2] is None
+	assert books[2][2] == db.publishers_added["sea press"]
+
+	db.cur.execute("SELECT book_id, topic_name FROM book_topic ORDER BY book_id, topic_name;")
+	assert db.cur.fetchall() == [(ids[0], "Deep Learning"), (ids[0], "Transformers"),
+		(ids[1], "Knots")]
+	db.cur.execute("SELECT book_id, filepath, num_pages, subname FROM File ORDER BY filepath;")
+	assert db.cur.fetchall() == [(ids[0], "a.pdf", 10, ""), (ids[0], "b.pdf", 20, "Chapter 2")]
+	db.cur.execute("SELECT topic_name FROM Topic WHERE topic_name IN ('Transformers', 'Knots') "
+		"ORDER BY topic_name;")
+	assert db.cur.fetchall() == [("Knots",), ("Transformers",)]
+
+
+def test_addbooks_bulk_without_publisher_in_query(db, client):
+	db.addbooks_bulk([{"title": "Anonymous", "year": None, "publisher": None,
+		"form": "notes", "topics": ("Naval",)}])
+	db.commit_transaction()
+	entries = client.get("/query?kw=naval&form=all").get_json()
+	assert [(e["title"], e["author"]) for e in entries] == [("Anonymous", "")]
+	entries = client.get("/query?q=anonymous&form=all").get_json()
+	assert [(e["title"], e["author"]) for e in entries] == [("Anonymous", "")]
+
+
+def test_quotes(db):
+	pub = db.addpublisher("O'Reilly")
+	book = db.addbook("Don't Panic", 1979, pub, "book", ("Hitchhiker's Guides",))
+	db.addfile(book, "files/don't panic.pdf", 10)
+	db.commit_transaction()
+	db.cur.execute("SELECT title, name, topic_name, filepath FROM Book JOIN Publisher USING(pub_id) "
+		"JOIN book_topic USING(book_id) JOIN File USING(book_id);")
+	assert db.cur.fetchall() == [("Don't Panic", "o'reilly", "Hitchhiker's Guides",
+		"files/don't panic.pdf")]
+
+
+def test_mixed_case_topics(db, credentials):
+	ids = db.addbooks_bulk([
+		{"title": "A", "year": None, "publisher": "Springer", "form": "book",
+			"topics": ("machine learning", "SQL", "sql")},
+		{"title": "B", "year": None, "publisher": "SPRINGER", "form": "book",
+			"topics": ("New Topic",)},
+		{"title": "C", "year": None, "publisher": "springer", "form": "book",
+			"topics": ("NEW TOPIC", "new topic")},
+		])
+	db.addbook("D", None, db.addpublisher("Springer"), "book", ("new TOPIC", "naval"))
+	db.commit_transaction()
+	db.cur.execute("SELECT title, topic_name FROM Book JOIN book_topic USING(book_id) "
+		"ORDER BY title, topic_name;")
+	assert db.cur.fetchall() == [("A", "Machine Learning"), ("A", "SQL"), ("B", "New Topic"),
+		("C", "New Topic"), ("D", "Naval"), ("D", "New Topic")]
+	db.cur.execute("SELECT topic_name FROM Topic WHERE lower(topic_name) = 'new topic';")
+	assert db.cur.fetchall() == [("New Topic",)]
+	db.cur.execute("SELECT DISTINCT pub_id FROM Book;")
+	assert len(db.cur.fetchall()) == 1
+
+	# A new connection loads the registered spelling from the database.
+	other = DatabaseInterface(*credentials)
+	other.addbook("E", None, None, "notes", ("NAVAL",))
+	other.finish()
+	db.cur.execute("SELECT topic_name FROM Book JOIN book_topic USING(book_id) "
+		"WHERE title = 'E';")
+	assert db.cur.fetchall() == [("Naval",)]
+
+
+def test_addbooks_committed_retries(db, monkeypatch):
+	bulk = db.addbooks_bulk
+	calls = []
+
+	def aborted_once(records, addunknowntopics=True):
+		book_ids = bulk(records, addunknowntopics)
+		calls.append(book_ids)
+		if len(calls) == 1:
+			raise psycopg2.errors.SerializationFailure("could not serialize access")
+		return book_ids
+
+	monkeypatch.setattr(db, "addbooks_bulk", aborted_once)
+	monkeypatch.setattr(time, "sleep", lambda seconds: None)
+	book_ids = db.addbooks_committed([{"title": "Retried", "year": 2020, "publisher": "Retry Press",
+		"form": "book", "topics": ("Retry Topic",)}])
+	assert len(calls) == 2 and book_ids == calls[1]
+	db.cur.execute("SELECT book_id, name, topic_name FROM Book JOIN Publisher USING(pub_id) "
+		"JOIN book_topic USING(book_id) WHERE title = 'Retried';")
+	assert db.cur.fetchall() == [(book_ids[0], "retry press", "Retry Topic")]
+	# Only the committed attempt is logged.
+	text = repr(list(read_frames(db.logfile)))
+	assert text.count("'Retried'") == 1 and text.count("'retry press'") == 1
+
+
+def test_new_names_sorted_case_insensitively(db):
+	db.addbooks_bulk([{"title": "Sorted", "year": None, "publisher": None, "form": "book",
+		"topics": ("beta", "Gamma", "Alpha")}])
+	db.commit_transaction()
+	entries = [e for offset, entries in read_frames(db.logfile) for e in entries
+		if e[0] == "v" and "INTO Topic" in e[1]]
+	assert entries[-1][2] == [["Alpha"], ["beta"], ["Gamma"]]
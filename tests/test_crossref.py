@@ -0,0 +1,87 @@
+import os
+import json
+
+import pytest
+
+from smartfilelibrary import crossref_db
+from smartfilelibrary.crossref_db import getDB, fixture_fetch, harvest_key
+from smartfilelibrary.metadatastore import CrossrefStore
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "crossref_springer_books.jsonl")
+TITLES = ["Automated Machine Learning", "Deep Learning for Sensor Data",
+	"Air Traffic Management", "Naval Traffic Systems"]
+
+
+@pytest.fixture(autouse=True)
+def small_pages(monkeypatch):
+	"""The fixture holds pages of two entries."""
+	monkeypatch.setattr(crossref_db, "ROWS_PER_REQUEST", 2)
+
+
+def counting_fetch(cursors, fail_at=None):
+	"""fixture_fetch, additionally collecting the requested cursors. Raises
+	ConnectionError on the cursor fail_at, like a lost connection."""
+	replay = fixture_fetch(FIXTURE)
+	def fetch(url, path, params={}):
+		cursors.append(params["cursor"])
+		if params["cursor"] == fail_at:
+			raise ConnectionError("connection lost")
+		return replay(url, path, params=params)
+	return fetch
+
+
+def titles(store):
+	rows = store.conn.execute("SELECT data FROM record ORDER BY record_id").fetchall()
+	return [json.loads(r[0])["title"][0] for r in rows]
+
+
+def test_getdb_list():
+	books = getDB("Springer", "book", 100, fetch=fixture_fetch(FIXTURE))
+	# The entry linking only HTML is dropped, without a store the duplicate stays.
+	assert [b["title"][0] for b in books] == TITLES[:2] + TITLES[:1] + TITLES[2:]
+
+
+def test_getdb_store(tmp_path):
+	store = CrossrefStore(str(tmp_path / "crossref.sqlite"))
+	cursors = []
+	assert getDB("Springer", "book", 100, store, counting_fetch(cursors)) is store
+	assert cursors == ["*", "AoJ1", "AoJ2", "AoJ3"]
+	assert titles(store) == TITLES
+	assert store.get_checkpoint(harvest_key("Springer", "book")) == ("AoJ3", 6, True)
+	assert store.lookup_isbn("9783030053178")["title"] == ["Automated Machine Learning"]
+	assert store.lookup_isbn("3 540 28247 x")["title"] == ["Air Traffic Management"]
+	assert store.lookup_doi("https://doi.org/10.1007/978-3-031-19568-6")["title"] == ["Naval Traffic Systems"]
+	assert store.lookup_isbn("978-3-662-44873-1") is None
+
+	# A complete harvest is not fetched again.
+	cursors.clear()
+	getDB("Springer", "book", 100, store, counting_fetch(cursors))
+	assert cursors == []
+
+
+def test_getdb_resume(tmp_path):
+	path = str(tmp_path / "crossref.sqlite")
+	store = CrossrefStore(path)
+	cursors = []
+	with pytest.raises(ConnectionError):
+		getDB("Springer", "book", 100, store, counting_fetch(cursors, fail_at="AoJ2"))
+	assert store.get_checkpoint(harvest_key("Springer", "book")) == ("AoJ2", 4, False)
+	assert titles(store) == TITLES[:2]
+	store.close()
+
+	store = CrossrefStore(path)
+	cursors.clear()
+	getDB("Springer", "book", 100, store, counting_fetch(cursors))
+	assert cursors == ["AoJ2", "AoJ3"]
+	assert titles(store) == TITLES
+	assert store.get_checkpoint(harvest_key("Springer", "book")) == ("AoJ3", 6, True)
+
+
+def test_getdb_expired_cursor(tmp_path):
+	store = CrossrefStore(str(tmp_path / "crossref.sqlite"))
+	store.add([], checkpoint=(harvest_key("Springer", "book"), "expired", 4, False))
+	cursors = []
+	getDB("Springer", "book", 100, store, counting_fetch(cursors))
+	# The fixture does not know the cursor, the harvest starts over.
+	assert cursors == ["expired", "*", "AoJ1", "AoJ2", "AoJ3"]
+	assert titles(store) == TITLES
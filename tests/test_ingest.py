@@ -0,0 +1,11 @@
+import pytest
+
+from smartfilelibrary import ingest
+
+
+def test_main_rejects_method_1(monkeypatch, capsys):
+	monkeypatch.setattr("sys.argv", ["ingest.py", "library", "user", "files", "1"])
+	monkeypatch.setattr(ingest, "getpass", lambda prompt: pytest.fail("asked for the password"))
+	with pytest.raises(SystemExit):
+		ingest.main()
+	assert "metadata_method 1 needs the options" in capsys.readouterr().out
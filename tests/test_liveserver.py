@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from smartfilelibrary.actionlog import read_frames
+
+
+@pytest.fixture(autouse=True)
+def books(db):
+	pub = db.addpublisher("Springer")
+	db.addbook("Deep Learning", 2016, pub, "book", ("Deep Learning", "LLMs"))
+	db.addbook("Naval Charts", 1999, pub, "research article", ("Naval",))
+	db.addbook("Learning SQL", 2020, pub, "book", ("SQL", "Deep Learning"))
+	db.addbook("Untagged", None, pub, "notes", ())
+	db.commit_transaction()
+
+
+def test_query_all(client):
+	res = client.get("/query?kw=*&form=all")
+	assert res.status_code == 200
+	entries = res.get_json()
+	assert [e["title"] for e in entries] == ["Deep Learning", "Naval Charts",
+		"Learning SQL", "Untagged"]
+	assert entries[0]["author"] == "Published By Springer"
+	assert sorted(entries[0]["keywords"]) == ["Deep Learning", "LLMs"]
+	assert entries[3]["keywords"] == []
+	assert "X-Next-Cursor" not in res.headers
+
+
+def test_query_filters(client):
+	entries = client.get("/query?kw=deep learning&form=all").get_json()
+	assert [e["title"] for e in entries] == ["Deep Learning", "Learning SQL"]
+	entries = client.get("/query?kw=*&form=research article").get_json()
+	assert [e["title"] for e in entries] == ["Naval Charts"]
+	entries = client.get("/query?kw=unknown&form=all").get_json()
+	assert entries[0]["title"] == "Could not find any matches."
+
+
+def test_query_pagination(client):
+	titles = []
+	url = "/query?kw=*&form=all&limit=3"
+	res = client.get(url)
+	titles += [e["title"] for e in res.get_json()]
+	cursor = res.headers["X-Next-Cursor"]
+	assert cursor == str(res.get_json()[-1]["id"])
+	res = client.get(url + "&cursor=" + cursor)
+	titles += [e["title"] for e in res.get_json()]
+	assert "X-Next-Cursor" not in res.headers
+	assert titles == ["Deep Learning", "Naval Charts", "Learning SQL", "Untagged"]
+	# Past the last page there is no placeholder entry.
+	res = client.get("/query?kw=*&form=all&limit=3&cursor=1000")
+	assert res.get_json() == []
+
+
+def test_query_bad_arguments(client):
+	assert client.get("/query?kw=*&form=all&limit=-1").status_code == 400
+	assert client.get("/query?kw=*&form=all&cursor=abc").status_code == 400
+
+
+def test_query_stream(client):
+	listed = client.get("/query?kw=*&form=all").get_json()
+	res = client.get("/query?kw=*&form=all&stream=1")
+	assert res.mimetype == "application/x-ndjson"
+	streamed = [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+	# The order of the keywords is not defined.
+	for e in listed + streamed:
+		e["keywords"].sort()
+	assert streamed == listed
+
+
+def test_set_fav(client, db):
+	assert client.get("/set_fav?id=2&val=1").status_code == 200
+	db.cur.execute("SELECT book_id FROM Book WHERE favorite;")
+	assert db.cur.fetchall() == [(2,)]
+	updates = [e for offset, entries in read_frames("locallog.sfl") for e in entries
+		if e[1].startswith("UPDATE Book")]
+	assert [e[2] for e in updates] == [[True, 2]]
+	assert client.get("/set_fav?id=x&val=1").status_code == 400
+
+
+def titles(res):
+	return [e["title"] for e in res.get_json()]
+
+
+def test_query_ranked(client):
+	# A match in the title ranks above a match in the topics only.
+	assert titles(client.get("/query?q=deep&form=all")) == ["Deep Learning", "Learning SQL"]
+	assert titles(client.get("/query?q=learn&form=all&kw=SQL")) == ["Learning SQL"]
+	assert titles(client.get("/query?q=learn&form=book&kw=*")) == ["Deep Learning", "Learning SQL"]
+	# Trigrams catch typos.
+	assert titles(client.get("/query?q=navl&form=all")) == ["Naval Charts"]
+	assert titles(client.get("/query?q=zebra&form=all")) == ["Could not find any matches."]
+
+
+def test_query_ranked_pages(client):
+	res = client.get("/query?q=deep&form=all&limit=1")
+	assert titles(res) == ["Deep Learning"]
+	assert res.headers["X-Next-Cursor"] == "1"
+	res = client.get("/query?q=deep&form=all&limit=1&cursor=1")
+	assert titles(res) == ["Learning SQL"]
+	res = client.get("/query?q=deep&form=all&limit=1&cursor=2")
+	assert titles(res) == []
+	streamed = client.get("/query?q=deep&form=all&stream=1").get_data(as_text=True)
+	assert [json.loads(line)["title"] for line in streamed.splitlines()] == [
+		"Deep Learning", "Learning SQL"]
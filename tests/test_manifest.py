@@ -0,0 +1,59 @@
+import os
+
+from smartfilelibrary import databaseinterface
+from smartfilelibrary.manifest import FileManifest
+
+
+def _touch(path, ns):
+	os.utime(path, ns=(ns, ns))
+
+
+def test_manifest_reuse(tmp_path):
+	pdf = tmp_path / "a.pdf"
+	pdf.write_bytes(b"first")
+	manifest = tmp_path / "manifest.json"
+	state = FileManifest(manifest)
+	assert state.get_result(pdf) is None
+	state.record(pdf, ["A", "a.pdf", ["Naval"], None])
+	state.save()
+
+	state = FileManifest(manifest)
+	assert state.get_result(pdf) == ["A", "a.pdf", ["Naval"], None]
+	# A new mtime with the same contents is still reused, the hash decides.
+	_touch(pdf, 10**18)
+	assert state.get_result(pdf) == ["A", "a.pdf", ["Naval"], None]
+	assert state.entries[str(pdf)]["mtime"] == 10**18
+	state.save()
+	pdf.write_bytes(b"second")
+	assert FileManifest(manifest).get_result(pdf) is None
+
+
+def test_preview_all_incremental(db, tmp_path, monkeypatch):
+	filesdir = tmp_path / "files"
+	filesdir.mkdir()
+	for name in ("a.pdf", "b.pdf"):
+		(filesdir / name).write_bytes(name.encode())
+	analyzed = []
+	previewed = []
+
+	def get_books(directory, extractor, chat, files=None, **kwargs):
+		analyzed.append(sorted(files))
+		return [(f.upper(), f, ["Naval"], None) for f in files]
+
+	monkeypatch.setattr(databaseinterface, "get_books", get_books)
+	monkeypatch.setattr(databaseinterface, "write_actions_to_db",
+		lambda books, *args: previewed.append(sorted(tuple(b[:2]) for b in books)))
+	db.md_extractor = object()
+	manifest = str(tmp_path / "manifest.json")
+
+	db.preview_all(str(filesdir), incremental=True, manifest=manifest)
+	assert analyzed == [["a.pdf", "b.pdf"]]
+	# Touched but unchanged files are reused, and the new mtime is saved.
+	_touch(filesdir / "a.pdf", 10**18)
+	db.preview_all(str(filesdir), incremental=True, manifest=manifest)
+	assert analyzed == [["a.pdf", "b.pdf"]]
+	assert FileManifest(manifest).entries[str(filesdir / "a.pdf")]["mtime"] == 10**18
+	(filesdir / "b.pdf").write_bytes(b"changed")
+	db.preview_all(str(filesdir), incremental=True, manifest=manifest)
+	assert analyzed == [["a.pdf", "b.pdf"], ["b.pdf"]]
+	assert previewed == [[("A.PDF", "a.pdf"), ("B.PDF", "b.pdf")]] * 3
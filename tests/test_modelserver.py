@@ -0,0 +1,66 @@
+import os
+import stat
+import time
+import threading
+
+import pytest
+
+from smartfilelibrary import modelserver
+from smartfilelibrary.modelserver import ModelServer, ModelClient, default_address
+
+
+@pytest.fixture
+def runtime_dir(tmp_path, monkeypatch):
+	monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+	return tmp_path
+
+
+def test_default_address(runtime_dir):
+	address = default_address()
+	assert address == str(runtime_dir / "smartfilelibrary" / "models.sock")
+	assert stat.S_IMODE(os.stat(runtime_dir / "smartfilelibrary").st_mode) == 0o700
+	os.chmod(runtime_dir / "smartfilelibrary", 0o755)
+	with pytest.raises(PermissionError):
+		default_address()
+
+
+def test_check_private(tmp_path):
+	path = tmp_path / "key"
+	path.write_bytes(b"secret")
+	os.chmod(path, 0o600)
+	modelserver._check_private(str(path), stat.S_IFREG)
+	os.chmod(path, 0o640)
+	with pytest.raises(PermissionError):
+		modelserver._check_private(str(path), stat.S_IFREG)
+	os.symlink(path, tmp_path / "link")
+	with pytest.raises(PermissionError):
+		modelserver._check_private(str(tmp_path / "link"), stat.S_IFREG)
+	with pytest.raises(PermissionError):
+		modelserver._check_private(str(tmp_path), stat.S_IFSOCK)
+
+
+def test_serve(runtime_dir):
+	address = default_address()
+	threading.Thread(target=ModelServer().serve_forever, daemon=True).start()
+	for _ in range(100):
+		try:
+			client = ModelClient()
+			break
+		except (FileNotFoundError, ConnectionError):
+			time.sleep(0.05)
+	assert stat.S_IMODE(os.stat(address + ".key").st_mode) == 0o600
+	assert client.call("info") == {}
+	client.close()
+	with pytest.raises(RuntimeError):
+		ModelServer().serve_forever()
+
+
+def test_serve_keeps_foreign_files(runtime_dir):
+	address = default_address()
+	with open(address, "w") as f:
+		f.write("not a socket")
+	with pytest.raises(PermissionError):
+		ModelServer().serve_forever()
+	assert os.path.exists(address)
+	with pytest.raises(PermissionError):
+		ModelClient()
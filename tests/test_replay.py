@@ -0,0 +1,127 @@
+import shutil
+
+import pytest
+
+from smartfilelibrary import DatabaseInterface
+from smartfilelibrary.actionlog import ActionLog, read_frames
+
+TABLES = ("Form", "Publisher", "Book", "File", "Topic", "subtopic_of", "topic_closure",
+	"book_topic")
+
+
+def snapshot(db):
+	"""The rows of all tables, in a defined order."""
+	ret = {}
+	for table in TABLES:
+		db.cur.execute(f"SELECT * FROM {table};")
+		ret[table] = sorted(map(repr, db.cur.fetchall()))
+	return ret
+
+
+def logged(path):
+	return [e for offset, entries in read_frames(path) for e in entries]
+
+
+def fill(db):
+	springer = db.addpublisher("Springer")
+	db.subtopic("Deep Learning", "Transformers")
+	first = db.addbook("Attention", 2017, springer, "research article", ("Transformers",))
+	db.addfile(first, "files/attention.pdf", 15)
+	gone = db.addbook("Obsolete", 1990, springer, "book", ("Naval", "SQL"))
+	db.addfile(gone, "files/obsolete.pdf", 100)
+	db.addbooks_bulk([
+		{"title": "Sea Charts", "year": 2001, "publisher": "Sea Press", "form": "book",
+			"topics": ("Naval Traffic",), "files": [("files/charts.pdf", 40)]},
+		{"title": "Anonymous", "year": None, "publisher": None, "form": "notes", "topics": ()},
+		])
+	db.commit_transaction()
+	# Cascades to book_topic and File, also in the replay.
+	db.execute("DELETE FROM Book WHERE book_id = %s;", (gone,))
+	db.execute("UPDATE Book SET favorite = %s WHERE book_id = %s;", (True, first))
+	db.commit_transaction()
+
+
+def test_replay_round_trip(db, tmp_path):
+	fill(db)
+	expected = snapshot(db)
+	shutil.copy(db.logfile, tmp_path / "backup.sfl")
+
+	db.cleardb()
+	db.commit_transaction()
+	db.executefile(str(tmp_path / "backup.sfl"), chunksize=5)
+	assert snapshot(db) == expected
+	db.cur.execute("SELECT topics_text FROM Book WHERE title = 'Sea Charts';")
+	assert db.cur.fetchone() == ("Naval Traffic",)
+	db.cur.execute("SELECT descendant_name FROM topic_closure WHERE ancestor_name = 'Data Science' "
+		"ORDER BY descendant_name;")
+	assert ("Transformers",) in db.cur.fetchall()
+	# The replayed statements are logged again, after those of cleardb.
+	replayed = logged(str(tmp_path / "backup.sfl"))
+	assert logged(db.logfile)[-len(replayed):] == replayed
+
+
+def test_replay_failure(db, tmp_path):
+	backup = str(tmp_path / "broken.sfl")
+	log = ActionLog(backup)
+	log.statement("INSERT INTO Topic (topic_name) VALUES ('Kept');")
+	log.flush()
+	log.statement("INSERT INTO Topic (topic_name) VALUES ('Rolled Back');")
+	log.statement("INSERT INTO Nowhere VALUES (1);")
+	log.close()
+	with pytest.raises(Exception):
+		db.executefile(backup, chunksize=1)
+	db.cur.execute("SELECT topic_name FROM Topic WHERE topic_name IN ('Kept', 'Rolled Back');")
+	assert db.cur.fetchall() == [("Kept",)]
+	db.cur.execute("SELECT tgname FROM pg_trigger WHERE tgname = ANY(%s) AND tgenabled = 'D';",
+		(list(db.REPLAY_TRIGGERS),))
+	assert db.cur.fetchall() == []
+
+
+def test_rollback_is_not_logged(db, credentials):
+	db.addpublisher("Kept")
+	db.commit_transaction()
+	db.addpublisher("Rolled Back")
+	db.rollback_transaction()
+	assert "rolled back" not in db.publishers_added
+	db.addtopics(("Kept Too",))
+	db.commit_transaction()
+
+	other = DatabaseInterface(*credentials)
+	other.addpublisher("Not Committed")
+	other.finish(commit=False)
+
+	text = repr(logged(db.logfile))
+	assert "kept" in text and "Kept Too" in text
+	assert "rolled back" not in text and "not committed" not in text
+	db.cur.execute("SELECT name FROM Publisher;")
+	assert db.cur.fetchall() == [("kept",)]
+
+
+def test_replay_keeps_ids(db, credentials, tmp_path):
+	fill(db)
+	# Uses up ids that are never logged, the replay must not fill the gap.
+	db.addbook("Rolled Back", None, db.addpublisher("Gone Press"), "book", ())
+	db.rollback_transaction()
+	other = DatabaseInterface(*credentials)
+	theirs = other.addbook("Other Writer", None, None, "notes", ())
+	mine = db.addbook("Mine", None, None, "notes", ())
+	db.commit_transaction()
+	other.finish()
+	assert theirs != mine
+	expected = snapshot(db)
+	shutil.copy(db.logfile, tmp_path / "backup.sfl")
+
+	db.cleardb()
+	db.commit_transaction()
+	db.executefile(str(tmp_path / "backup.sfl"))
+	assert snapshot(db) == expected
+	db.cur.execute("SELECT title FROM Book WHERE book_id = %s;", (theirs,))
+	assert db.cur.fetchone() == ("Other Writer",)
+	# The sequences continue after the replayed ids.
+	db.cur.execute("SELECT MAX(book_id) FROM Book;")
+	top = db.cur.fetchone()[0]
+	assert db.addbook("After", None, None, "notes", ()) == top + 1
+	db.cur.execute("SELECT MAX(pub_id) FROM Publisher;")
+	top = db.cur.fetchone()[0]
+	assert db.addpublisher("After Press") == top + 1
+	db.commit_transaction()
@@ -0,0 +1,19 @@
+import os
+import re
+
+from smartfilelibrary import DatabaseInterface
+
+SETUP_SQL = os.path.join(os.path.dirname(__file__), os.pardir, "setup.sql")
+
+
+def functions(sql):
+	return re.findall(r"CREATE OR REPLACE FUNCTION .*?\$\$ LANGUAGE plpgsql;", sql, re.S)
+
+
+def test_setup_sql_functions():
+	"""setup.sql creates the same trigger functions as cleardb."""
+	with open(SETUP_SQL) as f:
+		sql = f.read()
+	expected = functions(DatabaseInterface.SEARCHSETUP + DatabaseInterface.HIERARCHYSETUP)
+	assert len(expected) > 1
+	assert functions(sql) == expected